@@ -1,22 +1,36 @@
-from fastapi import APIRouter, HTTPException, status, Response, File, UploadFile, Query
+from fastapi import APIRouter, HTTPException, status, Response, File, UploadFile, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select, func, desc, distinct
 from sqlalchemy.orm import aliased
-from app.core.constants import SUBJECT_TO_TAGS
-from app.core.database import SessionDep
+from sqlalchemy.exc import IntegrityError
+from app.core.constants import SUBJECT_TO_TAGS, Achievement, Subject, DifficultyLevel
+from app.core.database import SessionDep, ReadSessionDep, engine, read_engine
 from app.core.models import UserModel, TaskModel, AttemptModel, AuditLogModel, PvPMatchModel
 from app.schemas.admin_schemas import UserAdminRead, AdminDashboardStats, UserAdminUpdate, TaskAdminUpdate, \
     AuditLogRead, AdminUserFullResponse, AdminPvpMatchesHistoryPlayer, BanUserRequest, PromoteUserRequest
 from datetime import datetime, timedelta, timezone
 from app.schemas.task import TaskAdminRead, TaskRead, TaskCreate
-import json
-import csv
-import io
-from app.core.dependencies import AdminDep
+import os
+import tempfile
+from app.core.dependencies import AdminDep, invalidate_user, user_cache
+from app.core.pool_watchdog import pool_watchdog
+from app.core.db_pool import pool_snapshot
+from app.api.pvp import backend as pvp_backend
+from app.core.sql_profiler import sql_stats_snapshot
 from app.utils.changes import calculate_changes
-from app.services.user_stats import calculate_user_stats,calculate_profile_info,calculate_elo_history
-from app.utils.formatters import validate_task_data
+from app.services.user_stats import calculate_user_stats,calculate_profile_info,calculate_elo_history, \
+    check_user_subject_stats, subject_stats_check
+from app.services.task_pool import task_pool
+from app.services.task_catalogue import task_catalogue
+from app.services.task_export import stream_tasks_export, MEDIA_TYPES
+from app.services.task_import import create_import_job, run_import, get_import_job, UPLOAD_CHUNK_SIZE
+from app.services.leaderboard import leaderboard
+from app.services.ai_service import generation_router
+from app.utils.achievments import reevaluate_achievement, reevaluation_status
 router = APIRouter(prefix='/admin', tags=['Админ панель'])
 
+DUPLICATE_TITLE_DETAIL = 'Активная задача с таким названием уже существует'
+
 
 async def log_admin_action(
         session,
@@ -36,7 +50,7 @@ async def log_admin_action(
 
 @router.get('/users', summary='Список всех пользователей (для админов)')
 async def get_all_users(
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep,
         limit: int = 100,
         offset: int = 0
@@ -93,6 +107,8 @@ async def update_user(
         )
 
     await session.commit()
+    invalidate_user(user.id)
+    leaderboard.invalidate()
     return {'message': f'Данные пользователя {user.username} успешно обновлены'}
 
 
@@ -131,6 +147,11 @@ async def set_user_ban_status(
     )
 
     await session.commit()
+    invalidate_user(user.id)
+    if user.is_banned:
+        leaderboard.remove(user.id)
+    else:
+        leaderboard.invalidate()
 
     msg = "Пользователь заблокирован" if data.is_banned else "Пользователь разблокирован"
     return {"message": msg, "user_id": user.id, "is_banned": user.is_banned}
@@ -171,6 +192,7 @@ async def set_user_admin_status(
     )
 
     await session.commit()
+    invalidate_user(user.id)
 
     msg = "Права администратора выданы" if data.is_admin else "Права администратора отозваны"
     return {"message": msg, "user_id": user.id, "is_admin": user.is_admin}
@@ -200,20 +222,19 @@ async def delete_user(
 
     await session.delete(user)
     await session.commit()
+    invalidate_user(user_id)
+    leaderboard.remove(user_id)
 
     return {'message': f'Пользователь {user.username} успешно удален'}
 
 @router.get('/users/{user_id}/full_details',summary='Возвращает полную информацию о пользователе (для админов)',response_model=AdminUserFullResponse)
 async def get_user_full_details(
         user_id: int,
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep
 ) -> AdminUserFullResponse:
 
-    user = await session.get(UserModel, user_id)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Пользователь не найден')
-
+    # calculate_profile_info сам вернет 404, если пользователя нет
     profile_info = await calculate_profile_info(session,user_id)
     subject_stats = await calculate_user_stats(session,user_id)
     elo_history = await calculate_elo_history(session,user_id)
@@ -226,7 +247,7 @@ async def get_user_full_details(
 
 @router.get('/stats', summary='Статистика для дашборда (для админов)')
 async def get_admin_stats(
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep
 ) -> AdminDashboardStats:
     good_time = datetime.now(timezone.utc) - timedelta(hours=24)
@@ -267,7 +288,11 @@ async def create_task(
 
     session.add(task_db)
 
-    await session.flush()
+    try:
+        await session.flush()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=DUPLICATE_TITLE_DETAIL)
 
     await log_admin_action(
         session=session,
@@ -279,138 +304,70 @@ async def create_task(
 
     await session.commit()
     await session.refresh(task_db)
+    task_pool.upsert(task_db)
+    task_catalogue.bump()
 
     return TaskRead.model_validate(task_db)
 
 
-@router.get('/tasks/export', summary='Экспорт задач JSON/CSV (для админов)')
+@router.get('/tasks/export', summary='Экспорт задач JSON/NDJSON/CSV (для админов)')
 async def export_tasks(
-        session: SessionDep,
         admin: AdminDep,
-        export_format: str = Query("json", enum=["json", "csv"], alias="format")
+        export_format: str = Query("json", enum=["json", "ndjson", "csv"], alias="format"),
+        subject: Subject | None = None,
+        difficulty: DifficultyLevel | None = None,
+        updated_since: datetime | None = None,
+        gzip: bool = False
 ):
-
-    tasks = (await session.execute(select(TaskModel).where(TaskModel.is_active == True))).scalars().all()
-
-    data = [TaskAdminRead.model_validate(t).model_dump() for t in tasks]
-
-    if export_format == "json":
-        return Response(
-            content=json.dumps(data, ensure_ascii=False, indent=4),
-            media_type='application/json',
-            headers={'Content-Disposition': 'attachment; filename="tasks.json"'}
-        )
-
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=data[0].keys() if data else [])
-    writer.writeheader()
-
-    for row in data:
-        row['tags'] = ", ".join(row['tags']) if isinstance(row['tags'], list) else ""
-        writer.writerow(row)
-
-    content = output.getvalue().encode('utf-8-sig')
-
-    return Response(
-        content=content,
-        media_type='text/csv',
-        headers={'Content-Disposition': 'attachment; filename="tasks_export.csv"'}
+    filename = 'tasks_export.csv' if export_format == 'csv' else f'tasks.{export_format}'
+    media_type = MEDIA_TYPES[export_format]
+    if gzip:
+        filename += '.gz'
+        media_type = 'application/gzip'
+
+    return StreamingResponse(
+        stream_tasks_export(export_format, subject, difficulty, updated_since, gzip),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
 
 
-
-
-
 @router.post('/tasks/import', summary='Импорт задач JSON/CSV (для админов)')
 async def import_tasks(
-        session: SessionDep,
         admin: AdminDep,
+        background_tasks: BackgroundTasks,
         file: UploadFile = File(...)
 ):
-    content = await file.read()
-    raw_data = []
-
-    try:
-        if file.filename.endswith('.json'):
-            raw_data = json.loads(content)
-        elif file.filename.endswith('.csv'):
-            decoded_content = content.decode('utf-8-sig')  # utf-8-sig лечит BOM
-            f = io.StringIO(decoded_content)
-            reader = csv.DictReader(f)
-            for row in reader:
-                if 'tags' in row and row['tags']:
-                    row['tags'] = [t.strip() for t in row['tags'].split(',')]
-                else:
-                    row['tags'] = []
-                raw_data.append(row)
-        else:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail="Поддерживаются только .json и .csv файлы")
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Ошибка при чтении файла: {str(e)}")
-
-    if not isinstance(raw_data, list):
+    if not file.filename.endswith(('.json', '.csv')):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail='Неверная структура данных: ожидался список задач')
+                            detail="Поддерживаются только .json и .csv файлы")
 
-    incoming_titles = [item.get("title") for item in raw_data if item.get("title")]
-    query = select(TaskModel).where(TaskModel.title.in_(incoming_titles), TaskModel.is_active == True)
-    result = await session.execute(query)
-    existing_tasks = {t.title: t for t in result.scalars().all()}
-
-    created_count = 0
-    updated_count = 0
-
-    for index, item in enumerate(raw_data):
-        validated_data = validate_task_data(index, item)
-
-        if not validated_data:
-            continue
-
-        title = validated_data['title']
-
-        if title in existing_tasks:
-            task = existing_tasks[title]
-            task.description = validated_data["description"]
-            task.subject = validated_data["subject"]
-            task.tags = validated_data["tags"]
-            task.hint = validated_data["hint"]
-            task.difficulty = validated_data["difficulty"]
-            task.correct_answer = validated_data["correct_answer"]
-            updated_count += 1
-        else:
-            new_task = TaskModel(
-                title=title,
-                description=validated_data["description"],
-                subject=validated_data["subject"],
-                tags=validated_data["tags"],
-                hint=validated_data["hint"],
-                difficulty=validated_data["difficulty"],
-                correct_answer=validated_data["correct_answer"]
-            )
-            session.add(new_task)
-            created_count += 1
+    # файл целиком в память не читаем: сбрасываем на диск кусками и разбираем уже в фоне
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            tmp.write(chunk)
 
-    await log_admin_action(
-        session=session,
-        admin_id=admin.id,
-        action="import_tasks",
-        details=f"File: {file.filename}. Created: {created_count}, Updated: {updated_count}"
-    )
+    job_id = await create_import_job(file.filename, admin.id)
+    background_tasks.add_task(run_import, job_id, file.filename, tmp.name, admin.id)
 
-    await session.commit()
+    return {"job_id": job_id, "status": "running"}
 
-    return {
-        "message": "Импорт завершен успешно",
-        "created": created_count,
-        "updated": updated_count
-    }
+
+@router.get('/tasks/import/{job_id}', summary='Ход импорта задач (для админов)',
+            description='Ход импорта хранится в task_import_jobs, опрашивать можно любой воркер. '
+                        'Если воркер, который вел импорт, перезапустился посреди импорта, статус останется running')
+async def get_import_status(job_id: str, session: SessionDep, admin: AdminDep):
+    # читаем с primary: реплика может отставать от только что записанного прогресса
+    job = await get_import_job(session, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Импорт не найден")
+    return job
 
 
 @router.get('/tasks/{task_id}/get', summary='Получить полную задачу с ответом (для админов)')
 async def get_admin_task_details(
         task_id: int,
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep
 ) -> TaskAdminRead:
     task = await session.get(TaskModel, task_id)
@@ -444,6 +401,8 @@ async def delete_task(
 
     session.add(task)
     await session.commit()
+    task_pool.discard(task_id)
+    task_catalogue.bump()
 
     return {'message': f'Задача #{task_id} успешно удалена'}
 
@@ -487,15 +446,107 @@ async def update_task(
             details=changes_log
         )
 
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=DUPLICATE_TITLE_DETAIL)
     await session.refresh(task)
+    task_pool.upsert(task)
+    task_catalogue.bump()
 
     return TaskRead.model_validate(task)
 
 
+@router.get('/db_pool', summary='Статистика пула соединений с БД (для админов)')
+async def get_db_pool_stats(admin: AdminDep):
+    stats = {'primary': pool_snapshot(engine.sync_engine.pool)}
+    if read_engine is not engine:
+        stats['replica'] = pool_snapshot(read_engine.sync_engine.pool)
+    pvp_pool = getattr(pvp_backend, 'pool', None)
+    if pvp_pool is not None:  # PVP_BACKEND=postgres: свой пул asyncpg и соединение LISTEN
+        stats['pvp'] = {
+            'max_size': pvp_pool.get_max_size(),
+            'size': pvp_pool.get_size(),
+            'checked_out': pvp_pool.get_size() - pvp_pool.get_idle_size(),
+            'listener': 1,
+        }
+    return stats
+
+
+@router.get('/sql_stats', summary='SQL-запросы и время в БД по маршрутам (для админов)',
+            description='Заполняется только при SQL_PROFILING=true')
+async def get_sql_stats(admin: AdminDep):
+    return sql_stats_snapshot()
+
+
+@router.get('/db_connections', summary='Долго удерживаемые соединения из пула (для админов)')
+async def get_db_connections(admin: AdminDep):
+    return pool_watchdog.snapshot()
+
+
+@router.get('/cache_stats', summary='Статистика кешей (для админов)')
+async def get_cache_stats(admin: AdminDep):
+    return {'users': user_cache.stats(), 'task_catalogue': task_catalogue.cache.stats()}
+
+
+@router.get('/ai_routes', summary='Состояние пар (ключ, модель) генерации задач (для админов)')
+async def get_ai_routes(admin: AdminDep):
+    return generation_router.snapshot()
+
+
+@router.post('/achievements/{achievement}/reevaluate', summary='Выдать достижение всем подходящим пользователям (для админов)')
+async def reevaluate_achievement_for_all(
+        achievement: Achievement,
+        session: SessionDep,
+        admin: AdminDep,
+        background_tasks: BackgroundTasks
+):
+    job = reevaluation_status.get(achievement.value)
+    if job and not job['finished']:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Перепроверка этого достижения уже идет')
+
+    await log_admin_action(
+        session=session,
+        admin_id=admin.id,
+        action="reevaluate_achievement",
+        details=f"Achievement: {achievement.value}"
+    )
+    await session.commit()
+
+    reevaluation_status[achievement.value] = {'processed': 0, 'awarded': 0, 'finished': False}
+    background_tasks.add_task(reevaluate_achievement, achievement)
+    return {'message': f'Перепроверка достижения {achievement.label} запущена'}
+
+
+@router.get('/achievements/reevaluate_status', summary='Ход перепроверки достижений (для админов)')
+async def get_reevaluation_status(admin: AdminDep):
+    return reevaluation_status
+
+
+@router.post('/user_subject_stats/check', summary='Сверить статистику по предметам с попытками (для админов)')
+async def check_subject_stats(
+        admin: AdminDep,
+        background_tasks: BackgroundTasks,
+        fix: bool = False
+):
+    if subject_stats_check and not subject_stats_check['finished']:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Сверка уже идет')
+
+    subject_stats_check.clear()
+    subject_stats_check.update({'checked': 0, 'mismatched': 0, 'fixed': 0, 'finished': False})
+    background_tasks.add_task(check_user_subject_stats, fix)
+    return {'message': 'Сверка запущена'}
+
+
+@router.get('/user_subject_stats/check', summary='Результат сверки статистики по предметам (для админов)')
+async def get_subject_stats_check(admin: AdminDep):
+    return subject_stats_check
+
+
 @router.get('/stats/most_popular_subject', summary='Самый популярный предмет (для админов)')
 async def get_most_popular_subject(
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep,
 ):
     query = (
@@ -515,7 +566,7 @@ async def get_most_popular_subject(
 
 @router.get('/logs',summary='Логи действий админов (для админов)',response_model=list[AuditLogRead])
 async def get_logs(
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep,
         limit: int = 20,
         offset: int = 0
@@ -544,7 +595,7 @@ async def get_logs(
 
 @router.get('/pvp_matches_history', summary='История матчей всех пользователей (для админов)')
 async def get_pvp_matches_history(
-        session: SessionDep,
+        session: ReadSessionDep,
         admin: AdminDep,
         limit: int = 20,
         offset: int = 0
@@ -6,8 +6,8 @@ from typing import Annotated
 
 from app.core.database import SessionDep
 from app.core.models import UserModel
-from app.core.security import get_password_hash, is_password_correct, create_access_token, create_refresh_token, \
-    verify_refresh_token
+from app.core.security import get_password_hash_async, is_password_correct_async, create_access_token, \
+    create_refresh_token, verify_refresh_token
 from app.schemas.user import UserRegister,Token
 
 router=APIRouter(prefix='/auth',tags=['Авторизация'])
@@ -16,7 +16,7 @@ router=APIRouter(prefix='/auth',tags=['Авторизация'])
 @router.post('/register',summary='Регистрация',status_code=status.HTTP_201_CREATED)
 async def register_user(new_user: UserRegister,session: SessionDep):
 
-    hashed_pass=get_password_hash(new_user.password.get_secret_value())
+    hashed_pass=await get_password_hash_async(new_user.password.get_secret_value())
 
     user_db=UserModel(
         username=new_user.username,
@@ -44,7 +44,7 @@ async def login_user(
     query=select(UserModel).where(UserModel.username == str(form_data.username))
     result=await session.execute(query)
     user=result.scalar_one_or_none()
-    if not user or not is_password_correct(form_data.password,user.hashed_password):
+    if not user or not await is_password_correct_async(form_data.password,user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Неверное имя пользователя или пароль!',
@@ -1,38 +1,42 @@
-from fastapi import APIRouter, Query
-from app.core.database import SessionDep
-from sqlalchemy import select
-from app.core.models import UserModel
-from app.schemas.user import LeaderboardPlayer
-from app.utils.levels import calculate_level_info
+from fastapi import APIRouter, Query, Response, HTTPException, status
+from app.core.dependencies import UserDep
+from app.schemas.user import LeaderboardPlayer, LeaderboardPosition
+from app.services.leaderboard import leaderboard
 
 router = APIRouter(prefix='/leaderboard',tags=['Таблица лидеров'])
 
-@router.get('/',summary='Таблица лидеров',description='Вывод первых 10 пользователей с наибольшим рейтингом')
+@router.get('/',summary='Таблица лидеров',description='Вывод первых 10 пользователей с наибольшим рейтингом',
+            response_model=list[LeaderboardPlayer])
 async def get_leaderboard(
-        session: SessionDep,
         limit: int = Query(default=10,gt=0,le=100)
-) -> list[LeaderboardPlayer]:
+):
+    # рейтинг меняется только после матчей, топ хранится уже сериализованным
+    return Response(content=await leaderboard.top(limit), media_type='application/json')
 
-    query=(select(UserModel)
-           .where(UserModel.is_banned==False)
-           .order_by(UserModel.rating.desc())
-           .limit(limit)
-    )
-    result = await session.execute(query)
-    users = result.scalars().all()
 
-    response_list =[]
+@router.get('/me',summary='Мое место в таблице лидеров',description='Место пользователя и соседи выше и ниже по рейтингу')
+async def get_my_position(
+        current_user: UserDep,
+        radius: int = Query(default=2,ge=0,le=10)
+) -> LeaderboardPosition:
+
+    await leaderboard.ensure_loaded()
 
-    for user in users:
-        level = calculate_level_info(user.xp)['level']
+    position = leaderboard.position(current_user.id)
+    if position is None:
+        # зарегистрировался после последней загрузки рейтинга
+        leaderboard.add(current_user)
+        position = leaderboard.position(current_user.id)
 
-        data=LeaderboardPlayer(
-            username=user.username,
-            rating=round(float(user.rating),1),
-            rank=user.user_rank,
-            level=level,
-            avatar_url=user.avatar_url,
-        )
-        response_list.append(data)
+    if position is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Пользователь не участвует в рейтинге')
 
-    return response_list
+    above, below = leaderboard.around(position, radius)
+
+    return LeaderboardPosition(
+        position=position,
+        total=len(leaderboard),
+        player=leaderboard.players[current_user.id].to_schema(),
+        above=above,
+        below=below,
+    )
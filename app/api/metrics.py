@@ -0,0 +1,47 @@
+import secrets
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from app.core.config import settings
+from app.core.database import engine, read_engine
+from app.utils.metrics import Counter, Gauge, collectors, render_metrics
+from app.api.pvp import backend as pvp_backend
+
+router = APIRouter(tags=['Система'])
+
+db_pool_size = Gauge('db_pool_size', 'Размер пула соединений', ('pool',))
+db_pool_checked_out = Gauge('db_pool_checked_out', 'Соединений выдано из пула', ('pool',))
+db_pool_overflow = Gauge('db_pool_overflow', 'Соединений сверх pool_size', ('pool',))
+db_pool_acquires = Counter('db_pool_acquires_total', 'Получений соединения из пула', ('pool',))
+db_pool_timeouts = Counter('db_pool_timeouts_total', 'Таймаутов ожидания соединения', ('pool',))
+db_pool_wait = Counter('db_pool_wait_seconds_total', 'Суммарное ожидание соединения из пула', ('pool',))
+
+
+async def collect_db_pool():
+    pools = [('primary', engine)]
+    if read_engine is not engine:
+        pools.append(('replica', read_engine))
+
+    for name, pool_engine in pools:
+        pool = pool_engine.sync_engine.pool
+        db_pool_size.set(pool.size(), name)
+        db_pool_checked_out.set(pool.checkedout(), name)
+        db_pool_overflow.set(max(pool.overflow(), 0), name)
+        db_pool_acquires.set_total(pool.stats.acquired, name)
+        db_pool_timeouts.set_total(pool.stats.timeouts, name)
+        db_pool_wait.set_total(pool.stats.wait_total, name)
+
+    # отдельный пул asyncpg очереди PvP (PVP_BACKEND=postgres), плюс соединение LISTEN
+    pvp_pool = getattr(pvp_backend, 'pool', None)
+    if pvp_pool is not None:
+        db_pool_size.set(pvp_pool.get_max_size() + 1, 'pvp')
+        db_pool_checked_out.set(pvp_pool.get_size() - pvp_pool.get_idle_size() + 1, 'pvp')
+
+collectors.append(collect_db_pool)
+
+
+@router.get('/metrics', summary='Метрики в формате Prometheus', include_in_schema=False)
+async def get_metrics(authorization: str | None = Header(default=None)):
+    if settings.METRICS_TOKEN and not secrets.compare_digest(authorization or '', f'Bearer {settings.METRICS_TOKEN}'):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Неверный токен метрик')
+
+    return PlainTextResponse(await render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
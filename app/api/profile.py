@@ -1,18 +1,20 @@
 from pathlib import Path
 from fastapi import APIRouter, UploadFile, File, HTTPException,status
-from app.core.database import SessionDep
-from app.core.dependencies import UserDep
+from app.core.database import SessionDep, ReadSessionDep
+from app.core.dependencies import UserDep, invalidate_user
 from app.core.models import UserModel
 from app.schemas.user import UserStatsResponse, UserProfileRead, NewUserName
 import uuid
 from app.schemas.user import EloHistoryPoint
-from app.utils.achievments import check_and_award_achievement
+from app.utils.achievments import find_new_achievements, append_achievements
+from app.core.constants import AchievementCounter
 import os
-from PIL import Image, ImageOps
-from pillow_heif import register_heif_opener
+from app.services.avatar_service import (
+    AvatarTooLarge, MAIN_AVATAR_SIZE, MAX_AVATAR_BYTES, avatar_files, process_avatar_async
+)
 from app.services.user_stats import calculate_user_stats, calculate_elo_history
 from app.services.user_stats import calculate_profile_info
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
 from sqlalchemy.exc import IntegrityError
 IS_PROD = os.getenv('VITE_IS_PROD') == 'true'
 
@@ -20,15 +22,16 @@ router = APIRouter(prefix='/profile',tags=['Профиль'])
 
 @router.get('/',summary='Профиль пользователя',description='Возвращает данные пользователя и его статистику в одном структурированном ответе.')
 async def get_my_profile(
-        session: SessionDep,
+        session: ReadSessionDep,
         current_user: UserDep
 ) -> UserProfileRead:
 
     return await calculate_profile_info(session, current_user.id)
 
 
-register_heif_opener()
 ALLOWED_AVATAR_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'heic', 'heif'}
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+static_dir = Path(__file__).resolve().parent.parent.parent / "static" / "avatars"
 
 @router.post('/avatar', summary='Загрузить аватарку')
 async def upload_avatar(
@@ -53,54 +56,75 @@ async def upload_avatar(
             detail=f'Формат {ext} не поддерживается. Разрешены: {", ".join(ALLOWED_AVATAR_EXTENSIONS)}'
         )
 
-    if current_user.avatar_url:
-        old_path = current_user.avatar_url.replace('/api/', '').lstrip('/')
-        if os.path.exists(old_path):
-            try:
-                os.remove(old_path)
-            except Exception as e:
-                print(f"Ошибка удаления старого файла: {e}")
-
-    ext = 'jpg'
+    data = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        data += chunk
+        if len(data) > MAX_AVATAR_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f'Файл больше {MAX_AVATAR_BYTES // (1024 * 1024)} МБ'
+            )
 
-    file_name = f"user_{current_user.id}_{uuid.uuid4().hex}.{ext}"
-    base_dir = Path(__file__).resolve().parent.parent.parent
-    static_dir = base_dir / "static" / "avatars"
+    file_stem = f"user_{current_user.id}_{uuid.uuid4().hex}"
     static_dir.mkdir(parents=True, exist_ok=True)
-    file_disk_path = static_dir / file_name
 
     try:
-        image = Image.open(file.file)
-
-        image = ImageOps.exif_transpose(image)
-
-        if image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
-
-        image.save(file_disk_path, "JPEG", quality=85)
-
+        await process_avatar_async(bytes(data), str(static_dir), file_stem)
+    except AvatarTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='Слишком большое разрешение изображения')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка обработки изображения: {e}")
 
     prefix = "/api" if IS_PROD else ""
-    generated_url = f"{prefix}/static/avatars/{file_name}"
-
-    current_user.avatar_url = generated_url
-    session.add(current_user)
-
-    new_badges = await check_and_award_achievement(current_user, session)
+    generated_url = f"{prefix}/static/avatars/{file_stem}_{MAIN_AVATAR_SIZE}.jpg"
+
+    # пользователь мог прийти из кеша: пишем точечным UPDATE, а старый url берем из самой строки
+    old_row = (
+        select(UserModel.id, UserModel.avatar_url)
+        .where(UserModel.id == current_user.id)
+        .with_for_update()
+        .subquery('old_row')
+    )
+    new_badges = find_new_achievements(current_user, {AchievementCounter.HAS_AVATAR: 1})
+    user_values = {'avatar_url': generated_url}
+    if new_badges:
+        user_values['all_achievements'] = append_achievements(new_badges)
+
+    update_query = (
+        update(UserModel)
+        .where(UserModel.id == old_row.c.id)
+        .values(**user_values)
+        .returning(old_row.c.avatar_url)
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(update_query)
+    old_url_row = result.one_or_none()
+    if old_url_row is None:
+        for new_path in avatar_files(generated_url, str(static_dir)):
+            if os.path.exists(new_path):
+                os.remove(new_path)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Пользователь не найден')
     await session.commit()
+    invalidate_user(current_user.id)
+
+    # старые файлы удаляем только после того, как новая ссылка записана
+    for old_path in avatar_files(old_url_row.avatar_url, str(static_dir)):
+        if os.path.exists(old_path):
+            try:
+                os.remove(old_path)
+            except Exception as e:
+                print(f"Ошибка удаления старого файла: {e}")
 
     return {
         'url': generated_url,
-        'achievements': new_badges,
+        'achievements': [a.label for a in new_badges],
     }
 
 
 @router.get('/stats', summary='Детальная статистика по предметам')
 async def get_user_stats(
         current_user: UserDep,
-        session: SessionDep,
+        session: ReadSessionDep,
 ) -> UserStatsResponse:
 
     return await calculate_user_stats(session, current_user.id)
@@ -108,7 +132,7 @@ async def get_user_stats(
 
 @router.get('/elo_history',summary='История рейтинга для графика в профиле')
 async def get_elo_history(
-    session: SessionDep,
+    session: ReadSessionDep,
     current_user: UserDep,
     limit: int = 50
 ) -> list[EloHistoryPoint]:
@@ -139,6 +163,7 @@ async def change_name(
     except IntegrityError:
         await session.rollback()
         raise HTTPException(status_code=409, detail="К сожалению, этот никнейм уже заняли в эту секунду")
+    invalidate_user(user.id)
 
     return {"message": f"Имя пользователя успешно изменено с {old_username} на {data.new_username}",
             "new_username": data.new_username}
\ No newline at end of file
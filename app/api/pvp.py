@@ -1,69 +1,109 @@
 from fastapi import APIRouter, WebSocket, Query
 import asyncio
 import jwt
-from sqlalchemy import select, func, or_
+from sqlalchemy import select, or_
 from sqlalchemy.orm import aliased
-from app.core.dependencies import UserDep
-from app.schemas.matchmaking import QueueEntry, MessageEvent, MatchHistoryItem
-from app.core.database import SessionDep
+from app.core.dependencies import UserDep, AdminDep, load_user
+from app.schemas.matchmaking import QueueEntry, MessageEvent, MatchHistoryItem, MatchSettlement
+from app.core.database import SessionDep, ReadSessionDep
 from app.core.config import settings
-from app.core.models import UserModel, TaskModel, PvPMatchModel, EloHistoryModel
-from app.utils.elo import calculate_elo_change, change_elo, WIN, LOSS, DRAW
+from app.core.models import UserModel, PvPMatchModel
+from app.utils.elo import calculate_elo_change, settle_match, WIN, LOSS, DRAW
 from app.utils.formatters import format_answer
 import time
-import bisect
-from app.core.database import new_session
 from fastapi.responses import HTMLResponse
-from collections import defaultdict, deque
+from collections import deque
 from app.utils.elo import ELO_RANKS
+from app.services.pvp_backend import create_pvp_backend
+from app.services.task_pool import task_pool
+from app.utils.rate_limiter import SlidingWindowLimiter
+from app.utils.metrics import Counter, Gauge, Histogram, collectors
 
 ALGORITHM = settings.ALGORITHM
 SECRET_KEY = settings.SECRET_KEY
 
 pending_reconnects = {}  # user_id -> asyncio.Future
-is_connected = defaultdict(
-    bool)  # для отслеживания подключенных пользователей т.к. в fastapi'ной имплементации вебсокетов нельзя проверить отключился ли пользователь
-is_in_match = defaultdict(bool)  # user_id
-queue = []  # комната ожидания, отсортирована по рейтингу
-index = dict()  # словарь user_id-QueueEntry
-_queue_lock = asyncio.Lock()
+reconnect_slot_ready = {}  # user_id -> asyncio.Event, сигнал что матч открыл слот для реконнекта
+connections = {}  # user_id -> PlayerConnection, текущее соединение пользователя
+backend = create_pvp_backend()  # очередь поиска и занятые игроки (в памяти процесса или общие через PostgreSQL)
+_matchmaking_wakeup = asyncio.Event()
+time_to_match = deque(maxlen=1000)  # время поиска (сек) последних подобранных игроков
+answer_limiter = SlidingWindowLimiter(limit=3, window=10)  # не больше 3 ответов за 10 секунд
+SWEEP_INTERVAL = 3  # период полного прохода по очереди (расширение окна эло для долго ждущих)
+
+pvp_queue_length = Gauge('pvp_queue_length', 'Игроков в очереди поиска')
+pvp_active_matches = Gauge('pvp_active_matches', 'Матчей идет на этом воркере')
+pvp_active_matches.set(0)
+pvp_time_to_match = Histogram('pvp_time_to_match_seconds', 'Время поиска соперника',
+                              buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300))
+pvp_reconnect_attempts = Counter('pvp_reconnect_attempts_total', 'Дисконнекты игроков во время матча')
+pvp_reconnect_successes = Counter('pvp_reconnect_successes_total', 'Успешные переподключения к матчу')
+pvp_matches_total = Counter('pvp_matches_total', 'Завершенные матчи по результату', ('result',))
 
 router = APIRouter(prefix='/pvp', tags=['PVP'])
 
 
+class PlayerConnection:
+    """
+    Жизненный цикл вебсокета в /pvp/join.
+
+    Обработчик не может вернуться раньше времени (fastapi закроет сокет), поэтому он ждёт
+    событие, которое выставляет матч по завершении, при дисконнекте или при замене соединения.
+    """
+
+    def __init__(self, user_id: int, websocket: WebSocket):
+        self.user_id = user_id
+        self.websocket = websocket
+        self._released = asyncio.Event()
+
+    @property
+    def released(self) -> bool:
+        return self._released.is_set()
+
+    def release(self):
+        self._released.set()
+
+    async def wait_released(self):
+        await self._released.wait()
+
+
+def register_connection(user_id: int, websocket: WebSocket) -> PlayerConnection:
+    conn = PlayerConnection(user_id, websocket)
+    old = connections.get(user_id)
+    connections[user_id] = conn
+    if old is not None:  # старый сокет больше не нужен, отпускаем его обработчик
+        old.release()
+    return conn
+
+
+def release_connection(user_id: int):
+    conn = connections.pop(user_id, None)
+    if conn is not None:
+        conn.release()
+
+
+def forget_connection(conn: PlayerConnection):
+    # удаляем из реестра только своё соединение, а не более новое
+    if connections.get(conn.user_id) is conn:
+        del connections[conn.user_id]
+
+
 async def add_player(entry: QueueEntry):
-    async with _queue_lock:
-        old = index.get(entry.user_id)
-        if old is not None:  # если уже в очереди
-            # закрываем старый вебсокет
-            try:
-                await old._ws.send_text("opponent disconnected")
-                await old._ws.close()
-            except Exception:
-                pass
-            queue.remove(old)
-            del index[old.user_id]
-        idx = bisect.bisect_left(queue, entry)  # ищем куда вставить чтобы не поломать сортировку
-        queue.insert(idx, entry)
-        index[entry.user_id] = entry
+    await backend.add_player(entry)
 
 
 async def remove_player(entry: QueueEntry):
     print('removing', entry)
-    async with _queue_lock:
-        if entry.user_id not in index:
-            return
-        queue.remove(entry)
-        del index[entry.user_id]
-    print('removed')
+    if await backend.remove_player(entry):
+        print('removed')
 
 
 @router.websocket('/join')  # начать поиск оппонента
-async def join_match(session: SessionDep, websocket: WebSocket):
+async def join_match(websocket: WebSocket):
     await websocket.accept()
     await websocket.send_text("Connected")
     entry = None
-    user = None  # Инициализируем user, чтобы в блоке except можно было проверить user.id
+    conn = None
 
     try:
         token = await websocket.receive_text()
@@ -76,9 +116,8 @@ async def join_match(session: SessionDep, websocket: WebSocket):
             await websocket.close()
             return
 
-        query = select(UserModel).where(UserModel.id == int(tokenData['sub']))
-        result = await session.execute(query)
-        user = result.scalar_one_or_none()
+        # без SessionDep: сессия запроса держала бы соединение из пула всё время поиска и матча
+        user = await load_user(int(tokenData['sub']))
 
         if not user:
             await websocket.close()
@@ -91,63 +130,68 @@ async def join_match(session: SessionDep, websocket: WebSocket):
         )
         entry._ws = websocket
 
-        # === ЛОГИКА РЕКОННЕКТА (ИЗМЕНЕНО) ===
+        # === ЛОГИКА РЕКОННЕКТА ===
 
         # 1. Если пользователь числится в матче, но слот для реконнекта еще не готов (Race Condition при F5)
-        if is_in_match[user.id] and user.id not in pending_reconnects:
-            # Ждем немного (до 3 сек), пока цикл матча поймет, что старый сокет отвалился
-            for _ in range(30):
-                if user.id in pending_reconnects:
-                    break
-                await asyncio.sleep(0.1)
+        in_match = await backend.is_in_match(user.id)
+
+        # 0. Матч идёт на другом воркере -> сокет остаётся здесь и проксируется туда
+        if in_match and await backend.hosted_elsewhere(user.id):
+            conn = register_connection(user.id, websocket)
+            await backend.forward_reconnect(user.id, websocket)
+            await conn.wait_released()
+            forget_connection(conn)
+            return
+
+        if in_match and user.id not in pending_reconnects:
+            # Ждем (до 3 сек), пока цикл матча поймет, что старый сокет отвалился и откроет слот
+            slot_ready = reconnect_slot_ready.setdefault(user.id, asyncio.Event())
+            try:
+                await asyncio.wait_for(slot_ready.wait(), timeout=3)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if reconnect_slot_ready.get(user.id) is slot_ready:
+                    del reconnect_slot_ready[user.id]
 
         # 2. Если слот для реконнекта существует -> подключаем к текущему матчу
         if user.id in pending_reconnects:
+            conn = register_connection(user.id, websocket)
             try:
                 # Передаем новый вебсокет в ожидающую Future
                 pending_reconnects[user.id].set_result(websocket)
             except Exception:
                 pass
 
-            is_connected[user.id] = True
-
-            # Держим соединение открытым, пока цикл матча не завершится или юзер не выйдет
-            while is_connected[user.id]:
-                await asyncio.sleep(5)
-
-            # Удаляем флаг подключения только при выходе
-            if user.id in is_connected:
-                del is_connected[user.id]
+            # Держим соединение открытым, пока матч не завершится или соединение не заменят
+            await conn.wait_released()
+            forget_connection(conn)
             return
 
-        async with _queue_lock:
-            if is_in_match[entry.user_id]:
-                try:
-                    await websocket.send_text(f"already in a match")
-                    await websocket.close()
-                    return
-                except Exception as e:
-                    print('pvp join is_in_match  ', e)
+        if await backend.is_in_match(entry.user_id):
+            try:
+                await websocket.send_text(f"already in a match")
+                await websocket.close()
+                return
+            except Exception as e:
+                print('pvp join is_in_match  ', e)
 
         await add_player(entry)
-        is_connected[entry.user_id] = True
+        conn = register_connection(entry.user_id, websocket)
         await websocket.send_text(f"Search started")
 
-        # если функция завершится, то она закроет соединение, поэтому ждём пока пользователь отключится
-        while is_connected[entry.user_id]:
-            await asyncio.sleep(10)
-
-        # убираем чтобы не тратить память зря
-        if user.id in is_connected:
-            del is_connected[entry.user_id]
+        # если функция завершится, то она закроет соединение, поэтому ждём пока матч или новое соединение нас не отпустит
+        await conn.wait_released()
+        forget_connection(conn)
 
     except Exception as e:
         print('/pvp/join error:', e)
         if entry is not None:
             await remove_player(entry)
         try:
-            if user:
-                is_connected[user.id] = False
+            if conn is not None:
+                conn.release()
+                forget_connection(conn)
             await websocket.close()
         except Exception as e:
             pass
@@ -181,6 +225,12 @@ async def wait_for_reconnect(user_id: int, timeout: float):
     loop = asyncio.get_running_loop()
     fut = loop.create_future()
     pending_reconnects[user_id] = fut
+    early = backend.take_early_reconnect(user_id)
+    if early is not None:  # игрок переподключился к другому воркеру раньше, чем мы открыли слот
+        fut.set_result(early)
+    slot_ready = reconnect_slot_ready.get(user_id)
+    if slot_ready is not None:  # новый сокет уже ждёт слот в /pvp/join
+        slot_ready.set()
     try:
         # ждём пока пользователь переподключится
         new_ws = await asyncio.wait_for(fut, timeout=timeout)
@@ -195,8 +245,6 @@ async def wait_for_reconnect(user_id: int, timeout: float):
 async def start_match(player1: QueueEntry, player2: QueueEntry):
     tasktime = 120  # время в секундах на выполнение задачи
     numtasks = 3  # количество задач
-    max_cons_ans = 3  # максимальное количество ответов подряд
-    ans_window = 10
     reconnect_timeout = 10
 
     ws1 = player1._ws
@@ -211,42 +259,36 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
             return False
 
     if not await safe_ping(ws1):
-        is_connected[player1.user_id] = False
-        async with _queue_lock:
-            is_in_match[player1.user_id] = False
-            is_in_match[player2.user_id] = False
+        release_connection(player1.user_id)
+        await backend.finish_match(player1.user_id, player2.user_id)
         await add_player(player2)
         return
 
     if not await safe_ping(ws2):
-        is_connected[player2.user_id] = False
-        async with _queue_lock:
-            is_in_match[player1.user_id] = False
-            is_in_match[player2.user_id] = False
+        release_connection(player2.user_id)
+        await backend.finish_match(player1.user_id, player2.user_id)
         await add_player(player1)
         return
 
+    pvp_active_matches.inc()
     try:
         await ws1.send_text(f"match started")
         await ws2.send_text(f"match started")
-        # выбираем рандомные задачи
-        async with new_session() as session:
-            query = select(TaskModel).where(TaskModel.is_active == True).order_by(func.random()).limit(numtasks)
-            res = await session.execute(query)
-            tasks = res.all()
+        # выбираем рандомные задачи из пула в памяти, ответы там уже прогнаны через format_answer
+        correct_answers = await task_pool.sample(numtasks)
 
-        if len(tasks) != numtasks:
+        if len(correct_answers) != numtasks:
             await ws1.send_text(f"нет задач")
             await ws2.send_text(f"нет задач")
             return
 
-        task_ids = [task[0].id for task in tasks]
-        correct_answers = {task[0].id: format_answer(task[0].correct_answer) for task in tasks}
-        is_answered = {task[0].id: False for task in tasks}
-        answer_times = {player1.user_id: deque(), player2.user_id: deque()}
+        task_ids = list(correct_answers)
+        is_answered = {task_id: False for task_id in task_ids}
 
         # ответы обоих игроков добавляются в очередь и обрабатываются по порядку
         messages = asyncio.Queue()
+        answer_limiter.reset(player1.user_id)
+        answer_limiter.reset(player2.user_id)
 
         # ждём ответы
         t1 = asyncio.create_task(listen_messages(player1, messages))
@@ -306,11 +348,13 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
                         discplayer = player2
 
                     print(f"Player {discplayer.user_id} disconnected. Waiting for reconnect...")
+                    pvp_reconnect_attempts.inc()
 
                     # ждём пока игрок переподключится
                     new_ws = await wait_for_reconnect(discplayer.user_id, timeout=reconnect_timeout)
 
                     if new_ws:
+                        pvp_reconnect_successes.inc()
                         # заменяем ws на новый
                         discplayer._ws = new_ws
                         # Перезапускаем слушатель для этого игрока
@@ -356,24 +400,16 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
 
                 ans = msg
 
-                times = answer_times[ans.user_id]
-
-                # убираем старые ответы
-                while times and now - times[0] > ans_window:
-                    times.popleft()
-
                 # Определяем кому слать ответ
                 current_ws = ws1 if ans.user_id == player1.user_id else ws2
 
-                if len(times) >= max_cons_ans:
+                if answer_limiter.hit(ans.user_id):
                     try:
-                        await current_ws.send_text(f"please wait {ans_window} seconds between answers")
+                        await current_ws.send_text(f"please wait {answer_limiter.window} seconds between answers")
                     except:
                         pass
                     continue
 
-                times.append(now)
-
                 if correct_answers[task_id] == format_answer(ans.text):
                     if ans.user_id == player1.user_id:
                         anscnt1 += 1
@@ -412,38 +448,21 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
             elochange = calculate_elo_change(player1.rating, player2.rating, LOSS)
             winner = 2
 
-        r1 = await change_elo(player1.user_id, elochange)
-        r2 = await change_elo(player2.user_id, -elochange)
-
-        async with new_session() as db_session:
-
-            result = 'draw'
-            if winner == 1:
-                result = 'win_p1'
-            elif winner == 2:
-                result = 'win_p2'
-
-            new_match = PvPMatchModel(
-                player1_id=player1.user_id,
-                player2_id=player2.user_id,
-                result=result,
-                p1_elo_change=float(elochange),
-                p2_elo_change=float(-elochange)
-            )
-            db_session.add(new_match)
-
-            db_session.add(EloHistoryModel(
-                user_id=player1.user_id,
-                rating=round(float(r1), 1),
-                change=float(elochange)
-            ))
-            db_session.add(EloHistoryModel(
-                user_id=player2.user_id,
-                rating=round(float(r2), 1),
-                change=float(-elochange)
-            ))
-
-            await db_session.commit()
+        result = 'draw'
+        if winner == 1:
+            result = 'win_p1'
+        elif winner == 2:
+            result = 'win_p2'
+
+        # оба рейтинга, матч и история эло пишутся одной транзакцией
+        r1, r2 = await settle_match(MatchSettlement(
+            player1_id=player1.user_id,
+            player2_id=player2.user_id,
+            result=result,
+            p1_change=float(elochange),
+            p2_change=float(-elochange)
+        ))
+        pvp_matches_total.inc(result)
 
         try:
             await ws1.send_text(str("win" if winner == 1 else "loss" if winner == 2 else "draw") + f" {r1}")
@@ -463,14 +482,12 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
         except:
             pass
 
-        is_connected[player1.user_id] = False
-        is_connected[player2.user_id] = False
+        release_connection(player1.user_id)
+        release_connection(player2.user_id)
         return
 
     except Exception as e:  # если кто-то отключился окончательно
         print('pvp start_match exception:', e)
-        is_connected[player1.user_id] = False
-        is_connected[player2.user_id] = False
         # мы не знаем, кто отключился, поэтому пытаемся отправить сообщение обоим.
         try:
             await ws1.send_text("opponent disconnected")
@@ -483,37 +500,21 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
             await ws2.close()
         except Exception:
             pass
-
-        async with new_session() as db_session:
-
-            result = 'cancelled'
-
-            new_match = PvPMatchModel(
-                player1_id=player1.user_id,
-                player2_id=player2.user_id,
-                result=result,
-                p1_elo_change=0,
-                p2_elo_change=0
-            )
-            db_session.add(new_match)
-
-            db_session.add(EloHistoryModel(
-                user_id=player1.user_id,
-                rating=round(player1.rating, 1),
-                change=0
-            ))
-            db_session.add(EloHistoryModel(
-                user_id=player2.user_id,
-                rating=round(player2.rating, 1),
-                change=0
-            ))
-
-            await db_session.commit()
+        release_connection(player1.user_id)
+        release_connection(player2.user_id)
+
+        await settle_match(MatchSettlement(
+            player1_id=player1.user_id,
+            player2_id=player2.user_id,
+            result='cancelled',
+            p1_change=0,
+            p2_change=0
+        ))
+        pvp_matches_total.inc('cancelled')
 
     finally:
-        async with _queue_lock:
-            is_in_match[player1.user_id] = False
-            is_in_match[player2.user_id] = False
+        pvp_active_matches.dec()
+        await backend.finish_match(player1.user_id, player2.user_id)
         try:
             t1.cancel()
         except Exception:
@@ -526,61 +527,65 @@ async def start_match(player1: QueueEntry, player2: QueueEntry):
     return
 
 
-async def match_players():
-    global queue
-    global index
-    now = time.time()
-    async with _queue_lock:
-        if not queue: return
-        pairs = []  # найденные пары оппонентов
-        newqueue = []
-        newindex = dict()
-        l = len(queue)
-        i = 0
-        while i < l - 1:
-            p1 = queue[i]
-            p2 = queue[i + 1]
-
-            wait_time = max(  # наибольшее время поиска
-                now - p1.joined_at,
-                now - p2.joined_at
-            )
-
-            allowed_elo_diff = 50 * wait_time  # с каждой секундой увеличиваем допустимую разницу в эло
+def on_match_found(p1: QueueEntry, p2: QueueEntry, now: float):
+    time_to_match.append(now - p1.joined_at)
+    time_to_match.append(now - p2.joined_at)
+    pvp_time_to_match.observe(now - p1.joined_at)
+    pvp_time_to_match.observe(now - p2.joined_at)
+    asyncio.create_task(start_match(p1, p2))
 
-            if abs(p2.rating - p1.rating) < allowed_elo_diff:  # если подходить, то начинаем матч
 
-                is_in_match[p1.user_id] = True
-                is_in_match[p2.user_id] = True
-                pairs.append((p1, p2))
-                i += 2
-            else:  # иначе оставляем игрока в очереди
-                newqueue.append(p1)
-                newindex[p1.user_id] = p1
-                i += 1
-        if i == l - 1:
-            newqueue.append(queue[i])
-            newindex[queue[i].user_id] = queue[i]
-        queue = newqueue
-        index = newindex
-
-    for p in pairs:
-        asyncio.create_task(start_match(p[0], p[1]))
+def deliver_reconnect(user_id: int, websocket) -> bool:
+    fut = pending_reconnects.get(user_id)
+    if fut is None or fut.done():
+        return False
+    fut.set_result(websocket)
+    return True
 
 
 async def matchmaking_loop():
+    last_sweep = time.monotonic()
     while True:
         try:
-            await match_players()
+            # просыпаемся по add_player, либо по таймауту для периодического прохода
+            await asyncio.wait_for(_matchmaking_wakeup.wait(), timeout=SWEEP_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _matchmaking_wakeup.clear()
+
+        try:
+            # новичков сравниваем только с соседями, полный проход расширяет окно эло для долго ждущих
+            await backend.match_new_players()
+            if time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                await backend.match_players()
         except Exception as e:
             print(e)
-        await asyncio.sleep(3)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[idx], 3)
+
+
+async def collect_queue_length():
+    pvp_queue_length.set(await backend.queue_length())
+
+collectors.append(collect_queue_length)
 
 
 # при запуске начинаем постоянно подбирать всем матчи
 @router.on_event("startup")
 async def start_matchmaking():
     global _matchmaking_task
+    await backend.start(
+        on_match=on_match_found,
+        on_wakeup=_matchmaking_wakeup.set,
+        on_reconnect=deliver_reconnect,
+        on_release=release_connection,
+    )
     _matchmaking_task = asyncio.create_task(matchmaking_loop())
 
 
@@ -594,6 +599,7 @@ async def stop_matchmaking():
             await _matchmaking_task
         except asyncio.CancelledError:
             pass
+    await backend.stop()
 
 
 # всё снизу для тестирования
@@ -639,7 +645,7 @@ async def get():
 
 @router.get('/matches_history', summary='История игр для пвп')
 async def get_matches_history(
-        session: SessionDep,
+        session: ReadSessionDep,
         user: UserDep,
         limit: int = Query(default=10, le=50),
         offset: int = 0
@@ -707,6 +713,18 @@ async def get_matches_history(
     return response_list
 
 
+@router.get('/matchmaking_stats', summary='Статистика подбора матчей (для админов)')
+async def get_matchmaking_stats(admin: AdminDep):
+    samples = sorted(time_to_match)
+    return {
+        'queue_length': await backend.queue_length(),
+        'samples': len(samples),
+        'time_to_match_p50': percentile(samples, 50),
+        'time_to_match_p90': percentile(samples, 90),
+        'time_to_match_p99': percentile(samples, 99),
+    }
+
+
 @router.get('/ranks_info', summary='Возвращает инфу про ранги')
 async def get_ranks_info():
     return ELO_RANKS
\ No newline at end of file
@@ -1,60 +1,139 @@
 import logging
-from random import shuffle
-from pydantic import ValidationError
-import httpx
-from groq._exceptions import BadRequestError
-from fastapi import APIRouter,HTTPException,status
-from sqlalchemy import select, exists, func, desc
-from app.core.config import settings
-from app.core.database import SessionDep
-from app.core.models import TaskModel, AttemptModel, GeneratedTasksModel
-from app.schemas.task import TaskRead, AnswerCheckRequest, AnswerCheckResponse, GeneratedTask
-from app.core.dependencies import UserDep
-from app.core.constants import DifficultyLevel, Subject, Tag
+import math
+from fastapi import APIRouter,HTTPException,status,Request,Response,Query
+from sqlalchemy import select, func, insert, update, literal, case, or_, bindparam, lambda_stmt, \
+    Integer, Boolean, String
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from app.core.database import SessionDep, ReadSessionDep
+from app.core.models import TaskModel, AttemptModel, GeneratedTasksModel, UserModel, UserTaskProgressModel, \
+    UserSubjectStatsModel
+from app.schemas.task import TaskRead, TaskListItem, AnswerCheckRequest, AnswerCheckResponse
+from app.core.dependencies import UserDep, invalidate_user
+from app.core.constants import DifficultyLevel, Subject, Tag, AchievementCounter
 from app.schemas.task import GeneratedTaskCheckRequest
 from app.utils.levels import rewards
 from app.utils.formatters import format_answer
-from app.utils.achievments import check_and_award_achievement
-from datetime import datetime, timedelta, timezone
-from app.services.ai_service import generate_task
+from app.utils.achievments import find_new_achievements, append_achievements
+from app.services.ai_service import generate_task_with_fallback, keys_list
+from app.services.generated_task_pool import generated_task_pool
+from app.services.task_catalogue import task_catalogue
+from app.utils.rate_limiter import SlidingWindowLimiter
 router=APIRouter(prefix='/tasks',tags=['Задачи'])
 
-@router.get('/',summary='Получить все задачи',description='Возвращает задачи в соответствии с фильтрами')
+# 3 ответа на одну задачу быстрее чем за 4 секунды -> пауза 10 секунд
+answer_limiter = SlidingWindowLimiter(limit=3, window=4, cooldown=10)
+
+@router.get('/',summary='Получить все задачи',response_model=list[TaskListItem],
+            description='Возвращает задачи в соответствии с фильтрами. С limit отдает страницу по id, '
+                        'курсор следующей страницы - в заголовке X-Next-Cursor (передается как after_id)')
 async def get_tasks(
-        session: SessionDep,
+        request: Request,
+        session: ReadSessionDep,
         search: str | None = None,
         subject: Subject | None = None,
         difficulty: DifficultyLevel | None = None,
-        tag: Tag | None = None
-
-) -> list[TaskRead]:
+        tag: Tag | None = None,
+        limit: int | None = Query(default=None, gt=0, le=200),
+        after_id: int | None = None
+):
 
-    query= select(TaskModel).where(TaskModel.is_active == True)
+    page = await task_catalogue.get_page(session, search, subject, difficulty, tag, limit, after_id)
 
-    if subject:
-        query=query.where(TaskModel.subject == subject)
+    headers = {'ETag': page.etag, 'Cache-Control': 'no-cache'}
+    if page.next_cursor is not None:
+        headers['X-Next-Cursor'] = str(page.next_cursor)
 
-    if difficulty:
-        query=query.where(TaskModel.difficulty == difficulty)
+    if request.headers.get('if-none-match') == page.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-    if tag:
-        query=query.where(TaskModel.tags.contains([tag]))
+    return Response(content=page.body, media_type='application/json', headers=headers)
 
-    if search:
-        words = search.strip().split()
-        formatted_search = " & ".join([f"{word}:*" for word in words])
 
-        ts_query = func.to_tsquery('russian', formatted_search)
-        ts_vector = func.to_tsvector('russian', TaskModel.title + ' ' + TaskModel.description)
 
-        query = query.where(ts_vector.op('@@')(ts_query))
+def answer_write_query(all_achievements=None):
+    """Запись ответа одним UPDATE: попытка, прогресс по задаче, статистика предмета и счетчики пользователя.
 
-    result = await session.execute(query)
+    Все значения запроса - bindparam с префиксом answer_ (параметры execute в check_task_answer).
+    """
+    user_id = bindparam('answer_user_id', type_=Integer)
+    is_correct = bindparam('answer_is_correct', type_=Boolean)
+    time_spent = bindparam('answer_time_spent', type_=Integer)
 
-    tasks = result.scalars().all()
+    new_attempt = insert(AttemptModel).values(
+        user_id=user_id,
+        task_id=bindparam('answer_task_id', type_=Integer),
+        user_answer=bindparam('answer_text', type_=String),
+        is_correct=is_correct,
+        time_spent=time_spent
+    ).returning(AttemptModel.id).cte('new_attempt')
+
+    progress_insert = pg_insert(UserTaskProgressModel).values(
+        user_id=user_id,
+        task_id=bindparam('answer_task_id', type_=Integer),
+        attempts_before_success=case((is_correct, 0), else_=1),
+        first_correct_at=case((is_correct, func.now())),
+        best_time=case((is_correct, time_spent))
+    )
+    # first_correct_at = now() только у строки, которую решили именно этим запросом
+    solved_now = UserTaskProgressModel.first_correct_at == func.now()
+    progress = progress_insert.on_conflict_do_update(
+        index_elements=[UserTaskProgressModel.user_id, UserTaskProgressModel.task_id],
+        set_={
+            'attempts_before_success': UserTaskProgressModel.attempts_before_success + case(
+                (UserTaskProgressModel.first_correct_at == None, progress_insert.excluded.attempts_before_success),
+                else_=0
+            ),
+            'first_correct_at': func.coalesce(UserTaskProgressModel.first_correct_at, progress_insert.excluded.first_correct_at),
+            'best_time': func.least(UserTaskProgressModel.best_time, progress_insert.excluded.best_time),
+        }
+    ).returning(
+        func.coalesce(solved_now, False).label('first_solve'),
+        or_(UserTaskProgressModel.first_correct_at == None, solved_now).label('counted')
+    ).cte('progress')
+
+    # статистика по предмету для профиля меняется, только пока задача не решена
+    stats_insert = pg_insert(UserSubjectStatsModel).from_select(
+        ['user_id', 'subject', 'attempts_count', 'solved_count', 'solve_time_total'],
+        select(
+            user_id,
+            bindparam('answer_subject', type_=UserSubjectStatsModel.__table__.c.subject.type),
+            literal(1),
+            case((progress.c.first_solve, 1), else_=0),
+            case((progress.c.first_solve, time_spent), else_=0),
+        ).where(progress.c.counted)
+    )
+    subject_stats = stats_insert.on_conflict_do_update(
+        index_elements=[UserSubjectStatsModel.user_id, UserSubjectStatsModel.subject],
+        set_={
+            'attempts_count': UserSubjectStatsModel.attempts_count + stats_insert.excluded.attempts_count,
+            'solved_count': UserSubjectStatsModel.solved_count + stats_insert.excluded.solved_count,
+            'solve_time_total': UserSubjectStatsModel.solve_time_total + stats_insert.excluded.solve_time_total,
+        }
+    ).cte('subject_stats')
+
+    # атомарно в SQL: объект пользователя мог прийти из кеша с устаревшими счетчиками
+    user_values = {
+        'xp': UserModel.xp + case((progress.c.first_solve, bindparam('answer_reward', type_=Integer)), else_=0),
+        'solved_tasks_count': UserModel.solved_tasks_count + case((progress.c.first_solve, 1), else_=0),
+        'attempts_until_solved_count': UserModel.attempts_until_solved_count + case((progress.c.counted, 1), else_=0),
+    }
+    if all_achievements is not None:
+        user_values['all_achievements'] = all_achievements
+
+    return (
+        update(UserModel)
+        .where(UserModel.id == user_id, progress.c.counted != None)
+        .values(**user_values)
+        .add_cte(new_attempt, subject_stats)
+        .returning(progress.c.first_solve)
+        .execution_options(synchronize_session=False)
+    )
 
-    return tasks
 
+# INSERT ... ON CONFLICT SQLAlchemy не кеширует, и запрос компилировался бы на каждый ответ.
+# lambda_stmt кеширует компиляцию по коду лямбды: запрос без достижений собирается один раз на процесс
+answer_write_statement = lambda_stmt(lambda: answer_write_query())
 
 
 @router.post('/{task_id}/check',summary='Проверка правильного ответа по id задачи')
@@ -65,100 +144,96 @@ async def check_task_answer(
         current_user: UserDep
 ) -> AnswerCheckResponse:
 
-    last_attempts_query = (
-        select(AttemptModel)
-        .where(AttemptModel.user_id == current_user.id, AttemptModel.task_id == task_id)
-        .order_by(desc(AttemptModel.created_at))
-        .limit(3)
+    # частые ответы отсекаются в памяти, до базы такие запросы не доходят
+    wait = answer_limiter.hit((current_user.id, task_id))
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Слишком много попыток! Подождите {math.ceil(wait)} сек."
+        )
+
+    # все, что нужно для проверки, одним запросом: задача, решал ли ее раньше, сколько решено всего
+    first_correct_at = (
+        select(UserTaskProgressModel.first_correct_at)
+        .where(UserTaskProgressModel.user_id == current_user.id, UserTaskProgressModel.task_id == task_id)
+        .scalar_subquery()
     )
-    result = await session.execute(last_attempts_query)
-    last_attempts = result.scalars().all()
-
-    now = datetime.now(timezone.utc)
-    spam_threshold = timedelta(seconds=2)
-    cooldown_duration = timedelta(seconds=10)
-
-    if len(last_attempts) >= 3:
-        gap_1 = last_attempts[0].created_at - last_attempts[1].created_at
-        gap_2 = last_attempts[1].created_at - last_attempts[2].created_at
-        current_gap = now - last_attempts[0].created_at
-        if gap_1 < spam_threshold and gap_2 < spam_threshold:
-            if current_gap < cooldown_duration:
-                seconds_left = int((cooldown_duration - current_gap).total_seconds())
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail=f"Слишком много попыток! Подождите {seconds_left} сек."
-                )
-    new_badges = []
-    task = await session.get(TaskModel, task_id)
-
-    if not task or task.is_active == False:
+    solved_count = select(UserModel.solved_tasks_count).where(UserModel.id == current_user.id).scalar_subquery()
+    check_query = select(
+        TaskModel.correct_answer,
+        TaskModel.difficulty,
+        TaskModel.subject,
+        first_correct_at.label('first_correct_at'),
+        solved_count.label('solved_count'),
+    ).where(TaskModel.id == task_id, TaskModel.is_active == True)
+
+    row = (await session.execute(check_query)).one_or_none()
+
+    if row is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Задача не найдена')
+    if row.solved_count is None:
+        # пользователь удален, но еще живет в кеше
+        invalidate_user(current_user.id)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Пользователь не найден')
 
-    correct_format_answer = format_answer(str(task.correct_answer))
+    correct_format_answer = format_answer(str(row.correct_answer))
     user_format_answer = format_answer(user_data.answer)
     is_correct = (correct_format_answer == user_format_answer)
+    reward = rewards.get(row.difficulty)
 
-    already_solved_query = select(exists().where(
-        AttemptModel.user_id == current_user.id,
-        AttemptModel.task_id == task_id,
-        AttemptModel.is_correct == True
-    ))
-    was_solved_before = await session.scalar(already_solved_query)
+    new_achievements = []
+    if is_correct and not row.first_correct_at:
+        # первое решение задачи меняет счетчик решенных - проверяем только зависящие от него достижения
+        new_achievements = find_new_achievements(
+            current_user, {AchievementCounter.SOLVED_TASKS: row.solved_count + 1}
+        )
 
+    # запись попытки, прогресса по задаче и начислений - второй и последний запрос
+    if new_achievements:
+        write_query = answer_write_query(append_achievements(new_achievements))
+    else:
+        write_query = answer_write_statement
+    write_params = {
+        'answer_user_id': current_user.id,
+        'answer_task_id': task_id,
+        'answer_text': user_data.answer,
+        'answer_is_correct': is_correct,
+        'answer_time_spent': user_data.time_spent,
+        'answer_subject': row.subject,
+        'answer_reward': reward,
+    }
+
+    # пользователь мог быть удален между запросами: тогда RETURNING пуст или падает FK
+    try:
+        first_solve = (await session.execute(write_query, write_params)).scalar_one_or_none()
+    except IntegrityError:
+        first_solve = None
+    if first_solve is None:
+        await session.rollback()
+        invalidate_user(current_user.id)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Пользователь не найден')
+    await session.commit()
+    invalidate_user(current_user.id)
 
-    attempt = AttemptModel(
-        user_id=current_user.id,
-        task_id=task_id,
-        user_answer=user_data.answer,
-        is_correct=is_correct,
-        time_spent=user_data.time_spent
-    )
-    session.add(attempt)
-    await session.flush()
     message = 'Неверно! Попробуй еще раз.'
-
     if is_correct:
         message = 'Правильно!!!'
-
-        new_badges = await check_and_award_achievement(current_user, session)
-        
-        if not was_solved_before:
-            reward = rewards.get(task.difficulty)
-
-            current_user.xp += reward
-
+        if first_solve:
             message += f'Вы получили {reward} XP!'
 
-    await session.commit()
-
     return AnswerCheckResponse(
         is_correct=is_correct,
         message=message,
-        achievements=new_badges
+        achievements=[a.label for a in new_achievements]
     )
 
 
-KEY_1 = settings.GROQ_API_KEY_1
-KEY_2 = settings.GROQ_API_KEY_2
-KEY_3 = settings.GROQ_API_KEY_3
-KEY_4 = settings.GROQ_API_KEY_4
-
-raw_keys_list = [KEY_1, KEY_2, KEY_3, KEY_4]
-
-keys_list = [key for key in raw_keys_list if key]
-
-models_list = ['openai/gpt-oss-120b', 'llama-3.3-70b-versatile', 'meta-llama/llama-4-maverick-17b-128e-instruct',
-       'meta-llama/llama-4-scout-17b-16e-instruct']
-
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-allowed_tags = [t.value for t in Tag]
-
 @router.get('/generate',summary='Генерирует задачу по заданным параметрам')
 async def generate_task_for_user(
         subject: Subject,
@@ -172,38 +247,13 @@ async def generate_task_for_user(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Сервис генерации временно недоступен (отсутствуют ключи API)."
         )
-    generated_data: GeneratedTask | None = None  # Сюда положим результат
-    success = False
-    shuffle(keys_list)
-
-    for key in keys_list:
-        if success: break
-        for model in models_list:
-            if success: break
-            for attempt in range(3):
-                try:
-                    generated_data = await generate_task(
-                            subject=subject,
-                            difficulty=difficulty,
-                            api_key=key,
-                            model=model,
-                            allowed_tags=allowed_tags)
-                    success = True
-                    break
-                except ValidationError as e:
-                    logger.error(f"ИИ прислал неверную структуру (модель {model}, ключ {key}): {e}")
-                    continue
-                except BadRequestError as e:
-                    logger.error(f"Не получилось валидировать JSON (модель {model},ключ {key}): {e}")
-                    continue
-                except (httpx.ConnectError, httpx.ProxyError) as e:
-                    logger.warning(f"Проблема с прокси на модели {model}, ключ {key}: {e}")
-                    continue
-                except Exception as e:
-                    logger.error(f'ошибка модели {model}, ключ {key}, ошибка {e}')
-                    continue
-
-    if not success or not generated_data:
+
+    # обычно задача уже лежит в пуле, генерация вживую - только если пул пуст
+    generated_data = await generated_task_pool.take(session, subject, difficulty)
+    if generated_data is None:
+        generated_data = await generate_task_with_fallback(subject, difficulty)
+
+    if not generated_data:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Не удалось сгенерировать задачу. Попробуйте еще раз"
@@ -263,7 +313,7 @@ async def check_sandbox_task(
 @router.get('/{task_id}',summary='Получение задачи по ее id без ответа')
 async def get_task_by_id(
         task_id: int,
-        session: SessionDep
+        session: ReadSessionDep
 ) -> TaskRead:
     query = select(TaskModel).where(TaskModel.id == task_id, TaskModel.is_active == True)
     result = await session.execute(query)
@@ -14,16 +14,50 @@ class Settings(BaseSettings):
     GROQ_API_KEY_3: str | None = None
     GROQ_API_KEY_4: str | None = None
     PROXY_URL: str | None
+    GROQ_BASE_URL: str | None = None  # свой адрес API (например, локальный фейковый сервер), None - api.groq.com
+    GENERATED_POOL_SIZE: int = 3  # готовых сгенерированных задач на пару (предмет, сложность)
+    GENERATED_POOL_CONCURRENCY: int = 2  # одновременных запросов к ИИ при пополнении пула
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 15
     SUPERUSER: str
     SUPERUSER_PASSWORD: str
+    PASSWORD_HASH_WORKERS: int = 4  # потоков для argon2
+    PASSWORD_HASH_MAX_PENDING: int = 256  # больше - отвечаем 503, а не копим очередь бесконечно
+    USER_CACHE_TTL: float = 30  # сек, сколько живёт пользователь в кеше get_current_user
+    USER_CACHE_SIZE: int = 10000
+    # пул на один воркер: воркеров * (DB_POOL_SIZE + DB_MAX_OVERFLOW) должно помещаться в max_connections,
+    # при PVP_BACKEND=postgres к этому добавляется PVP_DB_POOL_SIZE + 1 (LISTEN) на воркер,
+    # еще одно соединение держит воркер, который пополняет пул сгенерированных задач
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 10  # сек ожидания свободного соединения, дальше TimeoutError
+    DB_POOL_RECYCLE: int = 1800  # сек, переоткрывать соединения старше (обрывы на стороне прокси/файрвола)
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100  # кеш подготовленных запросов asyncpg, 0 - для pgbouncer в режиме transaction
+    DB_APPLICATION_NAME: str = 'olymp-backend'  # видно в pg_stat_activity
+    DB_JIT: bool = False
+    DB_REPLICA_HOST: str | None = None  # реплика для GET-запросов (те же пользователь, пароль и база), None - без реплики
+    DB_REPLICA_PORT: int | None = None  # None - как DB_PORT
+    REPLICA_READ_YOUR_WRITES_SECONDS: float = 5  # сек после записи пользователь читает с основной базы
+    DB_HOLD_WARN_SECONDS: float = 10  # соединение из пула дольше - пишем в лог с маршрутом
+    METRICS_TOKEN: str | None = None  # если задан, /metrics требует Authorization: Bearer <токен>
+    SQL_PROFILING: bool = False  # счетчики SQL на запрос, Server-Timing, лог медленных запросов и N+1
+    SQL_SLOW_QUERY_MS: float = 200
+    SQL_N_PLUS_ONE_THRESHOLD: int = 5  # один и тот же запрос столько раз за HTTP-запрос - пишем в лог
+    PVP_BACKEND: str = 'memory'  # memory - один воркер, postgres - общий пул для нескольких воркеров
+    PVP_DB_POOL_SIZE: int = 5  # отдельный пул asyncpg очереди PvP (только при PVP_BACKEND=postgres)
 
 
     @property
     def DATABASE_URL(self):
         return f'postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}'
 
+    @property
+    def REPLICA_DATABASE_URL(self):
+        if not self.DB_REPLICA_HOST:
+            return None
+        return f'postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_REPLICA_HOST}:{self.DB_REPLICA_PORT or self.DB_PORT}/{self.DB_NAME}'
+
     model_config = SettingsConfigDict(env_file='.env', extra="ignore")
 
 
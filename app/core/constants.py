@@ -123,6 +123,12 @@ class RankName(BaseStrEnum):
         }
         return labels[self]
 
+class AchievementCounter(BaseStrEnum):
+    # счетчики пользователя, от которых зависят достижения
+    SOLVED_TASKS = "SOLVED_TASKS"  # меняется при первом решении задачи
+    HAS_AVATAR = "HAS_AVATAR"  # меняется при загрузке аватарки
+
+
 class Achievement(BaseStrEnum):
     FIRST_STEP = "FIRST_STEP"  # Решил 1 задачу
     GURU = "GURU"  # Решил 10 задач
@@ -137,6 +143,16 @@ class Achievement(BaseStrEnum):
         }
         return labels[self]
 
+    @property
+    def rule(self) -> tuple[AchievementCounter, int]:
+        """Счетчик и порог: достижение выдается, когда счетчик >= порога."""
+        rules = {
+            Achievement.FIRST_STEP: (AchievementCounter.SOLVED_TASKS, 1),
+            Achievement.GURU: (AchievementCounter.SOLVED_TASKS, 10),
+            Achievement.PROFILE_MASTER: (AchievementCounter.HAS_AVATAR, 1),
+        }
+        return rules[self]
+
 SUBJECT_TO_TAGS = {
     Subject.PYTHON: [
         Tag.TYPES, Tag.OOP, Tag.WEB
@@ -1,14 +1,94 @@
+from contextvars import ContextVar
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker,AsyncSession
-from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass
+from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass, Session
 from typing import Annotated
-from fastapi import Depends
+from fastapi import Depends, Request
 from app.core.config import settings
+from app.core.pool_watchdog import pool_watchdog
+from app.core.db_pool import InstrumentedPool, ReplicaPool
+from app.core.sql_profiler import install_sql_profiler
+from app.utils.cache import TTLCache
 
 
-engine = create_async_engine(url=settings.DATABASE_URL)
+def _create_engine(url: str, poolclass):
+    return create_async_engine(
+        url=url,
+        poolclass=poolclass,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+            'server_settings': {
+                'application_name': settings.DB_APPLICATION_NAME,
+                'jit': 'on' if settings.DB_JIT else 'off',  # на коротких OLTP-запросах JIT только тратит время
+            },
+        },
+    )
 
 
-new_session = async_sessionmaker(engine, expire_on_commit=False)
+engine = _create_engine(settings.DATABASE_URL, InstrumentedPool)
+pool_watchdog.install(engine)
+
+# реплика для чтения, если не задана - все идет в основную базу
+if settings.REPLICA_DATABASE_URL:
+    read_engine = _create_engine(settings.REPLICA_DATABASE_URL, ReplicaPool)
+    pool_watchdog.install(read_engine)
+else:
+    read_engine = engine
+
+if settings.SQL_PROFILING:
+    install_sql_profiler(engine)
+    if read_engine is not engine:
+        install_sql_profiler(read_engine)
+
+current_user_id: ContextVar[int | None] = ContextVar('current_user_id', default=None)  # выставляет get_current_user
+
+# кто недавно писал: его чтения идут в основную базу, пока реплика не догонит
+recent_writers = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.REPLICA_READ_YOUR_WRITES_SECONDS)
+
+
+def mark_user_write(user_id: int):
+    if read_engine is not engine:
+        recent_writers.set(user_id, True)
+
+
+class RoutingSession(Session):
+    """Сессия с info['read_only'] читает с реплики, остальные (и недавно писавшие пользователи) - с основной базы."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if read_engine is not engine and self.info.get('read_only'):
+            user_id = current_user_id.get()
+            if user_id is None or recent_writers.get(user_id) is None:
+                return read_engine.sync_engine
+        return engine.sync_engine
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _track_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _track_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_writer(session):
+    if session.info.pop('wrote', False):
+        user_id = current_user_id.get()
+        if user_id is not None:
+            mark_user_write(user_id)
+
+
+new_session = async_sessionmaker(engine, sync_session_class=RoutingSession, expire_on_commit=False)
+# для фоновых тяжелых чтений (экспорт и т.п.) без привязки к пользователю
+new_read_session = async_sessionmaker(read_engine, expire_on_commit=False)
 
 
 class Model(MappedAsDataclass, DeclarativeBase):
@@ -18,4 +98,12 @@ async def get_db():
     async with new_session() as session:
         yield session
 
-SessionDep = Annotated[AsyncSession, Depends(get_db)]
\ No newline at end of file
+
+async def get_read_db(request: Request):
+    # только для чтения: GET уходит на реплику, остальные методы - в основную базу
+    async with new_session() as session:
+        session.info['read_only'] = request.method in ('GET', 'HEAD')
+        yield session
+
+SessionDep = Annotated[AsyncSession, Depends(get_db)]
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_db)]
@@ -0,0 +1,65 @@
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)  # сек, границы гистограммы ожидания
+
+
+class PoolStats:
+    """Сколько ждали соединения из пула: счетчики и гистограмма (включая установку нового соединения)."""
+
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS) + 1)  # последний - больше всех границ
+
+    def observe(self, seconds: float):
+        self.acquired += 1
+        self.wait_total += seconds
+        if seconds > self.wait_max:
+            self.wait_max = seconds
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    stats = PoolStats()  # на классе, а не на экземпляре: при dispose() пул пересоздается
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.observe(time.perf_counter() - started)
+        return record
+
+
+class ReplicaPool(InstrumentedPool):
+    stats = PoolStats()
+
+
+def pool_snapshot(pool) -> dict:
+    stats = pool.stats
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),  # до заполнения пула overflow отрицательный
+        'max_overflow': pool._max_overflow,
+        'timeout': pool.timeout(),
+        'acquired': stats.acquired,
+        'timeouts': stats.timeouts,
+        'wait_avg_ms': round(stats.wait_total / stats.acquired * 1000, 3) if stats.acquired else 0.0,
+        'wait_max_ms': round(stats.wait_max * 1000, 3),
+        'wait_histogram': {
+            **{f'le_{bound}': count for bound, count in zip(WAIT_BUCKETS, stats.buckets)},
+            'inf': stats.buckets[-1],
+        },
+    }
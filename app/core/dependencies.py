@@ -1,15 +1,52 @@
 from typing import Annotated
 from fastapi import Depends,HTTPException,status
 import jwt
-from app.core.database import SessionDep
+from app.core.database import SessionDep, new_session, current_user_id
 from app.core.models import UserModel
 from app.core.security import oauth2_scheme
 from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
 from app.core.config import settings
+from app.utils.cache import TTLCache
 
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 
+# снимки строк users по id, чтобы не ходить в БД за пользователем на каждый запрос
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+def invalidate_user(user_id: int):
+    # вызывать после любых изменений пользователя (бан, права, xp, аватар, рейтинг, удаление)
+    user_cache.pop(user_id)
+
+
+def _snapshot_user(user: UserModel) -> dict:
+    return {attr.key: getattr(user, attr.key) for attr in UserModel.__mapper__.column_attrs}
+
+
+def _restore_user(snapshot: dict) -> UserModel:
+    # новый экземпляр на каждый запрос: изменения в одном запросе не попадают в кеш и другие запросы
+    user = UserModel.__mapper__.class_manager.new_instance()
+    for key, value in snapshot.items():
+        setattr(user, key, list(value) if isinstance(value, list) else value)
+    make_transient_to_detached(user)
+    return user
+
+
+async def load_user(user_id: int) -> UserModel | None:
+    # для долгоживущих обработчиков (вебсокеты): соединение из пула отдаётся сразу после запроса
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return _restore_user(snapshot)
+
+    async with new_session() as session:
+        user = await session.get(UserModel, user_id)
+
+    if user is not None:
+        user_cache.set(user_id, _snapshot_user(user))
+    return user
+
 
 async def get_current_user(
         session: SessionDep,
@@ -32,16 +69,27 @@ async def get_current_user(
     except:
         raise unauthorized_error
 
-    query=select(UserModel).where(UserModel.id == int(user_id))
-    result = await session.execute(query)
-    user = result.scalar_one_or_none()
+    user_id = int(user_id)
+    snapshot = user_cache.get(user_id)
 
-    if not user:
-        raise unauthorized_error
+    if snapshot is not None:
+        # кладём в сессию как уже загруженный объект, без SELECT
+        user = _restore_user(snapshot)
+        session.add(user)
+    else:
+        query=select(UserModel).where(UserModel.id == user_id)
+        result = await session.execute(query)
+        user = result.scalar_one_or_none()
+
+        if not user:
+            raise unauthorized_error
+
+        user_cache.set(user_id, _snapshot_user(user))
 
     if user.is_banned:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='Ваш аккаунт заблокирован.')
 
+    current_user_id.set(user.id)  # для выбора реплики/основной базы в ReadSessionDep
     return user
 
 
@@ -2,7 +2,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.core.models import UserModel
-from app.core.security import get_password_hash
+from app.core.security import get_password_hash_async
 
 async def create_first_superuser(session: AsyncSession):
     print("Проверка суперпользователя")
@@ -15,7 +15,7 @@ async def create_first_superuser(session: AsyncSession):
             print(f"Создание админа:{settings.SUPERUSER}")
             new_superuser = UserModel(
                 username=settings.SUPERUSER,
-                hashed_password=get_password_hash(settings.SUPERUSER_PASSWORD),
+                hashed_password=await get_password_hash_async(settings.SUPERUSER_PASSWORD),
                 is_admin=True,
                 is_banned=False,
                 email="superuser@superuser.com",
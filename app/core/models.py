@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Mapped,mapped_column
 from app.core.database import Model
-from sqlalchemy import Text, ForeignKey, func, Enum as SQLEnum, Index, text, DateTime
+from sqlalchemy import Text, ForeignKey, func, Enum as SQLEnum, Index, text, DateTime, Float, BigInteger
 from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime, timezone
 from app.core.constants import DifficultyLevel,Tag,Subject,RankName,Achievement
@@ -19,10 +19,15 @@ class UserModel(Model):
     is_admin: Mapped[bool] = mapped_column(default=False)
     is_banned: Mapped[bool] = mapped_column(default=False)
     xp: Mapped[int] = mapped_column(default=0)
+    solved_tasks_count: Mapped[int] = mapped_column(default=0, server_default='0')  # различных решенных задач
+    attempts_until_solved_count: Mapped[int] = mapped_column(default=0, server_default='0')  # попытки до первого верного ответа по каждой задаче (для процента успеха)
     avatar_url: Mapped[str | None] = mapped_column(default=None)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),server_default=func.now(),init=False)
 
 
+# холодный путь таблицы лидеров: сортировка по рейтингу только среди незабаненных
+Index('ix_users_rating_active', UserModel.rating.desc(), postgresql_where=text('NOT is_banned'))
+
 class TaskModel(Model):
     __tablename__ = 'tasks'
 
@@ -35,6 +40,7 @@ class TaskModel(Model):
     tags: Mapped[list[Tag]] = mapped_column(JSONB, default_factory=list)
     hint: Mapped[str | None] = mapped_column(Text, default=None)
     is_active: Mapped[bool] = mapped_column(default=True,server_default="true")
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),server_default=func.now(),onupdate=func.now(),init=False,index=True)
 
 Index(
     'ix_tasks_fts',
@@ -42,6 +48,8 @@ Index(
     postgresql_using='gin'
 )
 Index('ix_tasks_tags', TaskModel.tags, postgresql_using='gin')
+# название уникально среди активных задач: по нему импорт делает upsert
+Index('ix_tasks_title_active', TaskModel.title, unique=True, postgresql_where=text('is_active'))
 
 class AttemptModel(Model):
     __tablename__ = 'attempts'
@@ -68,6 +76,26 @@ Index(
     AttemptModel.created_at
 )
 
+class UserTaskProgressModel(Model):
+    __tablename__ = 'user_task_progress'  # сводка по попыткам пользователя на задачу, обновляется при каждой проверке
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    task_id: Mapped[int] = mapped_column(ForeignKey('tasks.id'), primary_key=True)
+    attempts_before_success: Mapped[int] = mapped_column(default=0)  # неверные попытки до первого верного ответа
+    first_correct_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), default=None)
+    best_time: Mapped[int | None] = mapped_column(default=None)  # лучшее time_spent среди верных ответов
+
+
+class UserSubjectStatsModel(Model):
+    __tablename__ = 'user_subject_stats'  # статистика профиля по предметам, обновляется при каждой проверке
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    subject: Mapped[Subject] = mapped_column(SQLEnum(Subject, native_enum=False), primary_key=True)
+    attempts_count: Mapped[int] = mapped_column(default=0)  # попытки до первого верного ответа по каждой задаче
+    solved_count: Mapped[int] = mapped_column(default=0)
+    solve_time_total: Mapped[int] = mapped_column(BigInteger, default=0)  # сумма time_spent первых верных ответов
+
+
 class AuditLogModel(Model):
     __tablename__ = 'audit_logs'
 
@@ -79,6 +107,23 @@ class AuditLogModel(Model):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),server_default=func.now(),init=False)
 
 
+class TaskImportJobModel(Model):
+    __tablename__ = 'task_import_jobs'  # ход фонового импорта задач, его видят все воркеры
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    admin_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"))
+    filename: Mapped[str] = mapped_column()
+    status: Mapped[str] = mapped_column(default='running')
+    processed: Mapped[int] = mapped_column(default=0)
+    created: Mapped[int] = mapped_column(default=0)
+    updated: Mapped[int] = mapped_column(default=0)
+    skipped: Mapped[int] = mapped_column(default=0)
+    error_count: Mapped[int] = mapped_column(default=0)
+    errors: Mapped[list[dict]] = mapped_column(JSONB, default_factory=list)
+    message: Mapped[str | None] = mapped_column(default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),server_default=func.now(),init=False)
+
+
 class PvPMatchModel(Model):
     __tablename__ = 'pvp_matches'
 
@@ -101,6 +146,31 @@ class EloHistoryModel(Model):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),insert_default=lambda: datetime.now(timezone.utc),init=False)
 
 
+class PvPQueueModel(Model):
+    __tablename__ = 'pvp_queue'  # общая очередь поиска для PVP_BACKEND=postgres
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    rating: Mapped[float] = mapped_column()
+    joined_at: Mapped[float] = mapped_column(Float(precision=53))  # unix time, как в QueueEntry
+    worker_id: Mapped[str] = mapped_column()  # воркер, к которому подключен сокет игрока
+
+Index('ix_pvp_queue_rating_joined', PvPQueueModel.rating, PvPQueueModel.joined_at, PvPQueueModel.user_id)
+
+
+class PvPInMatchModel(Model):
+    __tablename__ = 'pvp_in_match'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    host_worker_id: Mapped[str] = mapped_column(index=True)  # воркер, на котором идёт матч
+
+
+class PvPWorkerModel(Model):
+    __tablename__ = 'pvp_workers'
+
+    worker_id: Mapped[str] = mapped_column(primary_key=True)
+    seen_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
 class GeneratedTasksModel(Model):
     __tablename__ = "generated_tasks"
 
@@ -112,4 +182,25 @@ class GeneratedTasksModel(Model):
     correct_answer: Mapped[str] = mapped_column()
     difficulty: Mapped[DifficultyLevel] = mapped_column(SQLEnum(DifficultyLevel, native_enum=False), index=True)
     tags: Mapped[list[Tag]] = mapped_column(JSONB, default_factory=list)
-    hint: Mapped[str | None] = mapped_column(Text, default=None)
\ No newline at end of file
+    hint: Mapped[str | None] = mapped_column(Text, default=None)
+
+
+class GeneratedTaskPoolModel(Model):
+    __tablename__ = "generated_task_pool"  # заранее сгенерированные задачи для /tasks/generate
+
+    id: Mapped[int] = mapped_column(primary_key=True,init=False)
+    subject: Mapped[Subject] = mapped_column(SQLEnum(Subject, native_enum=False))
+    difficulty: Mapped[DifficultyLevel] = mapped_column(SQLEnum(DifficultyLevel, native_enum=False))
+    title: Mapped[str] = mapped_column()
+    description: Mapped[str] = mapped_column(Text)
+    correct_answer: Mapped[str] = mapped_column()
+    tags: Mapped[list[Tag]] = mapped_column(JSONB, default_factory=list)
+    hint: Mapped[str | None] = mapped_column(Text, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True),server_default=func.now(),init=False)
+
+Index(
+    'ix_generated_task_pool_subject_difficulty',
+    GeneratedTaskPoolModel.subject,
+    GeneratedTaskPoolModel.difficulty,
+    GeneratedTaskPoolModel.id
+)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.core.config import settings
+
+# маршрут, который сейчас обрабатывается: по нему видно, кто держит соединение из пула
+current_route: ContextVar[str] = ContextVar('current_route', default='-')
+
+
+class RouteContextMiddleware:
+    """ASGI-мидлварь (не BaseHTTPMiddleware, чтобы покрывать и вебсокеты): выставляет current_route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            token = current_route.set(f"{scope['method']} {scope['path']}")
+        elif scope['type'] == 'websocket':
+            token = current_route.set(f"WS {scope['path']}")
+        else:
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_route.reset(token)
+
+
+class PoolWatchdog:
+    """
+    Следит за соединениями, взятыми из пула.
+
+    Соединение, которое держат дольше threshold секунд, попадает в лог с маршрутом:
+    при возврате в пул, а если его так и не вернули - периодической проверкой.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.checked_out = {}  # connection_record -> (взято в, маршрут)
+        self.reported = set()  # уже залогированные периодической проверкой
+        self.slow_checkins = 0
+        self._task: asyncio.Task | None = None
+
+    def install(self, engine):
+        pool = engine.sync_engine.pool
+        event.listen(pool, 'checkout', self._on_checkout)
+        event.listen(pool, 'checkin', self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out[connection_record] = (time.monotonic(), current_route.get())
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        item = self.checked_out.pop(connection_record, None)
+        self.reported.discard(connection_record)
+        if item is None:
+            return
+        held = time.monotonic() - item[0]
+        if held > self.threshold:
+            self.slow_checkins += 1
+            print(f'Соединение из пула удерживалось {held:.1f} с: {item[1]}')
+
+    def held(self, min_seconds: float = 0) -> list[dict]:
+        now = time.monotonic()
+        result = [
+            {'route': route, 'held_seconds': round(now - taken_at, 1)}
+            for taken_at, route in self.checked_out.values()
+            if now - taken_at >= min_seconds
+        ]
+        result.sort(key=lambda item: item['held_seconds'], reverse=True)
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            'threshold': self.threshold,
+            'checked_out': len(self.checked_out),
+            'slow_checkins': self.slow_checkins,
+            'held_too_long': self.held(self.threshold),
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.threshold)
+            now = time.monotonic()
+            for record, (taken_at, route) in list(self.checked_out.items()):
+                if record in self.reported or now - taken_at <= self.threshold:
+                    continue
+                self.reported.add(record)
+                print(f'Соединение из пула удерживается уже {now - taken_at:.1f} с: {route}')
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+pool_watchdog = PoolWatchdog(threshold=settings.DB_HOLD_WARN_SECONDS)
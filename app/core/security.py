@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import HTTPException, status
 from passlib.context import CryptContext
@@ -18,6 +20,34 @@ def is_password_correct(password: str, hashed_password_from_db: str) -> bool:
     return pwd_context.verify(password,hashed_password_from_db)
 
 
+# argon2 занимает десятки мс CPU и отпускает GIL, поэтому считаем его в отдельных потоках,
+# чтобы логины не замораживали event loop (и вместе с ним PvP вебсокеты)
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='argon2')
+_hash_pending = 0  # запущенные + ждущие в очереди пула
+
+
+async def _run_hashing(func, *args):
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Слишком много одновременных входов, попробуйте через несколько секунд'
+        )
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+
+async def is_password_correct_async(password: str, hashed_password_from_db: str) -> bool:
+    return await _run_hashing(is_password_correct, password, hashed_password_from_db)
+
+
 def create_token(data: dict, expires_delta: timedelta, token_type: str):
 
     to_encode = data.copy()
@@ -0,0 +1,107 @@
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.core.config import settings
+from app.core.pool_watchdog import current_route
+
+
+class RequestSqlStats:
+    __slots__ = ('count', 'duration', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}  # текст запроса (с плейсхолдерами, то есть "форма") -> сколько раз выполнен
+
+
+# статистика текущего запроса, None - запрос не профилируется (фоновые задачи, старт приложения)
+request_sql_stats: ContextVar[RequestSqlStats | None] = ContextVar('request_sql_stats', default=None)
+
+route_sql_stats = {}  # шаблон маршрута -> [запросов, SQL-запросов, время в БД, запросов с N+1]
+
+
+def _route_name(scope) -> str:
+    route = scope.get('route')
+    if route is None:  # 404 и т.п.: сырой путь раздул бы статистику
+        return 'unmatched'
+    return f"{scope['method']} {route.path}"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    stats = request_sql_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+        stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+    if elapsed * 1000 >= settings.SQL_SLOW_QUERY_MS:
+        print(f'Медленный запрос {elapsed * 1000:.0f} мс ({current_route.get()}): {" ".join(statement.split())[:500]}')
+
+
+def install_sql_profiler(engine):
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class SqlProfilerMiddleware:
+    """Считает SQL-запросы и время в БД на каждый HTTP-запрос, отдает их в заголовке Server-Timing."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestSqlStats()
+        token = request_sql_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(
+                    b'server-timing',
+                    f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'.encode()
+                )]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_sql_stats.reset(token)
+            self._finish(scope, stats)
+
+    @staticmethod
+    def _finish(scope, stats: RequestSqlStats):
+        route = _route_name(scope)
+        repeated = [(statement, n) for statement, n in stats.statements.items() if n >= settings.SQL_N_PLUS_ONE_THRESHOLD]
+        for statement, n in repeated:
+            print(f'Возможный N+1 ({route}): запрос выполнен {n} раз: {" ".join(statement.split())[:300]}')
+
+        totals = route_sql_stats.get(route)
+        if totals is None:
+            totals = route_sql_stats[route] = [0, 0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += stats.count
+        totals[2] += stats.duration
+        if repeated:
+            totals[3] += 1
+
+
+def sql_stats_snapshot() -> list[dict]:
+    result = [
+        {
+            'route': route,
+            'requests': requests,
+            'queries_per_request': round(queries / requests, 2),
+            'db_ms_per_request': round(duration / requests * 1000, 2),
+            'n_plus_one_requests': n_plus_one,
+        }
+        for route, (requests, queries, duration, n_plus_one) in route_sql_stats.items()
+    ]
+    result.sort(key=lambda item: item['db_ms_per_request'] * item['requests'], reverse=True)
+    return result
@@ -20,6 +20,14 @@ class MessageEvent(BaseModel):
     ts: float # timestamp
 
 
+class MatchSettlement(BaseModel):
+    player1_id: int
+    player2_id: int
+    result: str  # win_p1 / win_p2 / draw / cancelled
+    p1_change: float
+    p2_change: float
+
+
 class MatchHistoryItem(BaseModel):
     current_player: str
     opponent: str
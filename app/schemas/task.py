@@ -25,6 +25,20 @@ class TaskRead(TaskBase):
     tags: list[str] = Field(default_factory=list)
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class TaskListItem(BaseModel):
+    """Задача в каталоге: без ответа и подсказки, описание обрезано."""
+    id: int
+    title: str
+    description: str
+    subject: Subject
+    difficulty: DifficultyLevel
+    tags: list[str] = Field(default_factory=list)
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class TaskCreate(TaskBase):
     correct_answer: str
 
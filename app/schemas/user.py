@@ -81,6 +81,14 @@ class LeaderboardPlayer(BaseModel):
     avatar_url: str | None
 
 
+class LeaderboardPosition(BaseModel):
+    position: int
+    total: int
+    player: LeaderboardPlayer
+    above: list[LeaderboardPlayer]
+    below: list[LeaderboardPlayer]
+
+
 class EloHistoryPoint(BaseModel):
     rating: float
     change: float
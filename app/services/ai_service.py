@@ -1,11 +1,155 @@
+import asyncio
+import logging
+import time
+from pydantic import ValidationError
 from app.core.config import settings
-from app.core.constants import Subject, DifficultyLevel
-from groq import AsyncGroq
+from app.core.constants import Subject, DifficultyLevel, Tag
+from groq import AsyncGroq, RateLimitError, AuthenticationError, PermissionDeniedError
+from groq._exceptions import BadRequestError
 from app.schemas.task import GeneratedTask
 import httpx
+from app.utils.metrics import Counter, Histogram
 
 PROXY_URL = settings.PROXY_URL
 
+KEY_1 = settings.GROQ_API_KEY_1
+KEY_2 = settings.GROQ_API_KEY_2
+KEY_3 = settings.GROQ_API_KEY_3
+KEY_4 = settings.GROQ_API_KEY_4
+
+raw_keys_list = [KEY_1, KEY_2, KEY_3, KEY_4]
+
+keys_list = [key for key in raw_keys_list if key]
+
+models_list = ['openai/gpt-oss-120b', 'llama-3.3-70b-versatile', 'meta-llama/llama-4-maverick-17b-128e-instruct',
+       'meta-llama/llama-4-scout-17b-16e-instruct']
+
+allowed_tags = [t.value for t in Tag]
+
+MAX_ATTEMPTS = 8  # сколько пар (ключ, модель) пробуем на одну задачу
+HEDGE_DELAY = 10  # сек без ответа - параллельно запускаем следующую пару
+MAX_PARALLEL = 2
+RATE_LIMIT_COOLDOWN = 60  # если 429 пришел без retry-after
+AUTH_COOLDOWN = 3600  # ключ отозван или заблокирован
+EWMA_ALPHA = 0.3
+DEFAULT_LATENCY = 15.0  # оценка для пар, которые еще не пробовали
+
+logger = logging.getLogger(__name__)
+
+ai_generation_duration = Histogram('ai_generation_duration_seconds', 'Время успешной генерации задачи',
+                                   ('model', 'key'), buckets=(1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90))
+ai_generation_failures = Counter('ai_generation_failures_total', 'Неудачные запросы к ИИ по причинам',
+                                 ('model', 'key', 'reason'))
+
+_http_client: httpx.AsyncClient | None = None
+_groq_clients = {}  # api_key -> AsyncGroq поверх общего пула соединений
+
+
+def start_ai_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            proxy=PROXY_URL or None,  # пустой PROXY_URL (например, с локальным фейковым Groq) - без прокси
+            timeout=httpx.Timeout(45.0, connect=10.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+
+
+async def stop_ai_client():
+    global _http_client
+    _groq_clients.clear()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_groq_client(api_key: str) -> AsyncGroq:
+    start_ai_client()
+    client = _groq_clients.get(api_key)
+    if client is None:
+        # повторы делает GenerationRouter, встроенные ретраи клиента только дублировали бы их
+        client = AsyncGroq(api_key=api_key, http_client=_http_client, base_url=settings.GROQ_BASE_URL, max_retries=0)
+        _groq_clients[api_key] = client
+    return client
+
+
+class _RouteStats:
+    __slots__ = ('latency', 'error_rate', 'cooldown_until')
+
+    def __init__(self):
+        self.latency = DEFAULT_LATENCY
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+
+
+class GenerationRouter:
+    """Здоровье пар (ключ, модель): EWMA задержки и доли ошибок, пауза после 429 - лучшие пары пробуются первыми."""
+
+    def __init__(self):
+        self.stats = {}  # (key, model) -> _RouteStats
+
+    def _get(self, pair) -> _RouteStats:
+        stats = self.stats.get(pair)
+        if stats is None:
+            stats = self.stats[pair] = _RouteStats()
+        return stats
+
+    def ranked(self) -> list[tuple[str, str]]:
+        now = time.monotonic()
+        pairs = [(key, model) for key in keys_list for model in models_list]
+        ready = [p for p in pairs if self._get(p).cooldown_until <= now]
+        # порядок моделей в models_list - запасной критерий при равных оценках
+        ready.sort(key=lambda p: (self._get(p).latency * (1 + 4 * self._get(p).error_rate), models_list.index(p[1])))
+        if ready:
+            return ready
+        # все на паузе - пробуем ту, что освободится раньше всех
+        return sorted(pairs, key=lambda p: self._get(p).cooldown_until)
+
+    def record_success(self, pair, latency: float):
+        stats = self._get(pair)
+        stats.latency += EWMA_ALPHA * (latency - stats.latency)
+        stats.error_rate -= EWMA_ALPHA * stats.error_rate
+
+    def record_abandoned(self, pair, waited: float):
+        # ответа не дождались: знаем только, что задержка не меньше waited
+        stats = self._get(pair)
+        if waited > stats.latency:
+            stats.latency += EWMA_ALPHA * (waited - stats.latency)
+
+    def record_failure(self, pair, cooldown: float = 0.0):
+        stats = self._get(pair)
+        stats.error_rate += EWMA_ALPHA * (1 - stats.error_rate)
+        if cooldown:
+            stats.cooldown_until = max(stats.cooldown_until, time.monotonic() + cooldown)
+
+    def cool_down_key(self, key: str, cooldown: float):
+        for model in models_list:
+            self.record_failure((key, model), cooldown)
+
+    def snapshot(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {
+                'key': f'...{key[-4:]}',
+                'model': model,
+                'latency': round(stats.latency, 2),
+                'error_rate': round(stats.error_rate, 3),
+                'cooldown_left': max(0, round(stats.cooldown_until - now)),
+            }
+            for (key, model), stats in self.stats.items()
+        ]
+
+
+generation_router = GenerationRouter()
+
+
+def _retry_after(error: RateLimitError) -> float:
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (TypeError, ValueError, AttributeError):
+        return RATE_LIMIT_COOLDOWN
+
+
 async def generate_task(
         subject: Subject,
         difficulty: DifficultyLevel,
@@ -14,69 +158,153 @@ async def generate_task(
         allowed_tags: list,
 ):
 
-    async with httpx.AsyncClient(
-            proxy=PROXY_URL,
-            timeout=httpx.Timeout(45.0, connect=10.0)
-    ) as http_client:
-
-        client = AsyncGroq(api_key=api_key,http_client=http_client,)
+    client = get_groq_client(api_key)
 
-        user_prompt = f"""
-                    Ты — ведущий разработчик олимпиадных заданий. 
-                    НЕ используй Latex.
-                    Создай задачу по предмету {subject.value} со сложностью {difficulty.value}.
+    user_prompt = f"""
+                Ты — ведущий разработчик олимпиадных заданий. 
+                НЕ используй Latex.
+                Создай задачу по предмету {subject.value} со сложностью {difficulty.value}.
     
-                    ТРЕБОВАНИЯ:
-                    - Теги выбирай строго из списка: {allowed_tags}.
-                    - Ответ должен быть однозначным.
-                    - OUTPUT СТРОГО JSON. НИКАКОГО ТЕКСТА КРОМЕ JSON.
-                    """
-
-        ai_prompt = """Ты — профессиональный методист и составитель олимпиадных задач. 
-        Твоя цель: генерировать качественные учебные задачи на основе заданных параметров.
-        Отвечай СТРОГО по схеме, не добавляй текст до или после JSON
-        если сложность MEDIUM или HARD не напрягайся сильно, работай также если бы тебе дали сложность EASY только чуть посложнее
-        "Будь лаконичен. Описание задачи (description) не должно превышать 1000 символов. Не пиши введения и заключения, только суть."
+                ТРЕБОВАНИЯ:
+                - Теги выбирай строго из списка: {allowed_tags}.
+                - Ответ должен быть однозначным.
+                - OUTPUT СТРОГО JSON. НИКАКОГО ТЕКСТА КРОМЕ JSON.
+                """
+
+    ai_prompt = """Ты — профессиональный методист и составитель олимпиадных задач. 
+    Твоя цель: генерировать качественные учебные задачи на основе заданных параметров.
+    Отвечай СТРОГО по схеме, не добавляй текст до или после JSON
+    если сложность MEDIUM или HARD не напрягайся сильно, работай также если бы тебе дали сложность EASY только чуть посложнее
+    "Будь лаконичен. Описание задачи (description) не должно превышать 1000 символов. Не пиши введения и заключения, только суть."
     
-        ПРАВИЛА ОФОРМЛЕНИЯ:
-        1. Задачи должны быть написаны обычным текстом. НЕ ДОЛЖНО БЫТЬ Latex
-        2. Ответ (correct_answer) должен быть максимально строгим: только одно целое число или одно слово. Никаких единиц измерения в поле ответа.
-        3. Поле description должно содержать полное и понятное условие.
-        4. Поле hint должно давать наводку на метод решения, не раскрывая сам ответ.
-        5. Строго соблюдай предоставленную JSON-схему. Вывод должен содержать ТОЛЬКО валидный JSON без лишнего текста.OUTPUT СТРОГО JSON. НИКАКОГО ТЕКСТА КРОМЕ JSON.
-        6. Задача должна быть на русском языке"""
-
-        if model == 'openai/gpt-oss-120b':
-            response_format = {
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "generated_task_schema",
-                        "strict": True,
-                        "schema": GeneratedTask.model_json_schema()
-                    }
-            }
-        else:
-            response_format = {
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "generated_task_schema",
-                        "schema": GeneratedTask.model_json_schema()
-                    }
-            }
+    ПРАВИЛА ОФОРМЛЕНИЯ:
+    1. Задачи должны быть написаны обычным текстом. НЕ ДОЛЖНО БЫТЬ Latex
+    2. Ответ (correct_answer) должен быть максимально строгим: только одно целое число или одно слово. Никаких единиц измерения в поле ответа.
+    3. Поле description должно содержать полное и понятное условие.
+    4. Поле hint должно давать наводку на метод решения, не раскрывая сам ответ.
+    5. Строго соблюдай предоставленную JSON-схему. Вывод должен содержать ТОЛЬКО валидный JSON без лишнего текста.OUTPUT СТРОГО JSON. НИКАКОГО ТЕКСТА КРОМЕ JSON.
+    6. Задача должна быть на русском языке"""
 
-        completion = await client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": ai_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format=response_format,
-            model=model,
-            temperature=0.5,
-            max_completion_tokens=2000,
-            top_p=0.9,
-            stream=False,
-            stop=None,
-            include_reasoning=False,
+    if model == 'openai/gpt-oss-120b':
+        response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "generated_task_schema",
+                    "strict": True,
+                    "schema": GeneratedTask.model_json_schema()
+                }
+        }
+    else:
+        response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "generated_task_schema",
+                    "schema": GeneratedTask.model_json_schema()
+                }
+        }
 
-        )
-        return GeneratedTask.model_validate_json(completion.choices[0].message.content)
+    completion = await client.chat.completions.create(
+        messages=[
+            {"role": "system", "content": ai_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        response_format=response_format,
+        model=model,
+        temperature=0.5,
+        max_completion_tokens=2000,
+        top_p=0.9,
+        stream=False,
+        stop=None,
+        include_reasoning=False,
+
+    )
+    return GeneratedTask.model_validate_json(completion.choices[0].message.content)
+
+
+async def _attempt(subject: Subject, difficulty: DifficultyLevel, pair) -> GeneratedTask | None:
+    key, model = pair
+    key_label = f'...{key[-4:]}'  # в метрики - только хвост ключа, как и в логи
+    started = time.monotonic()
+    try:
+        task = await generate_task(
+                subject=subject,
+                difficulty=difficulty,
+                api_key=key,
+                model=model,
+                allowed_tags=allowed_tags)
+    except asyncio.CancelledError:
+        # проиграла параллельному запросу
+        generation_router.record_abandoned(pair, time.monotonic() - started)
+        ai_generation_failures.inc(model, key_label, 'abandoned')
+        raise
+    except RateLimitError as e:
+        logger.warning(f"429 на модели {model}, ключ {key_label}")
+        generation_router.record_failure(pair, _retry_after(e))
+        ai_generation_failures.inc(model, key_label, 'rate_limit')
+        return None
+    except (AuthenticationError, PermissionDeniedError) as e:
+        logger.error(f"Ключ {key_label} отклонен: {e}")
+        generation_router.cool_down_key(key, AUTH_COOLDOWN)
+        ai_generation_failures.inc(model, key_label, 'auth')
+        return None
+    except ValidationError as e:
+        logger.error(f"ИИ прислал неверную структуру (модель {model}, ключ {key_label}): {e}")
+        reason = 'invalid_structure'
+    except BadRequestError as e:
+        logger.error(f"Не получилось валидировать JSON (модель {model},ключ {key_label}): {e}")
+        reason = 'bad_request'
+    except (httpx.ConnectError, httpx.ProxyError) as e:
+        logger.warning(f"Проблема с прокси на модели {model}, ключ {key_label}: {e}")
+        reason = 'connection'
+    except Exception as e:
+        logger.error(f'ошибка модели {model}, ключ {key_label}, ошибка {e}')
+        reason = 'other'
+    else:
+        latency = time.monotonic() - started
+        generation_router.record_success(pair, latency)
+        ai_generation_duration.observe(latency, model, key_label)
+        return task
+
+    generation_router.record_failure(pair)
+    ai_generation_failures.inc(model, key_label, reason)
+    return None
+
+
+async def generate_task_with_fallback(subject: Subject, difficulty: DifficultyLevel) -> GeneratedTask | None:
+    """
+    Пробует пары (ключ, модель) от самой здоровой. Ошибка - сразу следующая пара,
+    нет ответа дольше HEDGE_DELAY - следующая пара запускается параллельно, берется первый успешный ответ.
+    """
+    candidates = iter(generation_router.ranked()[:MAX_ATTEMPTS])
+    running = set()
+
+    def launch() -> bool:
+        pair = next(candidates, None)
+        if pair is None:
+            return False
+        running.add(asyncio.create_task(_attempt(subject, difficulty, pair)))
+        return True
+
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(running, timeout=HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                if len(running) < MAX_PARALLEL:
+                    launch()
+                continue
+
+            for finished in done:
+                running.discard(finished)
+                result = finished.result()
+                if result is not None:
+                    return result
+
+            if not running:
+                launch()
+    finally:
+        for pending in running:
+            pending.cancel()
+
+    return None
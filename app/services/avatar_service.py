@@ -0,0 +1,111 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from pillow_heif import register_heif_opener
+
+# модуль импортируется в дочерних процессах пула, поэтому здесь только PIL и stdlib
+
+AVATAR_SIZES = (256, 128, 64)  # от большего к меньшему: каждый следующий размер уменьшается из предыдущего
+AVATAR_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+MAIN_AVATAR_SIZE = 256
+MAX_AVATAR_BYTES = 15 * 1024 * 1024
+MAX_AVATAR_PIXELS = 40_000_000  # ~ 48 Мп фото с телефона, больше - отказ без декодирования
+AVATAR_WORKERS = 2
+
+_VARIANT_RE = re.compile(r'_(\d+)\.(jpg|webp)$')
+
+_executor: ProcessPoolExecutor | None = None
+
+
+class AvatarTooLarge(ValueError):
+    pass
+
+
+def _init_worker():
+    register_heif_opener()
+    Image.MAX_IMAGE_PIXELS = MAX_AVATAR_PIXELS
+
+
+def _atomic_save(image: Image.Image, path: str, image_format: str):
+    # пишем во временный файл рядом и переименовываем: отдающийся файл никогда не бывает недописанным
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if image_format == 'JPEG':
+                image.save(f, image_format, quality=85, optimize=True)
+            else:
+                image.save(f, image_format, quality=80, method=4)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def process_avatar(data: bytes, directory: str, file_stem: str) -> list[str]:
+    image = Image.open(io.BytesIO(data))
+
+    if image.width * image.height > MAX_AVATAR_PIXELS:
+        raise AvatarTooLarge(f'{image.width}x{image.height}')
+
+    # JPEG сразу декодируется в уменьшенном в 2/4/8 раз виде, а не в полном разрешении
+    image.draft('RGB', (MAIN_AVATAR_SIZE * 2, MAIN_AVATAR_SIZE * 2))
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    written = []
+    for size in AVATAR_SIZES:
+        image = image.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for ext, image_format in AVATAR_FORMATS:
+            path = os.path.join(directory, f'{file_stem}_{size}.{ext}')
+            _atomic_save(image, path, image_format)
+            written.append(path)
+    return written
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=AVATAR_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+        )
+    return _executor
+
+
+async def process_avatar_async(data: bytes, directory: str, file_stem: str) -> list[str]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), process_avatar, data, directory, file_stem)
+
+
+def shutdown_avatar_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def avatar_variant_url(url: str | None, size: int, ext: str = 'jpg') -> str | None:
+    # старые аватарки (до нарезки на размеры) отдаются как есть
+    if not url or not _VARIANT_RE.search(url):
+        return url
+    return _VARIANT_RE.sub(f'_{size}.{ext}', url)
+
+
+def avatar_files(url: str | None, directory: str) -> list[str]:
+    if not url:
+        return []
+    file_name = url.rsplit('/', 1)[-1]
+    if not _VARIANT_RE.search(file_name):
+        return [os.path.join(directory, file_name)]
+    stem = _VARIANT_RE.sub('', file_name)
+    return [os.path.join(directory, f'{stem}_{size}.{ext}') for size in AVATAR_SIZES for ext, _ in AVATAR_FORMATS]
@@ -0,0 +1,130 @@
+import asyncio
+import asyncpg
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.constants import Subject, DifficultyLevel
+from app.core.database import new_session
+from app.core.models import GeneratedTaskPoolModel
+from app.schemas.task import GeneratedTask
+from app.services.ai_service import generate_task_with_fallback, keys_list
+
+REFILL_INTERVAL = 60  # даже без запросов раз в минуту проверяем, что пул полный (могли разобрать другие воркеры)
+REFILL_LOCK_KEY = 724_017  # advisory lock: пул пополняет один воркер, иначе при старте каждый сгенерировал бы все пары
+
+_TASK_FIELDS = ('title', 'description', 'correct_answer', 'subject', 'difficulty', 'tags', 'hint')
+
+
+class GeneratedTaskPool:
+    """
+    Заранее сгенерированные задачи для /tasks/generate, по GENERATED_POOL_SIZE на (предмет, сложность).
+
+    Запрос забирает готовую задачу одним DELETE ... RETURNING (SKIP LOCKED - параллельные запросы
+    не ждут друг друга и не получают одну задачу), пополнение идет в фоне с ограниченным числом запросов к ИИ.
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(settings.GENERATED_POOL_CONCURRENCY)
+        self._task: asyncio.Task | None = None
+
+    async def take(self, session: AsyncSession, subject: Subject, difficulty: DifficultyLevel) -> GeneratedTask | None:
+        # удаление в транзакции запроса: если он упадет до коммита, задача вернется в пул
+        candidate = (
+            select(GeneratedTaskPoolModel.id)
+            .where(GeneratedTaskPoolModel.subject == subject, GeneratedTaskPoolModel.difficulty == difficulty)
+            .order_by(GeneratedTaskPoolModel.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        query = (
+            delete(GeneratedTaskPoolModel)
+            .where(GeneratedTaskPoolModel.id == candidate)
+            .returning(*[getattr(GeneratedTaskPoolModel, field) for field in _TASK_FIELDS])
+        )
+        row = (await session.execute(query)).one_or_none()
+        self._wakeup.set()
+
+        if row is None:
+            return None
+        return GeneratedTask(**row._asdict())
+
+    async def refill(self) -> bool:
+        """Пополняет пул, если его сейчас не пополняет другой воркер. False - lock занят, ход пропущен."""
+        # lock живет, пока открыто соединение: упавший воркер не оставит его занятым.
+        # Отдельное соединение, а не из пула: пополнение может идти минутами
+        dsn = settings.DATABASE_URL.replace('postgresql+asyncpg://', 'postgresql://')
+        lock_connection = await asyncpg.connect(dsn)
+        try:
+            if not await lock_connection.fetchval('SELECT pg_try_advisory_lock($1)', REFILL_LOCK_KEY):
+                return False
+            await self._refill_missing()
+            return True
+        finally:
+            await lock_connection.close()
+
+    async def _refill_missing(self):
+        async with new_session() as session:
+            query = (
+                select(GeneratedTaskPoolModel.subject, GeneratedTaskPoolModel.difficulty, func.count())
+                .group_by(GeneratedTaskPoolModel.subject, GeneratedTaskPoolModel.difficulty)
+            )
+            counts = {(row[0], row[1]): row[2] for row in (await session.execute(query)).all()}
+
+        jobs = [
+            self._generate_one(subject, difficulty)
+            for subject in Subject
+            for difficulty in DifficultyLevel
+            for _ in range(settings.GENERATED_POOL_SIZE - counts.get((subject, difficulty), 0))
+        ]
+        await asyncio.gather(*jobs)
+
+    async def _generate_one(self, subject: Subject, difficulty: DifficultyLevel):
+        async with self._semaphore:
+            task = await generate_task_with_fallback(subject, difficulty)
+
+        if task is None or task.subject != subject or task.difficulty != difficulty:
+            return
+
+        async with new_session() as session:
+            # другой воркер мог успеть пополнить эту пару, лишнее не кладем
+            count_query = select(func.count()).where(
+                GeneratedTaskPoolModel.subject == subject,
+                GeneratedTaskPoolModel.difficulty == difficulty
+            )
+            if await session.scalar(count_query) >= settings.GENERATED_POOL_SIZE:
+                return
+            session.add(GeneratedTaskPoolModel(**task.model_dump()))
+            await session.commit()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.refill()
+            except Exception as e:
+                print(f"Ошибка пополнения пула сгенерированных задач: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=REFILL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not keys_list or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+generated_task_pool = GeneratedTaskPool()
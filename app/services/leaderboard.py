@@ -0,0 +1,143 @@
+import asyncio
+import time
+from bisect import bisect_left, insort
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from app.core.database import new_session
+from app.core.models import UserModel
+from app.core.constants import RankName
+from app.schemas.user import LeaderboardPlayer
+from app.services.avatar_service import avatar_variant_url
+from app.utils.levels import calculate_level_info
+
+REFRESH_INTERVAL = 60  # полная перезагрузка: подтягивает xp, имена, аватарки и матчи с других воркеров
+TOP_CACHE_LIMIT = 100
+
+_players_adapter = TypeAdapter(list[LeaderboardPlayer])
+
+
+class _Player:
+    __slots__ = ('user_id', 'username', 'rating', 'rank', 'xp', 'avatar_url')
+
+    def __init__(self, user_id: int, username: str, rating: float, rank: RankName, xp: int, avatar_url: str | None):
+        self.user_id = user_id
+        self.username = username
+        self.rating = rating
+        self.rank = rank
+        self.xp = xp
+        self.avatar_url = avatar_url
+
+    @property
+    def key(self):
+        return -self.rating, self.user_id
+
+    def to_schema(self) -> LeaderboardPlayer:
+        return LeaderboardPlayer(
+            username=self.username,
+            rating=round(float(self.rating), 1),
+            rank=self.rank,
+            level=calculate_level_info(self.xp)['level'],
+            avatar_url=avatar_variant_url(self.avatar_url, 64),
+        )
+
+
+class Leaderboard:
+    """
+    Рейтинг незабаненных игроков в памяти: отсортированный список ключей (-rating, user_id) + словарь игроков.
+    Место игрока ищется бинпоиском, топ отдается уже сериализованным.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.players = {}  # user_id -> _Player
+        self.loaded_at = 0.0
+        self._top_cache = {}  # limit -> json bytes
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    async def refresh(self):
+        async with new_session() as session:
+            query = (
+                select(UserModel.id, UserModel.username, UserModel.rating, UserModel.user_rank,
+                       UserModel.xp, UserModel.avatar_url)
+                .where(UserModel.is_banned == False)
+                .order_by(UserModel.rating.desc(), UserModel.id)
+            )
+            rows = (await session.execute(query)).all()
+
+        players = [_Player(row.id, row.username, row.rating, row.user_rank, row.xp, row.avatar_url) for row in rows]
+        self.players = {p.user_id: p for p in players}
+        self.keys = [p.key for p in players]
+        self._top_cache.clear()
+        self.loaded_at = time.monotonic()
+
+    async def ensure_loaded(self):
+        if time.monotonic() - self.loaded_at < REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if time.monotonic() - self.loaded_at >= REFRESH_INTERVAL:
+                await self.refresh()
+
+    def invalidate(self):
+        # бан/разбан, удаление, правка админом: перечитываем при следующем запросе
+        self.loaded_at = 0.0
+
+    def update_rating(self, user_id: int, rating: float, rank: RankName):
+        player = self.players.get(user_id)
+        if player is None:
+            return
+        self._remove_key(player)
+        player.rating = rating
+        player.rank = rank
+        insort(self.keys, player.key)
+        self._top_cache.clear()
+
+    def add(self, user: UserModel):
+        if user.is_banned or user.id in self.players:
+            return
+        player = _Player(user.id, user.username, user.rating, user.user_rank, user.xp, user.avatar_url)
+        self.players[user.id] = player
+        insort(self.keys, player.key)
+        self._top_cache.clear()
+
+    def remove(self, user_id: int):
+        player = self.players.pop(user_id, None)
+        if player is not None:
+            self._remove_key(player)
+            self._top_cache.clear()
+
+    async def top(self, limit: int) -> bytes:
+        await self.ensure_loaded()
+        body = self._top_cache.get(limit)
+        if body is None:
+            players = [self.players[user_id].to_schema() for _, user_id in self.keys[:limit]]
+            body = _players_adapter.dump_json(players)
+            if limit <= TOP_CACHE_LIMIT:
+                self._top_cache[limit] = body
+        return body
+
+    def position(self, user_id: int) -> int | None:
+        """Место игрока (с 1) за O(log n)."""
+        player = self.players.get(user_id)
+        if player is None:
+            return None
+        return bisect_left(self.keys, player.key) + 1
+
+    def around(self, position: int, radius: int) -> tuple[list[LeaderboardPlayer], list[LeaderboardPlayer]]:
+        index = position - 1
+        above = self.keys[max(0, index - radius):index]
+        below = self.keys[index + 1:index + 1 + radius]
+        return (
+            [self.players[user_id].to_schema() for _, user_id in above],
+            [self.players[user_id].to_schema() for _, user_id in below],
+        )
+
+    def _remove_key(self, player: _Player):
+        index = bisect_left(self.keys, player.key)
+        if index < len(self.keys) and self.keys[index] == player.key:
+            del self.keys[index]
+
+
+leaderboard = Leaderboard()
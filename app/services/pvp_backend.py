@@ -0,0 +1,510 @@
+import asyncio
+import json
+import time
+import uuid
+import asyncpg
+from app.core.config import settings
+from app.schemas.matchmaking import QueueEntry
+from app.utils.matchmaking_queue import MatchmakingQueue
+
+MATCHMAKING_CHANNEL = 'pvp_matchmaking'  # общий канал: новые игроки в очереди
+MATCHMAKING_LOCK_KEY = 724_001  # ключ advisory lock, под которым один воркер подбирает пары
+WORKER_TIMEOUT = 30  # через сколько секунд без heartbeat записи воркера считаются мёртвыми
+MAX_RELAY_TEXT = 2000  # payload NOTIFY ограничен 8000 байт
+
+
+def can_pair(p1: QueueEntry, p2: QueueEntry, now: float) -> bool:
+    wait_time = max(  # наибольшее время поиска
+        now - p1.joined_at,
+        now - p2.joined_at
+    )
+    allowed_elo_diff = 50 * wait_time  # с каждой секундой увеличиваем допустимую разницу в эло
+    return abs(p2.rating - p1.rating) < allowed_elo_diff
+
+
+async def close_socket(ws):
+    try:
+        await ws.send_text("opponent disconnected")
+        await ws.close()
+    except Exception:
+        pass
+
+
+class InProcessPvpBackend:
+    """Очередь и флаги матчей в памяти процесса. Работает только с одним воркером uvicorn."""
+
+    def __init__(self):
+        self.queue = MatchmakingQueue()
+        self.in_match = set()
+        self.new_players = []  # user_id игроков, вставших в очередь с последнего пробуждения матчмейкера
+        self.lock = asyncio.Lock()
+        self.on_match = None
+        self.on_wakeup = None
+
+    async def start(self, on_match, on_wakeup, on_reconnect, on_release):
+        self.on_match = on_match
+        self.on_wakeup = on_wakeup
+
+    async def stop(self):
+        pass
+
+    async def heartbeat(self):
+        pass
+
+    async def queue_length(self) -> int:
+        return len(self.queue)
+
+    async def add_player(self, entry: QueueEntry):
+        async with self.lock:
+            old = self.queue.get(entry.user_id)
+            if old is not None and old._ws is not entry._ws:  # если уже в очереди - закрываем старый вебсокет
+                await close_socket(old._ws)
+            self.queue.add(entry)  # старая запись пользователя заменяется
+            self.new_players.append(entry.user_id)
+        self.on_wakeup()
+
+    async def remove_player(self, entry: QueueEntry) -> bool:
+        async with self.lock:
+            return self.queue.remove(entry)
+
+    async def is_in_match(self, user_id: int) -> bool:
+        return user_id in self.in_match
+
+    async def hosted_elsewhere(self, user_id: int) -> bool:
+        # матч всегда идёт в этом же процессе, реконнект обрабатывается локально
+        return False
+
+    async def forward_reconnect(self, user_id: int, websocket):
+        pass
+
+    def take_early_reconnect(self, user_id: int):
+        return None
+
+    async def finish_match(self, *user_ids: int):
+        async with self.lock:
+            self.in_match.difference_update(user_ids)
+
+    async def match_new_players(self):
+        # новичка сравниваем только с соседями по рейтингу, а не со всей очередью
+        now = time.time()
+        pairs = []
+        async with self.lock:
+            user_ids = self.new_players.copy()
+            self.new_players.clear()
+
+            for user_id in user_ids:
+                entry = self.queue.get(user_id)
+                if entry is None:  # уже в матче или вышел из поиска
+                    continue
+
+                prev, nxt = self.queue.neighbours(user_id)
+                candidates = [p for p in (prev, nxt) if p is not None and can_pair(entry, p, now)]
+                if not candidates:
+                    continue
+
+                opponent = min(candidates, key=lambda p: abs(p.rating - entry.rating))
+                self.queue.remove(entry)
+                self.queue.remove(opponent)
+                pairs.append((opponent, entry) if opponent is prev else (entry, opponent))
+
+            self._mark_in_match(pairs)
+
+        for p1, p2 in pairs:
+            self.on_match(p1, p2, now)
+
+    async def match_players(self):
+        now = time.time()
+        async with self.lock:
+            if not self.queue: return
+            # подходящие соседние пары вынимаются из очереди на месте, остальные остаются как были
+            pairs = self.queue.pair_adjacent(lambda p1, p2: can_pair(p1, p2, now))
+            self._mark_in_match(pairs)
+
+        for p1, p2 in pairs:
+            self.on_match(p1, p2, now)
+
+    def _mark_in_match(self, pairs):
+        for p1, p2 in pairs:
+            self.in_match.add(p1.user_id)
+            self.in_match.add(p2.user_id)
+
+
+class RemoteSocket:
+    """
+    Вебсокет игрока, подключенного к другому воркеру.
+
+    Повторяет используемую матчем часть интерфейса WebSocket, сообщения ходят через NOTIFY.
+    """
+
+    def __init__(self, backend: "PostgresPvpBackend", user_id: int, worker_id: str):
+        self.backend = backend
+        self.user_id = user_id
+        self.worker_id = worker_id
+        self.inbox = asyncio.Queue()
+
+    async def send_text(self, text: str):
+        await self.backend.notify(self.worker_id, {'t': 'out', 'u': self.user_id, 'm': text[:MAX_RELAY_TEXT]})
+
+    async def receive_text(self) -> str:
+        text = await self.inbox.get()
+        if text is None:
+            raise ConnectionError(f'remote socket of user {self.user_id} disconnected')
+        return text
+
+    async def close(self):
+        self.backend.remote_sockets.pop(self.user_id, None)
+        await self.backend.notify(self.worker_id, {'t': 'close', 'u': self.user_id})
+
+
+class PostgresPvpBackend:
+    """
+    Общий пул подбора для нескольких воркеров/нод через PostgreSQL.
+
+    Очередь и занятые игроки лежат в таблицах pvp_queue/pvp_in_match, пары подбирает тот воркер,
+    который взял advisory lock. Матч идёт на воркере первого игрока, сокет второго игрока,
+    если он подключен к другому воркеру, проксируется через LISTEN/NOTIFY канал этого воркера.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.channel = f'pvp_{self.worker_id}'
+        self.pool = None
+        self.listener = None
+        self.local_sockets = {}  # user_id -> WebSocket игроков в очереди, подключенных к этому воркеру
+        self.remote_sockets = {}  # user_id -> RemoteSocket игроков матчей этого воркера
+        self.relays = {}  # user_id -> asyncio.Task, проксирование локального сокета чужому матчу
+        self.background_tasks = set()  # обработчики уведомлений: держим ссылки, чтобы задачи не собрал GC
+        self.relay_sockets = {}  # user_id -> WebSocket
+        self.early_reconnects = {}  # user_id -> RemoteSocket, пришедшие раньше, чем матч открыл слот
+        self.new_players = []
+        self.on_match = None
+        self.on_wakeup = None
+        self.on_reconnect = None
+        self.on_release = None
+
+    async def start(self, on_match, on_wakeup, on_reconnect, on_release):
+        self.on_match = on_match
+        self.on_wakeup = on_wakeup
+        self.on_reconnect = on_reconnect
+        self.on_release = on_release
+
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=settings.PVP_DB_POOL_SIZE)
+        self.listener = await asyncpg.connect(self.dsn)
+        await self.listener.add_listener(self.channel, self._on_notification)
+        await self.listener.add_listener(MATCHMAKING_CHANNEL, self._on_notification)
+        await self.heartbeat()
+
+    async def stop(self):
+        for task in [*self.relays.values(), *self.background_tasks]:
+            task.cancel()
+        if self.pool is not None:
+            await self.pool.execute('DELETE FROM pvp_queue WHERE worker_id = $1', self.worker_id)
+            await self.pool.execute('DELETE FROM pvp_workers WHERE worker_id = $1', self.worker_id)
+        if self.listener is not None:
+            await self.listener.close()
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def notify(self, channel: str, payload: dict):
+        if not channel.startswith('pvp_'):
+            channel = f'pvp_{channel}'
+        await self.pool.execute('SELECT pg_notify($1, $2)', channel, json.dumps(payload, ensure_ascii=False))
+
+    async def heartbeat(self):
+        await self.pool.execute(
+            '''INSERT INTO pvp_workers (worker_id, seen_at) VALUES ($1, now())
+               ON CONFLICT (worker_id) DO UPDATE SET seen_at = now()''',
+            self.worker_id
+        )
+
+    async def queue_length(self) -> int:
+        return await self.pool.fetchval('SELECT count(*) FROM pvp_queue')
+
+    async def add_player(self, entry: QueueEntry):
+        ws = entry._ws
+        worker_id = ws.worker_id if isinstance(ws, RemoteSocket) else self.worker_id
+        if isinstance(ws, RemoteSocket):  # игрок вернулся в очередь из несостоявшегося матча на этом воркере
+            self.remote_sockets.pop(entry.user_id, None)
+            await self.notify(worker_id, {'t': 'requeue', 'u': entry.user_id})
+        else:
+            old_ws = self.local_sockets.get(entry.user_id)
+            if old_ws is not None and old_ws is not ws:
+                await close_socket(old_ws)
+            self.local_sockets[entry.user_id] = ws
+
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                old_worker = await con.fetchval(
+                    'SELECT worker_id FROM pvp_queue WHERE user_id = $1 FOR UPDATE', entry.user_id
+                )
+                await con.execute(
+                    '''INSERT INTO pvp_queue (user_id, rating, joined_at, worker_id) VALUES ($1, $2, $3, $4)
+                       ON CONFLICT (user_id) DO UPDATE
+                       SET rating = EXCLUDED.rating, joined_at = EXCLUDED.joined_at, worker_id = EXCLUDED.worker_id''',
+                    entry.user_id, entry.rating, entry.joined_at, worker_id
+                )
+                if old_worker is not None and old_worker != worker_id:  # старый сокет на другом воркере
+                    await con.execute('SELECT pg_notify($1, $2)', f'pvp_{old_worker}',
+                                      json.dumps({'t': 'close', 'u': entry.user_id}))
+                await con.execute('SELECT pg_notify($1, $2)', MATCHMAKING_CHANNEL,
+                                  json.dumps({'t': 'new', 'u': entry.user_id}))
+
+    async def remove_player(self, entry: QueueEntry) -> bool:
+        if self.local_sockets.get(entry.user_id) is entry._ws:
+            del self.local_sockets[entry.user_id]
+        result = await self.pool.execute(
+            'DELETE FROM pvp_queue WHERE user_id = $1 AND joined_at = $2 AND worker_id = $3',
+            entry.user_id, entry.joined_at, self.worker_id
+        )
+        return result != 'DELETE 0'
+
+    async def is_in_match(self, user_id: int) -> bool:
+        return await self.pool.fetchval('SELECT EXISTS (SELECT 1 FROM pvp_in_match WHERE user_id = $1)', user_id)
+
+    async def _match_host(self, user_id: int) -> str | None:
+        return await self.pool.fetchval('SELECT host_worker_id FROM pvp_in_match WHERE user_id = $1', user_id)
+
+    async def hosted_elsewhere(self, user_id: int) -> bool:
+        host = await self._match_host(user_id)
+        return host is not None and host != self.worker_id
+
+    async def forward_reconnect(self, user_id: int, websocket):
+        # матч идёт на другом воркере: сокет остаётся здесь, матч получит его как RemoteSocket
+        host = await self._match_host(user_id)
+        if host is None:
+            self.on_release(user_id)
+            return
+        self.relay_sockets[user_id] = websocket
+        await self.notify(host, {'t': 'reconnect', 'u': user_id, 'w': self.worker_id})
+
+    def take_early_reconnect(self, user_id: int):
+        return self.early_reconnects.pop(user_id, None)
+
+    async def finish_match(self, *user_ids: int):
+        for user_id in user_ids:
+            self.remote_sockets.pop(user_id, None)
+            self.early_reconnects.pop(user_id, None)
+        await self.pool.execute(
+            'DELETE FROM pvp_in_match WHERE user_id = ANY($1::int[]) AND host_worker_id = $2',
+            list(user_ids), self.worker_id
+        )
+
+    async def match_new_players(self):
+        user_ids = self.new_players.copy()
+        self.new_players.clear()
+        if not user_ids:
+            return
+        await self._locked_matching(self._pair_new_players, user_ids)
+
+    async def match_players(self):
+        await self.heartbeat()
+        await self._locked_matching(self._pair_all)
+
+    async def _locked_matching(self, find_pairs, *args):
+        async with self.pool.acquire() as con:
+            async with con.transaction():
+                # пары подбирает только один воркер, остальные пропускают ход
+                if not await con.fetchval('SELECT pg_try_advisory_xact_lock($1)', MATCHMAKING_LOCK_KEY):
+                    return
+                now = time.time()
+                pairs = await find_pairs(con, now, *args)
+                for (p1, w1), (p2, w2) in pairs:
+                    await con.execute('DELETE FROM pvp_queue WHERE user_id = ANY($1::int[])', [p1.user_id, p2.user_id])
+                    await con.executemany(
+                        '''INSERT INTO pvp_in_match (user_id, host_worker_id) VALUES ($1, $2)
+                           ON CONFLICT (user_id) DO UPDATE SET host_worker_id = EXCLUDED.host_worker_id''',
+                        [(p1.user_id, w1), (p2.user_id, w1)]
+                    )
+                    payload = {
+                        't': 'match',
+                        'now': now,
+                        'p1': {**p1.model_dump(), 'w': w1},
+                        'p2': {**p2.model_dump(), 'w': w2},
+                    }
+                    # матч запускает воркер, держащий сокет первого игрока
+                    await con.execute('SELECT pg_notify($1, $2)', f'pvp_{w1}', json.dumps(payload))
+
+    async def _pair_new_players(self, con, now: float, user_ids: list[int]):
+        pairs = []
+        taken = set()
+        for user_id in user_ids:
+            row = await con.fetchrow('SELECT * FROM pvp_queue WHERE user_id = $1', user_id)
+            if row is None or user_id in taken:
+                continue
+            entry = self._entry_from_row(row)
+
+            # ближайшие соседи по (rating, joined_at, user_id) снизу и сверху
+            below = await con.fetchrow(
+                '''SELECT * FROM pvp_queue WHERE (rating, joined_at, user_id) < ($1, $2, $3)
+                   ORDER BY rating DESC, joined_at DESC, user_id DESC LIMIT 1''',
+                row['rating'], row['joined_at'], user_id
+            )
+            above = await con.fetchrow(
+                '''SELECT * FROM pvp_queue WHERE (rating, joined_at, user_id) > ($1, $2, $3)
+                   ORDER BY rating, joined_at, user_id LIMIT 1''',
+                row['rating'], row['joined_at'], user_id
+            )
+            candidates = [
+                r for r in (below, above)
+                if r is not None and r['user_id'] not in taken and can_pair(entry, self._entry_from_row(r), now)
+            ]
+            if not candidates:
+                continue
+
+            opponent = min(candidates, key=lambda r: abs(r['rating'] - row['rating']))
+            taken.update((user_id, opponent['user_id']))
+            me = (entry, row['worker_id'])
+            other = (self._entry_from_row(opponent), opponent['worker_id'])
+            pairs.append((other, me) if opponent is below else (me, other))
+        return pairs
+
+    async def _pair_all(self, con, now: float):
+        await con.execute(
+            '''DELETE FROM pvp_queue WHERE worker_id NOT IN
+               (SELECT worker_id FROM pvp_workers WHERE seen_at > now() - make_interval(secs => $1))''',
+            WORKER_TIMEOUT
+        )
+        await con.execute(
+            '''DELETE FROM pvp_in_match WHERE host_worker_id NOT IN
+               (SELECT worker_id FROM pvp_workers WHERE seen_at > now() - make_interval(secs => $1))''',
+            WORKER_TIMEOUT
+        )
+
+        rows = await con.fetch('SELECT * FROM pvp_queue')
+        queue = MatchmakingQueue()
+        workers = {}
+        for row in rows:
+            queue.add(self._entry_from_row(row))
+            workers[row['user_id']] = row['worker_id']
+
+        pairs = queue.pair_adjacent(lambda p1, p2: can_pair(p1, p2, now))
+        return [((p1, workers[p1.user_id]), (p2, workers[p2.user_id])) for p1, p2 in pairs]
+
+    @staticmethod
+    def _entry_from_row(row) -> QueueEntry:
+        return QueueEntry(rating=row['rating'], joined_at=row['joined_at'], user_id=row['user_id'])
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self.background_tasks.discard(task)
+        self._log_failure(task)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print('pvp backend task error:', repr(task.exception()))
+
+    def _on_notification(self, connection, pid, channel, payload):
+        self._spawn(self._handle_notification(channel, json.loads(payload)))
+
+    async def _handle_notification(self, channel: str, msg: dict):
+        try:
+            kind = msg['t']
+            if kind == 'new':
+                self.new_players.append(msg['u'])
+                self.on_wakeup()
+            elif kind == 'match':
+                await self._start_hosted_match(msg)
+            elif kind == 'relay':
+                self._start_relay(msg['u'], msg['host'])
+            elif kind == 'in':
+                remote = self.remote_sockets.get(msg['u'])
+                if remote is not None:
+                    remote.inbox.put_nowait(msg['m'])
+            elif kind == 'out':
+                ws = self.relay_sockets.get(msg['u'])
+                if ws is not None:
+                    try:
+                        await ws.send_text(msg['m'])
+                    except Exception:
+                        pass
+            elif kind == 'close':
+                await self._close_local(msg['u'])
+            elif kind == 'requeue':
+                self._stop_relay(msg['u'])
+            elif kind == 'reconnect':
+                remote = RemoteSocket(self, msg['u'], msg['w'])
+                self.remote_sockets[msg['u']] = remote
+                if not self.on_reconnect(msg['u'], remote):
+                    # матч ещё не заметил дисконнект, отдадим сокет, когда он откроет слот
+                    self.early_reconnects[msg['u']] = remote
+                await self.notify(msg['w'], {'t': 'relay', 'u': msg['u'], 'host': self.worker_id})
+        except Exception as e:
+            print('pvp backend notification error:', e)
+
+    async def _start_hosted_match(self, msg: dict):
+        players = []
+        for data in (msg['p1'], msg['p2']):
+            worker_id = data.pop('w')
+            entry = QueueEntry(**data)
+            if worker_id == self.worker_id:
+                # если игрок уже ушёл, _ws остаётся None и матч отменится на пинге
+                entry._ws = self.local_sockets.pop(entry.user_id, None)
+            else:
+                remote = RemoteSocket(self, entry.user_id, worker_id)
+                self.remote_sockets[entry.user_id] = remote
+                entry._ws = remote
+                await self.notify(worker_id, {'t': 'relay', 'u': entry.user_id, 'host': self.worker_id})
+            players.append(entry)
+
+        self.on_match(players[0], players[1], msg['now'])
+
+    def _start_relay(self, user_id: int, host: str):
+        ws = self.relay_sockets.get(user_id)
+        if ws is None:
+            ws = self.local_sockets.pop(user_id, None)
+            if ws is None:
+                self._spawn(self.notify(host, {'t': 'in', 'u': user_id, 'm': None}))
+                return
+            self.relay_sockets[user_id] = ws
+
+        self._stop_relay(user_id, keep_socket=True)
+        task = asyncio.create_task(self._pump(user_id, ws, host))
+        task.add_done_callback(self._log_failure)
+        self.relays[user_id] = task
+
+    async def _pump(self, user_id: int, ws, host: str):
+        # всё, что пишет игрок, уходит воркеру, на котором идёт матч
+        try:
+            while True:
+                text = await ws.receive_text()
+                await self.notify(host, {'t': 'in', 'u': user_id, 'm': text[:MAX_RELAY_TEXT]})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.notify(host, {'t': 'in', 'u': user_id, 'm': None})
+
+    def _stop_relay(self, user_id: int, keep_socket: bool = False):
+        task = self.relays.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        if not keep_socket:
+            ws = self.relay_sockets.pop(user_id, None)
+            if ws is not None:  # снова в очереди на этом воркере
+                self.local_sockets.setdefault(user_id, ws)
+
+    async def _close_local(self, user_id: int):
+        task = self.relays.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        ws = self.relay_sockets.pop(user_id, None)
+        if ws is None:
+            ws = self.local_sockets.pop(user_id, None)
+        if ws is not None:
+            try:
+                await ws.close()
+            except Exception:
+                pass
+        self.on_release(user_id)
+
+
+def create_pvp_backend():
+    if settings.PVP_BACKEND == 'postgres':
+        dsn = settings.DATABASE_URL.replace('postgresql+asyncpg://', 'postgresql://')
+        return PostgresPvpBackend(dsn)
+    return InProcessPvpBackend()
@@ -0,0 +1,129 @@
+import hashlib
+import time
+from pydantic import TypeAdapter
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.constants import Subject, DifficultyLevel, Tag
+from app.core.database import engine, read_engine
+from app.core.models import TaskModel
+from app.schemas.task import TaskListItem
+from app.utils.cache import TTLCache
+
+CACHE_TTL = 60  # правки с других воркеров видны не позже чем через минуту
+CACHE_SIZE = 256
+DESCRIPTION_PREVIEW_LENGTH = 300
+
+_list_adapter = TypeAdapter(list[TaskListItem])
+
+
+class CataloguePage:
+    __slots__ = ('body', 'etag', 'next_cursor')
+
+    def __init__(self, body: bytes, etag: str, next_cursor: int | None):
+        self.body = body
+        self.etag = etag
+        self.next_cursor = next_cursor
+
+
+class TaskCatalogue:
+    """Каталог задач для GET /tasks/: версия (растет при правках задач админом) + кеш готовых страниц."""
+
+    def __init__(self):
+        self.version = 0
+        self.changed_at = float('-inf')  # time.monotonic() последней правки
+        self.cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+    def bump(self):
+        self.version += 1
+        self.changed_at = time.monotonic()
+        self.cache.clear()
+
+    def _replica_may_lag(self) -> bool:
+        return (
+            read_engine is not engine
+            and time.monotonic() - self.changed_at < settings.REPLICA_READ_YOUR_WRITES_SECONDS
+        )
+
+    async def get_page(
+            self,
+            session: AsyncSession,
+            search: str | None = None,
+            subject: Subject | None = None,
+            difficulty: DifficultyLevel | None = None,
+            tag: Tag | None = None,
+            limit: int | None = None,
+            after_id: int | None = None
+    ) -> CataloguePage:
+        # сразу после правки реплика может отставать: читаем с основной базы и не кешируем,
+        # иначе устаревшая страница закешировалась бы под новой версией и админ не увидел бы свою правку
+        if self._replica_may_lag():
+            session.info['read_only'] = False
+            cache_key = None
+        # кешируем только частые запросы: весь каталог и фильтр по предмету
+        elif search or difficulty or tag:
+            cache_key = None
+        else:
+            cache_key = (subject, limit, after_id)
+        if cache_key is not None:
+            page = self.cache.get(cache_key)
+            if page is not None:
+                return page
+
+        version = self.version
+        items = await self._load(session, search, subject, difficulty, tag, limit, after_id)
+
+        body = _list_adapter.dump_json(items)
+        etag = f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+        next_cursor = items[-1].id if limit and len(items) == limit else None
+        page = CataloguePage(body, etag, next_cursor)
+
+        # если пока шел запрос задачи поменялись, устаревшую страницу не кешируем
+        if cache_key is not None and version == self.version:
+            self.cache.set(cache_key, page)
+        return page
+
+    @staticmethod
+    async def _load(session, search, subject, difficulty, tag, limit, after_id) -> list[TaskListItem]:
+        query = (
+            select(
+                TaskModel.id,
+                TaskModel.title,
+                func.left(TaskModel.description, DESCRIPTION_PREVIEW_LENGTH).label('description'),
+                TaskModel.subject,
+                TaskModel.difficulty,
+                TaskModel.tags,
+            )
+            .where(TaskModel.is_active == True)
+            .order_by(TaskModel.id)
+        )
+
+        if subject:
+            query = query.where(TaskModel.subject == subject)
+
+        if difficulty:
+            query = query.where(TaskModel.difficulty == difficulty)
+
+        if tag:
+            query = query.where(TaskModel.tags.contains([tag]))
+
+        if search:
+            words = search.strip().split()
+            formatted_search = " & ".join([f"{word}:*" for word in words])
+
+            ts_query = func.to_tsquery('russian', formatted_search)
+            ts_vector = func.to_tsvector('russian', TaskModel.title + ' ' + TaskModel.description)
+
+            query = query.where(ts_vector.op('@@')(ts_query))
+
+        if after_id is not None:
+            query = query.where(TaskModel.id > after_id)
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        rows = (await session.execute(query)).all()
+        return [TaskListItem.model_validate(row) for row in rows]
+
+
+task_catalogue = TaskCatalogue()
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from app.core.constants import Subject, DifficultyLevel
+from app.core.database import new_read_session
+from app.core.models import TaskModel
+from app.schemas.task import TaskAdminRead
+
+EXPORT_BATCH_SIZE = 500  # строк за одну выборку курсора и один кусок ответа
+
+CSV_FIELDS = list(TaskAdminRead.model_fields)
+
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_chunk(rows: list[dict], first: bool) -> str:
+    body = ',\n'.join(json.dumps(row, ensure_ascii=False, indent=4) for row in rows)
+    return body if first else ',\n' + body
+
+
+def _ndjson_chunk(rows: list[dict]) -> str:
+    return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+
+def _csv_chunk(rows: list[dict]) -> str:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_FIELDS)
+    for row in rows:
+        row['tags'] = ", ".join(row['tags']) if isinstance(row['tags'], list) else ""
+        writer.writerow(row)
+    return output.getvalue()
+
+
+async def _text_chunks(export_format: str, query):
+    if export_format == 'json':
+        yield '['
+    elif export_format == 'csv':
+        # BOM, чтобы Excel открыл кириллицу
+        yield '\ufeff' + ','.join(CSV_FIELDS) + '\r\n'
+
+    first = True
+    # своя сессия: сессия запроса закрывается раньше, чем отдается тело ответа
+    async with new_read_session() as session:
+        result = await session.stream_scalars(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for tasks in result.partitions():
+            rows = [TaskAdminRead.model_validate(t).model_dump(mode='json') for t in tasks]
+            session.expunge_all()
+
+            if export_format == 'json':
+                yield _json_chunk(rows, first)
+            elif export_format == 'ndjson':
+                yield _ndjson_chunk(rows)
+            else:
+                yield _csv_chunk(rows)
+            first = False
+
+    if export_format == 'json':
+        yield ']'
+
+
+async def stream_tasks_export(
+        export_format: str,
+        subject: Subject | None = None,
+        difficulty: DifficultyLevel | None = None,
+        updated_since: datetime | None = None,
+        gzip: bool = False
+):
+    """Отдает экспорт кусками по мере чтения из серверного курсора, в памяти не больше одной пачки."""
+    query = select(TaskModel).where(TaskModel.is_active == True).order_by(TaskModel.id)
+
+    if subject:
+        query = query.where(TaskModel.subject == subject)
+
+    if difficulty:
+        query = query.where(TaskModel.difficulty == difficulty)
+
+    if updated_since:
+        query = query.where(TaskModel.updated_at >= updated_since)
+
+    compressor = zlib.compressobj(wbits=31) if gzip else None  # wbits=31 - формат gzip
+
+    async for chunk in _text_chunks(export_format, query):
+        data = chunk.encode('utf-8')
+        if compressor is None:
+            yield data
+        else:
+            compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,206 @@
+import csv
+import json
+import os
+import uuid
+from fastapi import HTTPException
+from sqlalchemy import func, text, literal_column, select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.core.database import new_session
+from app.core.models import TaskModel, AuditLogModel, TaskImportJobModel
+from app.services.task_catalogue import task_catalogue
+from app.services.task_pool import task_pool
+from app.utils.formatters import validate_task_data
+
+IMPORT_CHUNK_SIZE = 1000  # задач в одном INSERT ... ON CONFLICT и одной транзакции
+READ_CHUNK_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_REPORTED_ERRORS = 1000
+MAX_STORED_JOBS = 50
+
+JOB_FIELDS = ('status', 'filename', 'processed', 'created', 'updated', 'skipped', 'error_count', 'errors', 'message')
+
+
+def _iter_json_array(f):
+    """Читает массив JSON-объектов по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = f.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Неверная структура данных: ожидался список задач')
+    buffer = buffer[1:]
+    eof = False
+
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def _iter_csv(f):
+    for row in csv.DictReader(f):
+        if 'tags' in row and row['tags']:
+            row['tags'] = [t.strip() for t in row['tags'].split(',')]
+        else:
+            row['tags'] = []
+        yield row
+
+
+def _check_text_fields(data: dict):
+    # иначе строка с числом вместо текста уронила бы INSERT всей пачки
+    for field in ('title', 'description', 'hint', 'correct_answer'):
+        value = data[field]
+        if value is None and field == 'hint':
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            data[field] = str(value)
+        elif not isinstance(value, str):
+            raise ValueError(f"поле '{field}' должно быть строкой")
+
+
+async def create_import_job(filename: str, admin_id: int) -> str:
+    job_id = uuid.uuid4().hex
+    async with new_session() as session:
+        # старые завершенные импорты забываем, чтобы отчеты не копились в базе
+        keep = (
+            select(TaskImportJobModel.id)
+            .order_by(TaskImportJobModel.created_at.desc())
+            .limit(MAX_STORED_JOBS)
+        )
+        await session.execute(
+            delete(TaskImportJobModel)
+            .where(TaskImportJobModel.status != 'running', TaskImportJobModel.id.not_in(keep))
+        )
+        session.add(TaskImportJobModel(id=job_id, admin_id=admin_id, filename=filename))
+        await session.commit()
+    return job_id
+
+
+async def get_import_job(session, job_id: str) -> dict | None:
+    job = await session.get(TaskImportJobModel, job_id)
+    if job is None:
+        return None
+    return {field: getattr(job, field) for field in JOB_FIELDS}
+
+
+async def _save_job(job_id: str, job: dict):
+    # ход импорта пишется в таблицу: GET статуса может прийти в любой воркер
+    async with new_session() as session:
+        await session.execute(
+            update(TaskImportJobModel).where(TaskImportJobModel.id == job_id)
+            .values({field: job[field] for field in JOB_FIELDS if field != 'filename'})
+        )
+        await session.commit()
+
+
+async def _write_chunk(rows: list[dict], job: dict):
+    # в одном INSERT одно название может встретиться только раз, побеждает последняя строка
+    unique_rows = list({row['title']: row for row in rows}.values())
+
+    insert_query = pg_insert(TaskModel).values(unique_rows)
+    upsert_query = insert_query.on_conflict_do_update(
+        index_elements=[TaskModel.title],
+        index_where=text('is_active'),
+        set_={
+            'description': insert_query.excluded.description,
+            'subject': insert_query.excluded.subject,
+            'tags': insert_query.excluded.tags,
+            'hint': insert_query.excluded.hint,
+            'difficulty': insert_query.excluded.difficulty,
+            'correct_answer': insert_query.excluded.correct_answer,
+            'updated_at': func.now(),
+        }
+    ).returning(
+        TaskModel.id, TaskModel.subject, TaskModel.difficulty, TaskModel.correct_answer, TaskModel.is_active,
+        literal_column('xmax = 0').label('inserted')  # xmax = 0 - строка вставлена, иначе обновлена
+    )
+
+    async with new_session() as session:
+        result = (await session.execute(upsert_query)).all()
+        await session.commit()
+
+    for row in result:
+        task_pool.upsert(row)
+        if row.inserted:
+            job['created'] += 1
+        else:
+            job['updated'] += 1
+
+
+async def run_import(job_id: str, filename: str, path: str, admin_id: int):
+    """Фоновый импорт: строки с ошибками попадают в отчет, остальные пишутся пачками по IMPORT_CHUNK_SIZE."""
+    job = {
+        'status': 'running',
+        'filename': filename,
+        'processed': 0,
+        'created': 0,
+        'updated': 0,
+        'skipped': 0,
+        'error_count': 0,
+        'errors': [],
+        'message': None,
+    }
+    batch = []
+
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            rows = _iter_json_array(f) if job['filename'].endswith('.json') else _iter_csv(f)
+
+            for index, item in enumerate(rows):
+                job['processed'] += 1
+                if job['processed'] % IMPORT_CHUNK_SIZE == 0:
+                    await _save_job(job_id, job)
+                try:
+                    if not isinstance(item, dict):
+                        raise ValueError('ожидался объект задачи')
+                    validated_data = validate_task_data(index, item)
+                    if validated_data:
+                        _check_text_fields(validated_data)
+                except Exception as e:
+                    # любая ошибка строки (в т.ч. null или число вместо строки) - в отчет, импорт продолжается
+                    detail = e.detail if isinstance(e, HTTPException) else f"Ошибка в строке {index + 1}: {e}"
+                    job['error_count'] += 1
+                    if len(job['errors']) < MAX_REPORTED_ERRORS:
+                        job['errors'].append({'row': index + 1, 'error': detail})
+                    continue
+
+                if not validated_data:
+                    job['skipped'] += 1
+                    continue
+
+                batch.append(validated_data)
+                if len(batch) >= IMPORT_CHUNK_SIZE:
+                    await _write_chunk(batch, job)
+                    batch = []
+
+        if batch:
+            await _write_chunk(batch, job)
+
+        job['status'] = 'finished'
+        job['message'] = 'Импорт завершен успешно'
+    except Exception as e:
+        job['status'] = 'failed'
+        job['message'] = f"Ошибка при импорте: {e}"
+    finally:
+        os.remove(path)
+        if job['created'] or job['updated']:
+            task_catalogue.bump()
+        await _save_job(job_id, job)
+
+        async with new_session() as session:
+            session.add(AuditLogModel(
+                admin_id=admin_id,
+                action="import_tasks",
+                details=f"File: {job['filename']}. Created: {job['created']}, Updated: {job['updated']}, "
+                        f"Errors: {job['error_count']}, Status: {job['status']}"
+            ))
+            await session.commit()
@@ -0,0 +1,129 @@
+import asyncio
+import random
+import time
+from sqlalchemy import select
+from app.core.constants import Subject, DifficultyLevel
+from app.core.database import new_session
+from app.core.models import TaskModel
+from app.utils.formatters import format_answer
+
+REFRESH_INTERVAL = 300  # полная перезагрузка раз в 5 минут, чтобы подтянуть правки с других воркеров
+
+
+class _IdSet:
+    # список + позиции: добавление/удаление за O(1), выборка k элементов за O(k)
+    __slots__ = ('ids', 'positions')
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, task_id: int):
+        if task_id in self.positions:
+            return
+        self.positions[task_id] = len(self.ids)
+        self.ids.append(task_id)
+
+    def discard(self, task_id: int):
+        pos = self.positions.pop(task_id, None)
+        if pos is None:
+            return
+        last = self.ids.pop()
+        if last != task_id:
+            self.ids[pos] = last
+            self.positions[last] = pos
+
+    def sample(self, k: int) -> list[int]:
+        if k > len(self.ids):
+            return list(self.ids)
+        return random.sample(self.ids, k)
+
+
+class TaskPool:
+    """Активные задачи в памяти для старта PvP матчей: id + уже нормализованный правильный ответ."""
+
+    def __init__(self):
+        self.answers = {}  # task_id -> format_answer(correct_answer)
+        self.keys = {}  # task_id -> (subject, difficulty)
+        self.all = _IdSet()
+        self.partitions = {}  # (subject, difficulty) -> _IdSet
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        async with new_session() as session:
+            query = (
+                select(TaskModel.id, TaskModel.subject, TaskModel.difficulty, TaskModel.correct_answer)
+                .where(TaskModel.is_active == True)
+            )
+            rows = (await session.execute(query)).all()
+
+        self.answers.clear()
+        self.keys.clear()
+        self.all = _IdSet()
+        self.partitions = {}
+        for row in rows:
+            self._add(row.id, row.subject, row.difficulty, row.correct_answer)
+        self.loaded_at = time.monotonic()
+
+    async def ensure_loaded(self):
+        if time.monotonic() - self.loaded_at < REFRESH_INTERVAL:
+            return
+        async with self._lock:
+            if time.monotonic() - self.loaded_at >= REFRESH_INTERVAL:
+                await self.refresh()
+
+    def invalidate(self):
+        self.loaded_at = 0.0
+
+    def upsert(self, task: TaskModel):
+        self.discard(task.id)
+        if task.is_active:
+            self._add(task.id, task.subject, task.difficulty, task.correct_answer)
+
+    def discard(self, task_id: int):
+        key = self.keys.pop(task_id, None)
+        if key is None:
+            return
+        del self.answers[task_id]
+        self.all.discard(task_id)
+        self.partitions[key].discard(task_id)
+
+    def get_answer(self, task_id: int) -> str | None:
+        return self.answers.get(task_id)
+
+    async def sample(
+            self,
+            k: int,
+            subject: Subject | None = None,
+            difficulty: DifficultyLevel | None = None
+    ) -> dict[int, str]:
+        await self.ensure_loaded()
+
+        if subject is None and difficulty is None:
+            ids = self.all.sample(k)
+        elif subject is not None and difficulty is not None:
+            ids = self.partitions.get((Subject(subject), DifficultyLevel(difficulty)), _IdSet()).sample(k)
+        else:
+            candidates = [
+                task_id
+                for (subj, diff), id_set in self.partitions.items()
+                if subject in (None, subj) and difficulty in (None, diff)
+                for task_id in id_set.ids
+            ]
+            ids = random.sample(candidates, min(k, len(candidates)))
+
+        return {task_id: self.answers[task_id] for task_id in ids}
+
+    def _add(self, task_id: int, subject, difficulty, correct_answer: str):
+        key = (Subject(subject), DifficultyLevel(difficulty))
+        self.answers[task_id] = format_answer(str(correct_answer))
+        self.keys[task_id] = key
+        self.all.add(task_id)
+        self.partitions.setdefault(key, _IdSet()).add(task_id)
+
+
+task_pool = TaskPool()
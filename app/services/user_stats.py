@@ -1,62 +1,38 @@
 from fastapi import HTTPException,status
-from sqlalchemy import select, func, or_, distinct
+from sqlalchemy import select, func, or_, and_, distinct, delete
 from app.core.constants import Achievement
-from app.core.models import AttemptModel, TaskModel, EloHistoryModel, UserModel
+from app.core.database import new_session
+from app.core.models import AttemptModel, TaskModel, EloHistoryModel, UserModel, UserSubjectStatsModel
 from app.schemas.user import SubjectStats, UserStatsResponse, UserProfileRead
 from app.utils.levels import calculate_level_info
 
+CHECK_BATCH_SIZE = 500
+
+subject_stats_check = {}  # ход последней сверки user_subject_stats
+
 
 async def calculate_user_stats(
         session,
         user_id: int,
 ):
-
-    first_success_subquery = (
-        select(
-            AttemptModel.task_id,
-            func.min(AttemptModel.created_at).label('first_correct_at')
-        )
-        .where(
-            AttemptModel.user_id == user_id,
-            AttemptModel.is_correct == True
-        )
-        .group_by(AttemptModel.task_id)
-        .subquery()
-    )
-
-    subject_query = (
-        select(
-            TaskModel.subject,
-            func.avg(AttemptModel.time_spent).filter(AttemptModel.is_correct == True).label('avg_speed'),
-            func.count(AttemptModel.id).label('attempts_count'),
-            func.count(func.distinct(AttemptModel.task_id)).filter(AttemptModel.is_correct == True).label(
-                'correct_count')
-        )
-        .join(AttemptModel, TaskModel.id == AttemptModel.task_id)
-        .outerjoin(first_success_subquery, AttemptModel.task_id == first_success_subquery.c.task_id)
-        .where(
-            AttemptModel.user_id == user_id,
-            TaskModel.is_active == True,
-            or_(
-                first_success_subquery.c.first_correct_at == None,
-                AttemptModel.created_at <= first_success_subquery.c.first_correct_at
-            )
-        )
-        .group_by(TaskModel.subject)
+    # таблицу ведет проверка ответов, здесь только чтение готовых счетчиков
+    query = (
+        select(UserSubjectStatsModel)
+        .where(UserSubjectStatsModel.user_id == user_id)
+        .order_by(UserSubjectStatsModel.subject)
     )
-
-    result = await session.execute(subject_query)
-    subject_rows = result.all()
+    result = await session.execute(query)
+    subject_rows = result.scalars().all()
 
     subject_breakdown = []
 
     for row in subject_rows:
         subj_attempts = row.attempts_count or 0
-        subj_correct = row.correct_count or 0
+        subj_correct = row.solved_count or 0
 
         accuracy = round((subj_correct / subj_attempts * 100), 1) if subj_attempts > 0 else 0.0
 
-        avg_time = round(float(row.avg_speed), 1) if row.avg_speed else 0.0
+        avg_time = round(row.solve_time_total / subj_correct, 1) if subj_correct > 0 else 0.0
 
         subject_breakdown.append(SubjectStats(
             subject=row.subject,
@@ -69,6 +45,125 @@ async def calculate_user_stats(
     return UserStatsResponse(stats=subject_breakdown)
 
 
+def _expected_subject_stats(user_ids: list[int]):
+    # то же, что накапливает проверка ответов, но посчитанное заново по attempts
+    first_success_subquery = (
+        select(
+            AttemptModel.user_id,
+            AttemptModel.task_id,
+            func.min(AttemptModel.created_at).label('first_correct_at')
+        )
+        .where(AttemptModel.user_id.in_(user_ids), AttemptModel.is_correct == True)
+        .group_by(AttemptModel.user_id, AttemptModel.task_id)
+        .subquery()
+    )
+    first_correct_at = first_success_subquery.c.first_correct_at
+
+    return (
+        select(
+            AttemptModel.user_id,
+            TaskModel.subject,
+            func.count(AttemptModel.id).filter(
+                or_(first_correct_at == None, AttemptModel.created_at <= first_correct_at)
+            ).label('attempts_count'),
+            func.count(distinct(AttemptModel.task_id)).filter(AttemptModel.is_correct == True).label('solved_count'),
+            func.coalesce(
+                func.sum(AttemptModel.time_spent).filter(
+                    AttemptModel.is_correct == True, AttemptModel.created_at == first_correct_at
+                ),
+                0
+            ).label('solve_time_total'),
+        )
+        .join(TaskModel, TaskModel.id == AttemptModel.task_id)
+        .outerjoin(
+            first_success_subquery,
+            and_(
+                AttemptModel.user_id == first_success_subquery.c.user_id,
+                AttemptModel.task_id == first_success_subquery.c.task_id
+            )
+        )
+        .where(AttemptModel.user_id.in_(user_ids))
+        .group_by(AttemptModel.user_id, TaskModel.subject)
+    )
+
+
+async def _load_expected_stats(session, user_ids) -> dict:
+    if not user_ids:
+        return {}
+    return {
+        (row.user_id, row.subject): (row.attempts_count, row.solved_count, row.solve_time_total)
+        for row in (await session.execute(_expected_subject_stats(user_ids))).all()
+    }
+
+
+async def check_user_subject_stats(fix: bool = False, batch_size: int = CHECK_BATCH_SIZE) -> dict:
+    """
+    Сверяет user_subject_stats с пересчетом по attempts пачками пользователей.
+    С fix=True расходящиеся пользователи пересобираются, каждая пачка - отдельная транзакция.
+    """
+    report = {'checked': 0, 'mismatched': 0, 'fixed': 0, 'finished': False}
+    subject_stats_check.clear()
+    subject_stats_check.update(report)
+    last_id = 0
+
+    try:
+        while True:
+            async with new_session() as session:
+                ids_query = select(UserModel.id).where(UserModel.id > last_id).order_by(UserModel.id).limit(batch_size)
+                user_ids = (await session.execute(ids_query)).scalars().all()
+                if not user_ids:
+                    break
+
+                expected = await _load_expected_stats(session, user_ids)
+                stored_query = select(UserSubjectStatsModel).where(UserSubjectStatsModel.user_id.in_(user_ids))
+                stored = {
+                    (row.user_id, row.subject): (row.attempts_count, row.solved_count, row.solve_time_total)
+                    for row in (await session.execute(stored_query)).scalars().all()
+                }
+
+                mismatched = {key[0] for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key)}
+                subject_stats_check['mismatched'] += len(mismatched)
+
+                if fix and mismatched:
+                    # проверка ответа сначала обновляет строку users, потом user_subject_stats: держим строки
+                    # пользователей до коммита и пересчитываем уже под блокировкой, иначе перезапись затрет
+                    # счетчики, которые параллельный ответ успел прибавить после первого пересчета
+                    lock_query = (
+                        select(UserModel.id)
+                        .where(UserModel.id.in_(mismatched))
+                        .order_by(UserModel.id)
+                        .with_for_update()
+                    )
+                    locked = (await session.execute(lock_query)).scalars().all()
+                    expected = await _load_expected_stats(session, locked)
+
+                    await session.execute(
+                        delete(UserSubjectStatsModel).where(UserSubjectStatsModel.user_id.in_(locked))
+                    )
+                    session.add_all([
+                        UserSubjectStatsModel(
+                            user_id=user_id,
+                            subject=subject,
+                            attempts_count=values[0],
+                            solved_count=values[1],
+                            solve_time_total=values[2]
+                        )
+                        for (user_id, subject), values in expected.items()
+                    ])
+                    await session.commit()
+                    subject_stats_check['fixed'] += len(locked)
+
+            last_id = user_ids[-1]
+            subject_stats_check['checked'] += len(user_ids)
+    except Exception as e:
+        # иначе сверка навсегда осталась бы "идет" и новый запуск получал бы 409
+        subject_stats_check['error'] = f"Ошибка после пользователя {last_id}: {e}"
+        print(f'Ошибка сверки user_subject_stats: {e}')
+    finally:
+        subject_stats_check['finished'] = True
+    return dict(subject_stats_check)
+
+
 async def calculate_elo_history(
         session,
         user_id: int,
@@ -90,7 +185,8 @@ async def calculate_profile_info(
         session,
         user_id: int
 ):
-    current_user : UserModel = await session.get(UserModel,user_id)
+    # populate_existing: в сессии может лежать снимок пользователя из кеша get_current_user
+    current_user : UserModel = await session.get(UserModel, user_id, populate_existing=True)
 
     if not current_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='Пользователь не найден')
@@ -103,39 +199,9 @@ async def calculate_profile_info(
     else:
         formatted_achievements = []
 
-    first_success_subquery = (
-        select(
-            AttemptModel.task_id,
-            func.min(AttemptModel.created_at).label('first_correct_at')
-        )
-        .where(
-            AttemptModel.user_id == current_user.id,
-            AttemptModel.is_correct == True
-        )
-        .group_by(AttemptModel.task_id)
-        .subquery()
-    )
-
-    query = (
-        select(
-            func.count(AttemptModel.id).label('total'),
-            func.count(distinct(AttemptModel.task_id)).filter(AttemptModel.is_correct == True).label('unique_solved')
-        )
-        .outerjoin(first_success_subquery, AttemptModel.task_id == first_success_subquery.c.task_id)
-        .where(
-            AttemptModel.user_id == current_user.id,
-            or_(
-                first_success_subquery.c.first_correct_at == None,  # Задача еще не решена
-                AttemptModel.created_at <= first_success_subquery.c.first_correct_at  # Попытки до успеха
-            )
-        )
-    )
-
-    result = await session.execute(query)
-    stats = result.one()
-
-    total = stats.total or 0
-    unique_solved = stats.unique_solved or 0
+    # счетчики ведет проверка ответов: попытки до первого верного ответа и число решенных задач
+    total = current_user.attempts_until_solved_count or 0
+    unique_solved = current_user.solved_tasks_count or 0
 
     success_rate = round((unique_solved / total * 100), 1) if total > 0 else 0.0
 
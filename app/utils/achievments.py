@@ -1,39 +1,103 @@
-from app.core.models import UserModel, AttemptModel
-from app.core.constants import Achievement
-from sqlalchemy import select, func,distinct
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy import select, update, case, literal, not_, func
+from sqlalchemy.dialects.postgresql import JSONB
+from app.core.models import UserModel
+from app.core.constants import Achievement, AchievementCounter
+from app.core.database import new_session
+from app.core.dependencies import invalidate_user
 
+# значение счетчика в SQL (для массовой перепроверки)
+COUNTER_COLUMNS = {
+    AchievementCounter.SOLVED_TASKS: UserModel.solved_tasks_count,
+    AchievementCounter.HAS_AVATAR: case((UserModel.avatar_url != None, 1), else_=0),
+}
 
-async def check_and_award_achievement(user: UserModel, session) -> list[str]:
+# какие достижения зависят от счетчика: при событии проверяются только они
+ACHIEVEMENTS_BY_COUNTER = {}
+for _achievement in Achievement:
+    ACHIEVEMENTS_BY_COUNTER.setdefault(_achievement.rule[0], []).append(_achievement)
 
-    if user.all_achievements is None:
-        user.all_achievements = []
-    new_achievements_labels = []
-    current_achievements_values = {str(a) for a in user.all_achievements}
+REEVALUATE_BATCH_SIZE = 1000
 
-    query = select(func.count(distinct(AttemptModel.task_id))).where(
-        AttemptModel.user_id == user.id,
-        AttemptModel.is_correct == True
-    )
-    result = await session.execute(query)
-    solved_tasks_count = result.scalar() or 0
+reevaluation_status = {}  # achievement -> {'processed': ..., 'awarded': ..., 'finished': ...}
 
-    if solved_tasks_count >= 1 and Achievement.FIRST_STEP.value not in current_achievements_values:
-        user.all_achievements.append(Achievement.FIRST_STEP)
-        new_achievements_labels.append(Achievement.FIRST_STEP.label)
 
-    #Гуру
-    if solved_tasks_count >= 10 and Achievement.GURU.value not in current_achievements_values:
-        user.all_achievements.append(Achievement.GURU)
-        new_achievements_labels.append(Achievement.GURU.label)
+def find_new_achievements(user: UserModel, changed: dict[AchievementCounter, int]) -> list[Achievement]:
+    """Какие достижения пользователь заработал по изменившимся счетчикам, но еще не получил. Без запросов к базе."""
+    current_achievements_values = {str(a) for a in user.all_achievements or []}
+    new_achievements = []
 
-    #аватарка
-    if user.avatar_url and Achievement.PROFILE_MASTER.value not in current_achievements_values:
-        user.all_achievements.append(Achievement.PROFILE_MASTER)
-        new_achievements_labels.append(Achievement.PROFILE_MASTER.label)
+    for counter, value in changed.items():
+        for achievement in ACHIEVEMENTS_BY_COUNTER.get(counter, ()):
+            threshold = achievement.rule[1]
+            if value >= threshold and achievement.value not in current_achievements_values:
+                new_achievements.append(achievement)
 
-    if new_achievements_labels:
-        flag_modified(user, "all_achievements")
-        await session.flush()
+    return new_achievements
 
-    return new_achievements_labels
\ No newline at end of file
+
+def current_achievements():
+    # SQL NULL и JSON null (так ORM сохраняет None) считаем пустым списком, иначе || и @> дают не то
+    return func.coalesce(func.nullif(UserModel.all_achievements, literal(None, JSONB)), literal([], JSONB))
+
+
+def append_achievements(achievements: list[Achievement]):
+    """SQL-выражение для all_achievements: дописывает достижения, которых в строке еще нет.
+
+    Считается по текущей строке в базе, а не по объекту пользователя: тот мог прийти из кеша.
+    """
+    result = current_achievements()
+    for achievement in achievements:
+        value = literal([achievement.value], JSONB)
+        result = case((result.contains(value), result), else_=result.op('||')(value))
+    return result
+
+
+async def reevaluate_achievement(achievement: Achievement, batch_size: int = REEVALUATE_BATCH_SIZE):
+    """
+    Выдает достижение всем, кто подходит под правило (например, после добавления нового достижения).
+    Идет по пользователям пачками по id, каждая пачка - отдельная короткая транзакция.
+    """
+    counter, threshold = achievement.rule
+    value = literal([achievement.value], JSONB)
+    job_status = {'processed': 0, 'awarded': 0, 'finished': False}
+    reevaluation_status[achievement.value] = job_status
+    last_id = 0
+
+    try:
+        while True:
+            async with new_session() as session:
+                ids_query = (
+                    select(UserModel.id)
+                    .where(UserModel.id > last_id)
+                    .order_by(UserModel.id)
+                    .limit(batch_size)
+                )
+                ids = (await session.execute(ids_query)).scalars().all()
+                if not ids:
+                    break
+
+                # all_achievements может быть NULL: без приведения к [] такие пользователи никогда не подходили бы
+                award_query = (
+                    update(UserModel)
+                    .where(
+                        UserModel.id.in_(ids),
+                        COUNTER_COLUMNS[counter] >= threshold,
+                        not_(current_achievements().contains(value))
+                    )
+                    .values(all_achievements=append_achievements([achievement]))
+                    .returning(UserModel.id)
+                )
+                awarded = (await session.execute(award_query)).scalars().all()
+                await session.commit()
+
+            for user_id in awarded:
+                invalidate_user(user_id)
+            last_id = ids[-1]
+            job_status['processed'] += len(ids)
+            job_status['awarded'] += len(awarded)
+    except Exception as e:
+        # иначе статус навсегда остался бы "идет" и повторный запуск получал бы 409
+        job_status['error'] = f"Ошибка после пользователя {last_id}: {e}"
+        print(f'Ошибка перепроверки достижения {achievement.value}: {e}')
+    finally:
+        job_status['finished'] = True
@@ -1,7 +1,13 @@
+import asyncio
 import math
-from app.core.database import new_session
-from app.core.models import UserModel
+from collections import defaultdict
+from sqlalchemy import select, update, values, column, func, cast, case, Integer, Float, Numeric
+from app.core.database import new_session, mark_user_write
+from app.core.models import UserModel, PvPMatchModel, EloHistoryModel
 from app.core.constants import RankName
+from app.schemas.matchmaking import MatchSettlement
+from app.core.dependencies import invalidate_user
+from app.services.leaderboard import leaderboard
 from fastapi import status, HTTPException
 WIN = 1.0
 DRAW = 0.5
@@ -22,22 +28,132 @@ def calculate_elo_change(
     return round(float(rating_change),1)
 
 
-# увеличивает/уменьшает elo пользователю и возвращает получившееся значение
-async def change_elo(
-    user_id: int,
-    elochange: float
-) -> float:
+class SettlementBatcher:
+    """
+    Групповая запись результатов матчей.
+
+    Пока идёт одна транзакция, новые результаты копятся и уходят следующей пачкой:
+    при одиночных матчах задержки нет, под нагрузкой много матчей пишутся одним коммитом.
+    """
+
+    def __init__(self, max_batch: int = 100):
+        self.max_batch = max_batch
+        self.pending: list[tuple[MatchSettlement, asyncio.Future]] = []
+        self.flushing = False
+        self.tasks = set()  # держим ссылку на задачу записи, иначе GC может собрать ее посреди пачки
+
+    async def submit(self, settlement: MatchSettlement) -> tuple[float, float]:
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((settlement, fut))
+        if not self.flushing:
+            self.flushing = True
+            task = asyncio.create_task(self._flush_loop())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return await fut
+
+    async def _flush_loop(self):
+        try:
+            while self.pending:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                try:
+                    results = await settle_batch([s for s, _ in batch])
+                except Exception as e:
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+
+                for (_, fut), result in zip(batch, results):
+                    if fut.done():
+                        continue
+                    if result is None:
+                        fut.set_exception(HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден"))
+                    else:
+                        fut.set_result(result)
+        finally:
+            self.flushing = False
+
+
+def rank_case(rating_expr):
+    return case(
+        *[(rating_expr >= rank["min_elo"], rank["name"].value) for rank in ELO_RANKS],
+        else_=RankName.BRONZE.value
+    )
+
+
+# применяет изменения эло и пишет матчи + историю одной транзакцией, возвращает рейтинги (p1, p2) после матча
+async def settle_batch(settlements: list[MatchSettlement]) -> list[tuple[float, float] | None]:
+    user_ids = sorted({s.player1_id for s in settlements} | {s.player2_id for s in settlements})
+
     async with new_session() as session:
-        user = await session.get(UserModel, user_id)
+        # сначала блокируем строки игроков (в одном порядке - без взаимоблокировок): если кого-то удалили
+        # во время матча, его матч пропускаем целиком, рейтинг соперника тоже не меняется
+        lock_query = select(UserModel.id).where(UserModel.id.in_(user_ids)).order_by(UserModel.id).with_for_update()
+        existing = set((await session.execute(lock_query)).scalars())
+        valid = [s for s in settlements if s.player1_id in existing and s.player2_id in existing]
 
-        if not user:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="Пользователь не найден")
+        deltas = defaultdict(float)
+        for s in valid:
+            deltas[s.player1_id] += s.p1_change
+            deltas[s.player2_id] += s.p2_change
+
+        ratings = {}
+        if deltas:
+            changes = values(
+                column('user_id', Integer),
+                column('delta', Float),
+                name='elo_changes'
+            ).data(list(deltas.items()))
+
+            new_rating = func.round(cast(UserModel.rating + changes.c.delta, Numeric), 1)
+
+            update_query = (
+                update(UserModel)
+                .where(UserModel.id == changes.c.user_id)
+                .values(rating=new_rating, user_rank=rank_case(new_rating))
+                .returning(UserModel.id, UserModel.rating)
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(update_query)
+            ratings = {row.id: float(row.rating) for row in result}
+
+        results = []
+        for s in settlements:
+            if s.player1_id not in ratings or s.player2_id not in ratings:  # пользователя удалили во время матча
+                results.append(None)
+                continue
+
+            r1 = ratings[s.player1_id]
+            r2 = ratings[s.player2_id]
+            session.add(PvPMatchModel(
+                player1_id=s.player1_id,
+                player2_id=s.player2_id,
+                result=s.result,
+                p1_elo_change=float(s.p1_change),
+                p2_elo_change=float(s.p2_change)
+            ))
+            session.add(EloHistoryModel(user_id=s.player1_id, rating=r1, change=float(s.p1_change)))
+            session.add(EloHistoryModel(user_id=s.player2_id, rating=r2, change=float(s.p2_change)))
+            results.append((r1, r2))
 
-        user.rating = round(float(user.rating + elochange), 1)
-        new_rank = get_rank_by_elo(user.rating)
-        user.user_rank = new_rank
         await session.commit()
-        return user.rating
+
+    for user_id in deltas:
+        invalidate_user(user_id)
+        mark_user_write(user_id)
+    for user_id, rating in ratings.items():
+        leaderboard.update_rating(user_id, rating, get_rank_by_elo(rating))
+
+    return results
+
+
+settlement_batcher = SettlementBatcher()
+
+
+async def settle_match(settlement: MatchSettlement) -> tuple[float, float]:
+    return await settlement_batcher.submit(settlement)
 
 
 def get_rank_by_elo(elo: float) -> RankName:
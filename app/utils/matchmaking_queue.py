@@ -0,0 +1,130 @@
+import random
+
+MAX_LEVEL = 32  # хватает на миллиарды записей при P = 0.25
+P = 0.25
+
+
+class _Node:
+    __slots__ = ('key', 'entry', 'next', 'prev')
+
+    def __init__(self, key, entry, level: int):
+        self.key = key
+        self.entry = entry
+        self.next = [None] * level
+        self.prev = [None] * level
+
+
+class MatchmakingQueue:
+    """
+    Очередь поиска матча, отсортированная по (rating, joined_at).
+
+    Двусвязный skip-list + словарь user_id -> узел: вставка за O(log n),
+    удаление по user_id за O(1) (узел знает соседей на всех уровнях),
+    без сдвигов списка и без пересборки очереди при подборе пар.
+    """
+
+    def __init__(self):
+        self._head = _Node(None, None, MAX_LEVEL)
+        self._level = 1
+        self._nodes = {}  # user_id -> _Node
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._nodes
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.entry
+            node = node.next[0]
+
+    def get(self, user_id: int):
+        node = self._nodes.get(user_id)
+        return node.entry if node is not None else None
+
+    def add(self, entry):
+        # у пользователя может быть только одна запись, старая заменяется
+        self.discard(entry.user_id)
+
+        key = (entry.rating, entry.joined_at, entry.user_id)
+        update = [self._head] * MAX_LEVEL
+        node = self._head
+        for lvl in range(self._level - 1, -1, -1):
+            while node.next[lvl] is not None and node.next[lvl].key < key:
+                node = node.next[lvl]
+            update[lvl] = node
+
+        level = self._random_level()
+        self._level = max(self._level, level)
+
+        new_node = _Node(key, entry, level)
+        for lvl in range(level):
+            prev = update[lvl]
+            nxt = prev.next[lvl]
+            new_node.prev[lvl] = prev
+            new_node.next[lvl] = nxt
+            prev.next[lvl] = new_node
+            if nxt is not None:
+                nxt.prev[lvl] = new_node
+
+        self._nodes[entry.user_id] = new_node
+
+    def discard(self, user_id: int):
+        node = self._nodes.get(user_id)
+        if node is None:
+            return None
+        self._unlink(node)
+        return node.entry
+
+    def remove(self, entry) -> bool:
+        # удаляем только если в очереди лежит именно эта запись, а не более новая после переподключения
+        node = self._nodes.get(entry.user_id)
+        if node is None or node.entry is not entry:
+            return False
+        self._unlink(node)
+        return True
+
+    def neighbours(self, user_id: int):
+        node = self._nodes.get(user_id)
+        if node is None:
+            return None, None
+        prev = node.prev[0]
+        nxt = node.next[0]
+        return (prev.entry if prev is not self._head else None), (nxt.entry if nxt is not None else None)
+
+    def pair_adjacent(self, can_pair) -> list[tuple]:
+        """Один проход по соседям в порядке рейтинга: подходящие пары сразу вынимаются из очереди."""
+        pairs = []
+        node = self._head.next[0]
+        while node is not None and node.next[0] is not None:
+            other = node.next[0]
+            if can_pair(node.entry, other.entry):
+                after = other.next[0]
+                self._unlink(node)
+                self._unlink(other)
+                pairs.append((node.entry, other.entry))
+                node = after
+            else:
+                node = other
+        return pairs
+
+    def _unlink(self, node: _Node):
+        for lvl in range(len(node.next)):
+            prev = node.prev[lvl]
+            nxt = node.next[lvl]
+            prev.next[lvl] = nxt
+            if nxt is not None:
+                nxt.prev[lvl] = prev
+        del self._nodes[node.entry.user_id]
+
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < MAX_LEVEL and random.random() < P:
+            level += 1
+        return level
@@ -0,0 +1,163 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# На горячем пути только поиск в dict по кортежу меток и сложение, текст собирается при запросе /metrics.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        registry.append(self)
+
+    def _header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = defaultdict(float)  # кортеж значений меток -> значение
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] += amount
+
+    def set_total(self, value: float, *labels):
+        # для счетчиков, которые уже ведутся в другом месте (пул соединений и т.п.)
+        self.values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self.values.items():
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.values[labels] -= amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._le = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+        self.series = {}  # кортеж значений меток -> [счетчики по корзинам (последняя +Inf), сумма]
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for le, count in zip(self._le, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+registry: list[_Metric] = []
+collectors = []  # async-функции, которые обновляют метрики перед выдачей (длина очереди, пул БД)
+
+
+async def render_metrics() -> str:
+    for collect in collectors:
+        await collect()
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    lines.append('')
+    return '\n'.join(lines)
+
+
+http_request_duration = Histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса', ('method', 'route'))
+http_requests_total = Counter('http_requests_total', 'HTTP-запросы по статусам', ('method', 'route', 'status'))
+websocket_connections = Gauge('websocket_connections', 'Открытые вебсокеты', ('route',))
+websocket_connections_total = Counter('websocket_connections_total', 'Всего подключений по вебсокету', ('route',))
+
+
+def _route_label(scope) -> str:
+    route = scope.get('route')
+    return route.path if route is not None else 'unmatched'  # сырой путь раздул бы число серий
+
+
+class MetricsMiddleware:
+    """ASGI-мидлварь: время и статусы HTTP-запросов, число открытых вебсокетов по маршрутам."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            return await self._websocket(scope, receive, send)
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = _route_label(scope)
+            http_request_duration.observe(time.perf_counter() - started, scope['method'], route)
+            http_requests_total.inc(scope['method'], route, status_code)
+
+    async def _websocket(self, scope, receive, send):
+        route = None
+
+        # маршрут известен только после роутинга: считаем соединение при первом receive (accept)
+        async def receive_with_route():
+            nonlocal route
+            if route is None:
+                route = _route_label(scope)
+                websocket_connections.inc(route)
+                websocket_connections_total.inc(route)
+            return await receive()
+
+        try:
+            await self.app(scope, receive_with_route, send)
+        finally:
+            if route is not None:
+                websocket_connections.dec(route)
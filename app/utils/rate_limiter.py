@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict, deque
+
+
+class _KeyState:
+    __slots__ = ('times', 'blocked_until')
+
+    def __init__(self):
+        self.times = deque()
+        self.blocked_until = 0.0
+
+
+class SlidingWindowLimiter:
+    """
+    Ограничение частоты по ключу в памяти процесса: не больше limit событий за window секунд.
+
+    Если задан cooldown, то набранный лимит сразу блокирует ключ на cooldown секунд,
+    иначе лишние события просто отклоняются, пока старые не выйдут из окна.
+    Отклоненные события не записываются. Ключей не больше maxsize, давно не использованные вытесняются.
+    """
+
+    def __init__(self, limit: int, window: float, cooldown: float | None = None, maxsize: int = 100_000):
+        self.limit = limit
+        self.window = window
+        self.cooldown = cooldown
+        self.maxsize = maxsize
+        self._state = OrderedDict()  # key -> _KeyState
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+    def hit(self, key, now: float | None = None) -> float:
+        """Записывает событие. Возвращает 0, если оно разрешено, иначе сколько секунд ждать."""
+        if now is None:
+            now = time.monotonic()
+
+        state = self._state.get(key)
+        if state is None:
+            state = _KeyState()
+            self._state[key] = state
+            if len(self._state) > self.maxsize:
+                self._state.popitem(last=False)
+        else:
+            self._state.move_to_end(key)
+
+        if state.blocked_until > now:
+            return state.blocked_until - now
+
+        times = state.times
+        while times and now - times[0] > self.window:
+            times.popleft()
+
+        if len(times) >= self.limit:
+            return self.window - (now - times[0])
+
+        times.append(now)
+        if self.cooldown is not None and len(times) >= self.limit:
+            state.blocked_until = now + self.cooldown
+            times.clear()
+        return 0.0
+
+    def reset(self, key):
+        self._state.pop(key, None)
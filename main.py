@@ -10,10 +10,20 @@ from app.api.profile import router as profile_router
 from app.api.leaderboard import router as leaderboard_router
 from app.api.admin import router as admin_router
 from app.api.constants import router as constants_router
+from app.api.metrics import router as metrics_router
 
 import os
 from app.core.database import new_session
 from app.core.init_db import create_first_superuser
+from app.services.task_pool import task_pool
+from app.services.leaderboard import leaderboard
+from app.services.generated_task_pool import generated_task_pool
+from app.services.ai_service import start_ai_client, stop_ai_client
+from app.services.avatar_service import shutdown_avatar_pool
+from app.core.pool_watchdog import pool_watchdog, RouteContextMiddleware
+from app.core.sql_profiler import SqlProfilerMiddleware
+from app.utils.metrics import MetricsMiddleware
+from app.core.config import settings
 
 
 @asynccontextmanager
@@ -22,9 +32,19 @@ async def lifespan(app: FastAPI):
     async with new_session() as session:
         await create_first_superuser(session)
 
+    await task_pool.refresh()
+    await leaderboard.refresh()
+    start_ai_client()
+    generated_task_pool.start()
+    pool_watchdog.start()
+
     print("База данных управляется через Alembic")
     yield
     print('Выключение сервера')
+    await pool_watchdog.stop()
+    await generated_task_pool.stop()
+    await stop_ai_client()
+    shutdown_avatar_pool()
 
 IS_PROD = os.getenv('VITE_IS_PROD') == 'true'
 app=FastAPI(title='Платформа для подготовки к олимпиадам',
@@ -56,8 +76,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Server-Timing"],
 )
 
+if settings.SQL_PROFILING:
+    app.add_middleware(SqlProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
+app.add_middleware(RouteContextMiddleware)
+
 
 app.include_router(auth_router)
 app.include_router(tasks_router)
@@ -66,6 +94,7 @@ app.include_router(profile_router)
 app.include_router(leaderboard_router)
 app.include_router(admin_router)
 app.include_router(constants_router)
+app.include_router(metrics_router)
 
 
 @app.get('/',tags=['Система'])
@@ -0,0 +1,28 @@
+"""add users rating active index
+
+Revision ID: 0a7d3e9c5f14
+Revises: f2c84d6e1b37
+Create Date: 2026-10-18 16:40:52.207735
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a7d3e9c5f14'
+down_revision: Union[str, Sequence[str], None] = 'f2c84d6e1b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_users_rating_active', 'users', [sa.text('rating DESC')], unique=False, postgresql_where=sa.text('NOT is_banned'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_rating_active', table_name='users', postgresql_where=sa.text('NOT is_banned'))
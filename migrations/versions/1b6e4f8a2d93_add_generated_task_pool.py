@@ -0,0 +1,42 @@
+"""add generated task pool
+
+Revision ID: 1b6e4f8a2d93
+Revises: 0a7d3e9c5f14
+Create Date: 2026-10-18 17:34:16.871250
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b6e4f8a2d93'
+down_revision: Union[str, Sequence[str], None] = '0a7d3e9c5f14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('generated_task_pool',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.Enum('ENGLISH', 'PYTHON', 'MATH', 'INF', 'RUSS', 'PHYS', name='subject', native_enum=False), nullable=False),
+    sa.Column('difficulty', sa.Enum('EASY', 'MEDIUM', 'HARD', name='difficultylevel', native_enum=False), nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('description', sa.Text(), nullable=False),
+    sa.Column('correct_answer', sa.String(), nullable=False),
+    sa.Column('tags', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('hint', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generated_task_pool_subject_difficulty', 'generated_task_pool', ['subject', 'difficulty', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_generated_task_pool_subject_difficulty', table_name='generated_task_pool')
+    op.drop_table('generated_task_pool')
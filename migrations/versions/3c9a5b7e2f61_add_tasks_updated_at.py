@@ -0,0 +1,30 @@
+"""add tasks updated_at
+
+Revision ID: 3c9a5b7e2f61
+Revises: 1b6e4f8a2d93
+Create Date: 2026-10-18 18:52:38.440196
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9a5b7e2f61'
+down_revision: Union[str, Sequence[str], None] = '1b6e4f8a2d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.create_index(op.f('ix_tasks_updated_at'), 'tasks', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_tasks_updated_at'), table_name='tasks')
+    op.drop_column('tasks', 'updated_at')
@@ -0,0 +1,41 @@
+"""add tasks title active unique index
+
+Revision ID: 5d2b8e4a7c19
+Revises: 3c9a5b7e2f61
+Create Date: 2026-10-18 19:41:07.815362
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2b8e4a7c19'
+down_revision: Union[str, Sequence[str], None] = '3c9a5b7e2f61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # из активных дублей по названию оставляем самую новую задачу, остальные скрываем
+    hidden = op.get_bind().execute(sa.text("""
+        UPDATE tasks SET is_active = false
+        WHERE is_active AND id NOT IN (
+            SELECT max(id) FROM tasks WHERE is_active GROUP BY title
+        )
+        RETURNING id, title
+    """)).all()
+    # какие задачи скрыты, видно в выводе alembic upgrade: вернуть можно UPDATE tasks SET is_active = true
+    for task_id, title in sorted(hidden):
+        print(f"5d2b8e4a7c19: задача {task_id} скрыта (is_active = false), дубль названия '{title}'")
+    if hidden:
+        print(f"5d2b8e4a7c19: всего скрыто дублей: {len(hidden)}")
+    op.create_index('ix_tasks_title_active', 'tasks', ['title'], unique=True, postgresql_where=sa.text('is_active'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tasks_title_active', table_name='tasks', postgresql_where=sa.text('is_active'))
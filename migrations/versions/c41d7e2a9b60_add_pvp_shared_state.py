@@ -0,0 +1,52 @@
+"""add pvp shared state
+
+Revision ID: c41d7e2a9b60
+Revises: b8f3e6c81071
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7e2a9b60'
+down_revision: Union[str, Sequence[str], None] = 'b8f3e6c81071'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('pvp_queue',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('rating', sa.Float(), nullable=False),
+    sa.Column('joined_at', sa.Float(precision=53), nullable=False),
+    sa.Column('worker_id', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_pvp_queue_rating_joined', 'pvp_queue', ['rating', 'joined_at', 'user_id'], unique=False)
+    op.create_table('pvp_in_match',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('host_worker_id', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index(op.f('ix_pvp_in_match_host_worker_id'), 'pvp_in_match', ['host_worker_id'], unique=False)
+    op.create_table('pvp_workers',
+    sa.Column('worker_id', sa.String(), nullable=False),
+    sa.Column('seen_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('worker_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('pvp_workers')
+    op.drop_index(op.f('ix_pvp_in_match_host_worker_id'), table_name='pvp_in_match')
+    op.drop_table('pvp_in_match')
+    op.drop_index('ix_pvp_queue_rating_joined', table_name='pvp_queue')
+    op.drop_table('pvp_queue')
@@ -0,0 +1,72 @@
+"""add user task progress
+
+Revision ID: e5b19f3c7a02
+Revises: c41d7e2a9b60
+Create Date: 2026-10-18 14:03:27.114862
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b19f3c7a02'
+down_revision: Union[str, Sequence[str], None] = 'c41d7e2a9b60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_task_progress',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('task_id', sa.Integer(), nullable=False),
+    sa.Column('attempts_before_success', sa.Integer(), nullable=False),
+    sa.Column('first_correct_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('best_time', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['task_id'], ['tasks.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'task_id')
+    )
+    op.add_column('users', sa.Column('solved_tasks_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('attempts_until_solved_count', sa.Integer(), server_default='0', nullable=False))
+
+    # заполняем по существующей истории попыток
+    op.execute("""
+        INSERT INTO user_task_progress (user_id, task_id, attempts_before_success, first_correct_at, best_time)
+        SELECT a.user_id,
+               a.task_id,
+               count(*) FILTER (WHERE f.first_correct_at IS NULL OR a.created_at < f.first_correct_at),
+               f.first_correct_at,
+               min(a.time_spent) FILTER (WHERE a.is_correct)
+        FROM attempts a
+        LEFT JOIN (
+            SELECT user_id, task_id, min(created_at) AS first_correct_at
+            FROM attempts
+            WHERE is_correct
+            GROUP BY user_id, task_id
+        ) f ON f.user_id = a.user_id AND f.task_id = a.task_id
+        GROUP BY a.user_id, a.task_id, f.first_correct_at
+    """)
+    op.execute("""
+        UPDATE users u
+        SET solved_tasks_count = s.solved,
+            attempts_until_solved_count = s.counted
+        FROM (
+            SELECT user_id,
+                   count(first_correct_at) AS solved,
+                   sum(attempts_before_success + (first_correct_at IS NOT NULL)::int) AS counted
+            FROM user_task_progress
+            GROUP BY user_id
+        ) s
+        WHERE u.id = s.user_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'attempts_until_solved_count')
+    op.drop_column('users', 'solved_tasks_count')
+    op.drop_table('user_task_progress')
@@ -0,0 +1,55 @@
+"""add user subject stats
+
+Revision ID: f2c84d6e1b37
+Revises: e5b19f3c7a02
+Create Date: 2026-10-18 15:21:09.630417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c84d6e1b37'
+down_revision: Union[str, Sequence[str], None] = 'e5b19f3c7a02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_subject_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.Enum('ENGLISH', 'PYTHON', 'MATH', 'INF', 'RUSS', 'PHYS', name='subject', native_enum=False), nullable=False),
+    sa.Column('attempts_count', sa.Integer(), nullable=False),
+    sa.Column('solved_count', sa.Integer(), nullable=False),
+    sa.Column('solve_time_total', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'subject')
+    )
+
+    # заполняем по существующей истории попыток
+    op.execute("""
+        INSERT INTO user_subject_stats (user_id, subject, attempts_count, solved_count, solve_time_total)
+        SELECT a.user_id,
+               t.subject,
+               count(*) FILTER (WHERE f.first_correct_at IS NULL OR a.created_at <= f.first_correct_at),
+               count(DISTINCT a.task_id) FILTER (WHERE a.is_correct),
+               coalesce(sum(a.time_spent) FILTER (WHERE a.is_correct AND a.created_at = f.first_correct_at), 0)
+        FROM attempts a
+        JOIN tasks t ON t.id = a.task_id
+        LEFT JOIN (
+            SELECT user_id, task_id, min(created_at) AS first_correct_at
+            FROM attempts
+            WHERE is_correct
+            GROUP BY user_id, task_id
+        ) f ON f.user_id = a.user_id AND f.task_id = a.task_id
+        GROUP BY a.user_id, t.subject
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_subject_stats')
@@ -0,0 +1,128 @@
+"""
+Очередь PvP: прежний отсортированный список (bisect + list.insert/list.remove + пересборка в match_players)
+против MatchmakingQueue (skip-list) на 1k/10k/100k игроков в поиске.
+
+python tests/benchmarks/bench_matchmaking_queue.py [размер ...]
+
+Меряется то, что выполняется под локом очереди: вставка, выход из поиска и один проход подбора пар.
+"""
+import bisect
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import conftest  # noqa: F401 - переменные окружения для Settings
+from app.schemas.matchmaking import QueueEntry
+from app.utils.matchmaking_queue import MatchmakingQueue
+
+CHURN_OPS = 200
+
+
+class SortedListQueue:
+    """Прежняя очередь из app/api/pvp.py: список, отсортированный по (rating, joined_at), и индекс user_id."""
+
+    def __init__(self):
+        self.queue = []
+        self.index = {}
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def __iter__(self):
+        return iter(self.queue)
+
+    def add(self, entry):
+        old = self.index.get(entry.user_id)
+        if old is not None:
+            self.queue.remove(old)
+            del self.index[old.user_id]
+        idx = bisect.bisect_left(self.queue, entry)
+        self.queue.insert(idx, entry)
+        self.index[entry.user_id] = entry
+
+    def remove(self, entry) -> bool:
+        if entry.user_id not in self.index:
+            return False
+        self.queue.remove(entry)
+        del self.index[entry.user_id]
+        return True
+
+    def pair_adjacent(self, can_pair) -> list[tuple]:
+        # как match_players: проход по соседям с пересборкой очереди и индекса
+        pairs = []
+        newqueue = []
+        newindex = {}
+        queue = self.queue
+        length = len(queue)
+        i = 0
+        while i < length - 1:
+            p1 = queue[i]
+            p2 = queue[i + 1]
+            if can_pair(p1, p2):
+                pairs.append((p1, p2))
+                i += 2
+            else:
+                newqueue.append(p1)
+                newindex[p1.user_id] = p1
+                i += 1
+        if i == length - 1:
+            newqueue.append(queue[i])
+            newindex[queue[i].user_id] = queue[i]
+        self.queue = newqueue
+        self.index = newindex
+        return pairs
+
+
+def make_entries(n: int, seed: int = 1) -> list[QueueEntry]:
+    rnd = random.Random(seed)
+    now = time.time()
+    return [QueueEntry(rating=rnd.gauss(1000, 300), joined_at=now - rnd.random() * 30, user_id=i) for i in range(n)]
+
+
+def bench(queue_cls, n: int) -> dict:
+    entries = make_entries(n)
+    queue = queue_cls()
+
+    started = time.perf_counter()
+    for entry in entries:
+        queue.add(entry)
+    fill = time.perf_counter() - started
+
+    # выход из поиска и новый игрок - как при реальной смене состава очереди
+    rnd = random.Random(2)
+    leaving = rnd.sample(entries, CHURN_OPS)
+    joining = make_entries(CHURN_OPS, seed=3)
+    for i, entry in enumerate(joining):
+        entry.user_id = n + i
+    started = time.perf_counter()
+    for old, new in zip(leaving, joining):
+        queue.remove(old)
+        queue.add(new)
+    churn = time.perf_counter() - started
+
+    # проход подбора, когда почти никто не подходит (узкое окно): вся очередь остается на месте
+    started = time.perf_counter()
+    queue.pair_adjacent(lambda p1, p2: abs(p1.rating - p2.rating) < 0.001)
+    match_pass = time.perf_counter() - started
+
+    return {
+        'insert_us': fill / n * 1e6,
+        'remove_add_us': churn / CHURN_OPS * 1e6,
+        'match_pass_ms': match_pass * 1000,
+    }
+
+
+def main(sizes: list[int]):
+    print(f'{"n":>7} {"очередь":<16} {"вставка, мкс":>13} {"выход+вход, мкс":>16} {"проход подбора, мс":>19}')
+    for n in sizes:
+        for name, queue_cls in (('список (было)', SortedListQueue), ('skip-list', MatchmakingQueue)):
+            r = bench(queue_cls, n)
+            print(f'{n:>7} {name:<16} {r["insert_us"]:>13.1f} {r["remove_add_us"]:>16.1f} {r["match_pass_ms"]:>19.1f}')
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000])
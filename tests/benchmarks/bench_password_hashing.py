@@ -0,0 +1,70 @@
+"""
+Задержка event loop во время пачки логинов: argon2 прямо в корутине (как было) и через пул потоков.
+
+python tests/benchmarks/bench_password_hashing.py [логинов]
+
+Пока идут логины, тикер каждую 1 мс засыпает на asyncio.sleep и меряет, насколько позже он проснулся.
+Это та задержка, которую в это время видят все вебсокеты PvP. Когда loop заблокирован, тиков почти нет,
+поэтому смотреть стоит на max и долю времени, которую loop простоял.
+"""
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import conftest  # noqa: F401 - переменные окружения для Settings
+from app.core.config import settings
+from app.core.security import get_password_hash, is_password_correct, is_password_correct_async
+
+TICK = 0.001
+
+
+async def measure_lag(logins: int, verify) -> tuple[list[float], float]:
+    stop = asyncio.Event()
+    lags = []
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    hashed = get_password_hash('password')
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)  # тикер уже работает, когда приходят логины
+
+    started = time.perf_counter()
+    await asyncio.gather(*[verify('password', hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker_task
+    return lags, elapsed
+
+
+async def verify_inline(password: str, hashed: str) -> bool:
+    return is_password_correct(password, hashed)  # так было в /auth/login до пула
+
+
+def report(name: str, lags: list[float], elapsed: float):
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1] if len(lags_ms) > 1 else lags_ms[-1]
+    print(
+        f'{name:<22} логины за {elapsed * 1000:7.0f} мс | тиков {len(lags_ms):5} | '
+        f'задержка loop p50 {statistics.median(lags_ms):7.2f} мс, p99 {p99:7.2f} мс, max {lags_ms[-1]:7.2f} мс | '
+        f'loop стоял {sum(lags_ms) / 1000 / elapsed:4.0%} времени'
+    )
+
+
+async def main(logins: int):
+    print(f'{logins} одновременных логинов, PASSWORD_HASH_WORKERS={settings.PASSWORD_HASH_WORKERS}')
+    report('в event loop (до)', *await measure_lag(logins, verify_inline))
+    report('пул потоков (после)', *await measure_lag(logins, is_password_correct_async))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 30))
@@ -0,0 +1,96 @@
+"""
+Локальный фейковый Groq API для тестов и ручной проверки генерации без ключей и сети.
+
+python tests/fake_groq.py [порт]   (затем GROQ_BASE_URL=http://localhost:<порт>, любой GROQ_API_KEY_1)
+
+Отвечает на POST /openai/v1/chat/completions валидной задачей по предмету и сложности из промпта.
+Модели из rate_limited_models получают 429 с retry-after, как настоящий API при исчерпании лимита.
+"""
+import json
+import re
+import socket
+import sys
+import threading
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+PROMPT_RE = re.compile(r'по предмету (\w+) со сложностью (\w+)')
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    app.state.requests = []  # (model, subject, difficulty) каждого запроса
+    app.state.rate_limited_models = set()
+
+    @app.post('/openai/v1/chat/completions')
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body['model']
+        match = PROMPT_RE.search(body['messages'][-1]['content'])
+        subject, difficulty = match.groups() if match else ('MATH', 'EASY')
+        app.state.requests.append((model, subject, difficulty))
+
+        if model in app.state.rate_limited_models:
+            return JSONResponse(
+                status_code=429,
+                headers={'retry-after': '30'},
+                content={'error': {'message': 'Rate limit reached', 'type': 'tokens', 'code': 'rate_limit_exceeded'}},
+            )
+
+        number = len(app.state.requests)
+        task = {
+            'title': f'Задача {number}',
+            'description': f'Сколько будет {number} + {number}?',
+            'correct_answer': str(number * 2),
+            'subject': subject,
+            'difficulty': difficulty,
+            'tags': [],
+            'hint': 'Сложите два числа',
+        }
+        return {
+            'id': f'chatcmpl-{number}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': json.dumps(task, ensure_ascii=False)},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        }
+
+    return app
+
+
+class FakeGroqServer:
+    """Фейковый сервер в фоновом потоке: with FakeGroqServer() as server: ... server.url, server.app.state."""
+
+    def __init__(self, port: int | None = None):
+        if port is None:
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        self.app = create_app()
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host='127.0.0.1', port=port, log_level='warning'))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError('фейковый Groq не запустился')
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+if __name__ == '__main__':
+    uvicorn.run(create_app(), host='127.0.0.1', port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081)
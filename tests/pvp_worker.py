@@ -0,0 +1,90 @@
+"""
+Отдельный процесс-воркер для test_pvp_postgres_backend: PostgresPvpBackend с одним игроком в очереди.
+
+python tests/pvp_worker.py <dsn> <user_id> <rating> <joined_at>
+
+Крутит матчмейкер, пока пара не найдена. Воркер, получивший матч, отправляет сопернику
+'match started' и ждет ответа, второй отвечает '42' через свой сокет. События пишутся в stdout строками JSON.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import conftest  # noqa: F401 - переменные окружения для Settings
+from app.schemas.matchmaking import QueueEntry
+from app.services.pvp_backend import PostgresPvpBackend
+
+TIMEOUT = 15
+
+
+def report(event: str, **data):
+    print(json.dumps({'event': event, 'pid': os.getpid(), **data}), flush=True)
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = asyncio.Queue()
+        self.incoming = asyncio.Queue()
+
+    async def send_text(self, text: str):
+        self.sent.put_nowait(text)
+
+    async def receive_text(self) -> str:
+        return await self.incoming.get()
+
+    async def close(self):
+        pass
+
+
+async def main(dsn: str, user_id: int, rating: float, joined_at: float):
+    backend = PostgresPvpBackend(dsn)
+    matches = []
+    await backend.start(
+        on_match=lambda p1, p2, now: matches.append((p1, p2)),
+        on_wakeup=lambda: None,
+        on_reconnect=lambda uid, ws: False,
+        on_release=lambda uid: None,
+    )
+    try:
+        ws = FakeSocket()
+        entry = QueueEntry(rating=rating, joined_at=joined_at, user_id=user_id)
+        entry._ws = ws
+        await backend.add_player(entry)
+        report('queued', worker=backend.worker_id, user=user_id)
+
+        deadline = time.monotonic() + TIMEOUT
+        while not matches and ws.sent.empty():
+            if time.monotonic() > deadline:
+                raise TimeoutError('пара не найдена')
+            await backend.match_players()
+            await asyncio.sleep(0.05)
+
+        if matches:
+            p1, p2 = matches[0]
+            report('host', worker=backend.worker_id, users=[p1.user_id, p2.user_id])
+            remote = p2._ws if p1._ws is ws else p1._ws
+            await remote.send_text('match started')
+            answer = await asyncio.wait_for(remote.receive_text(), TIMEOUT)
+            report('host_received', text=answer)
+            await backend.finish_match(p1.user_id, p2.user_id)
+        else:
+            text = await ws.sent.get()
+            report('player_received', worker=backend.worker_id, text=text)
+            ws.incoming.put_nowait('42')
+            while await backend.is_in_match(user_id):  # матч завершает воркер-хозяин
+                if time.monotonic() > deadline:
+                    raise TimeoutError('матч не завершился')
+                await asyncio.sleep(0.05)
+        report('done')
+    finally:
+        await backend.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4])))
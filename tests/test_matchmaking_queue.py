@@ -0,0 +1,58 @@
+"""MatchmakingQueue ведет себя как прежний отсортированный список: тот же порядок и те же пары."""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'benchmarks'))
+
+from app.schemas.matchmaking import QueueEntry
+from app.utils.matchmaking_queue import MatchmakingQueue
+from bench_matchmaking_queue import SortedListQueue
+
+
+def test_same_order_and_pairs_as_sorted_list():
+    rnd = random.Random(7)
+    now = time.time()
+    skip_list, sorted_list = MatchmakingQueue(), SortedListQueue()
+    current = {}  # user_id -> запись, которая сейчас в очереди
+
+    for step in range(5000):
+        op = rnd.random()
+        if op < 0.6 or not current:
+            # новый игрок или переподключение: старая запись пользователя заменяется
+            entry = QueueEntry(rating=rnd.gauss(1000, 200), joined_at=now - rnd.random() * 20, user_id=rnd.randrange(800))
+            skip_list.add(entry)
+            sorted_list.add(entry)
+            current[entry.user_id] = entry
+        elif op < 0.9:
+            entry = current.pop(rnd.choice(list(current)))
+            assert skip_list.remove(entry) and sorted_list.remove(entry)
+        else:
+            window = rnd.choice([1, 5, 50])
+            can_pair = lambda p1, p2: abs(p1.rating - p2.rating) < window
+            pairs = skip_list.pair_adjacent(can_pair)
+            assert [(p1.user_id, p2.user_id) for p1, p2 in pairs] == \
+                   [(p1.user_id, p2.user_id) for p1, p2 in sorted_list.pair_adjacent(can_pair)]
+            for p1, p2 in pairs:
+                del current[p1.user_id], current[p2.user_id]
+
+        assert [e.user_id for e in skip_list] == [e.user_id for e in sorted_list]
+        assert len(skip_list) == len(current)
+
+
+def test_neighbours_and_stale_remove():
+    queue = MatchmakingQueue()
+    low, mid, high = (QueueEntry(rating=r, joined_at=0, user_id=i) for i, r in enumerate((900, 1000, 1100)))
+    for entry in (high, low, mid):
+        queue.add(entry)
+
+    assert queue.neighbours(mid.user_id) == (low, high)
+    assert queue.neighbours(low.user_id) == (None, mid)
+
+    # после переподключения старая запись уже не в очереди и не удаляет новую
+    reconnected = QueueEntry(rating=1000, joined_at=5, user_id=mid.user_id)
+    queue.add(reconnected)
+    assert not queue.remove(mid)
+    assert queue.get(mid.user_id) is reconnected
+    assert queue.remove(reconnected) and mid.user_id not in queue